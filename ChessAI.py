@@ -0,0 +1,546 @@
+'''
+A pure python chess AI that searches ChessEngine.GameState directly, so the lower difficulty levels don't need the
+Stockfish process. It has the same functions as ChickenStock (newGame, addMove and getAIMove) so ChessMain can use
+either one.
+
+The search is iterative deepening negamax with alpha-beta pruning, a transposition table, quiescence search on
+captures and move ordering by the hash move, MVV-LVA (most valuable victim, least valuable attacker), killer moves
+and the history heuristic. It stops on a time or node budget and plays the best move of the last finished depth.
+'''
+import random
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import ChessBook
+import ChessEngine
+import ChessHash
+import ChessLimits
+import ChessProfile
+
+PIECE_VALUES = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+MATE_SCORE = 100000
+MATE_BOUND = MATE_SCORE - 1000 # scores above this are mates
+
+# piece-square tables from white's point of view, row 0 is the 8th rank just like GameState.board
+PIECE_SQUARE_TABLES = {
+  'p': [[0,  0,  0,  0,  0,  0,  0,  0],
+        [50, 50, 50, 50, 50, 50, 50, 50],
+        [10, 10, 20, 30, 30, 20, 10, 10],
+        [5,  5, 10, 25, 25, 10,  5,  5],
+        [0,  0,  0, 20, 20,  0,  0,  0],
+        [5, -5,-10,  0,  0,-10, -5,  5],
+        [5, 10, 10,-20,-20, 10, 10,  5],
+        [0,  0,  0,  0,  0,  0,  0,  0]],
+  'N': [[-50,-40,-30,-30,-30,-30,-40,-50],
+        [-40,-20,  0,  0,  0,  0,-20,-40],
+        [-30,  0, 10, 15, 15, 10,  0,-30],
+        [-30,  5, 15, 20, 20, 15,  5,-30],
+        [-30,  0, 15, 20, 20, 15,  0,-30],
+        [-30,  5, 10, 15, 15, 10,  5,-30],
+        [-40,-20,  0,  5,  5,  0,-20,-40],
+        [-50,-40,-30,-30,-30,-30,-40,-50]],
+  'B': [[-20,-10,-10,-10,-10,-10,-10,-20],
+        [-10,  0,  0,  0,  0,  0,  0,-10],
+        [-10,  0,  5, 10, 10,  5,  0,-10],
+        [-10,  5,  5, 10, 10,  5,  5,-10],
+        [-10,  0, 10, 10, 10, 10,  0,-10],
+        [-10, 10, 10, 10, 10, 10, 10,-10],
+        [-10,  5,  0,  0,  0,  0,  5,-10],
+        [-20,-10,-10,-10,-10,-10,-10,-20]],
+  'R': [[0,  0,  0,  0,  0,  0,  0,  0],
+        [5, 10, 10, 10, 10, 10, 10,  5],
+        [-5,  0,  0,  0,  0,  0,  0, -5],
+        [-5,  0,  0,  0,  0,  0,  0, -5],
+        [-5,  0,  0,  0,  0,  0,  0, -5],
+        [-5,  0,  0,  0,  0,  0,  0, -5],
+        [-5,  0,  0,  0,  0,  0,  0, -5],
+        [0,  0,  0,  5,  5,  0,  0,  0]],
+  'Q': [[-20,-10,-10, -5, -5,-10,-10,-20],
+        [-10,  0,  0,  0,  0,  0,  0,-10],
+        [-10,  0,  5,  5,  5,  5,  0,-10],
+        [-5,  0,  5,  5,  5,  5,  0, -5],
+        [0,  0,  5,  5,  5,  5,  0, -5],
+        [-10,  5,  5,  5,  5,  5,  0,-10],
+        [-10,  0,  5,  0,  0,  0,  0,-10],
+        [-20,-10,-10, -5, -5,-10,-10,-20]],
+  'K': [[-30,-40,-40,-50,-50,-40,-40,-30],
+        [-30,-40,-40,-50,-50,-40,-40,-30],
+        [-30,-40,-40,-50,-50,-40,-40,-30],
+        [-30,-40,-40,-50,-50,-40,-40,-30],
+        [-20,-30,-30,-40,-40,-30,-30,-20],
+        [-10,-20,-20,-20,-20,-20,-20,-10],
+        [20, 20,  0,  0,  0,  0, 20, 20],
+        [20, 30, 10,  0,  0, 10, 30, 20]],
+}
+
+# search settings for each difficulty level: search limits (the movetime is the most a move may take), random noise
+# in centipawns added to the root moves so the weaker levels make mistakes, and how many half moves into the game
+# the opening book is used for
+LEVELS = {
+  1: {'limits': ChessLimits.SearchLimits(depth=1, movetime=500), 'noise': 150, 'bookDepth': 2}, # ~500
+  2: {'limits': ChessLimits.SearchLimits(depth=2, movetime=1000), 'noise': 60, 'bookDepth': 6}, # ~700
+  3: {'limits': ChessLimits.SearchLimits(depth=4, movetime=2000), 'noise': 15, 'bookDepth': 12}, # ~1000
+}
+
+
+defaultTimeManager = ChessLimits.TimeManager()
+
+
+class SearchStopped(Exception): # raised inside the search when the time or node budget runs out
+  pass
+
+
+'''
+Score of the position from the point of view of the player to move, material plus piece-square tables
+'''
+def evaluate(gs):
+  score = 0
+  for piece, locations in gs.pieceLocations.items(): # only the occupied squares
+    pieceType = piece[1]
+    value = PIECE_VALUES[pieceType]
+    table = PIECE_SQUARE_TABLES[pieceType]
+    if piece[0] == 'w':
+      for r, c in locations:
+        score += value + table[r][c]
+    else:
+      for r, c in locations:
+        score -= value + table[7 - r][c]
+  return score if gs.whiteToMove else -score
+
+
+class Search():
+  def __init__(self, hashMB=16):
+    self.table = ChessHash.TranspositionTable(hashMB)
+    self.nodes = 0
+    self.killers = []
+    self.history = {}
+    self.stopEvent = threading.Event() # the running search's, set by stop() from another thread
+
+  '''
+  Search the position and return (best move, score, depth reached). Stops after maxDepth, or when seconds or
+  nodes run out, in which case the result of the last finished depth is used. No new depth is started once
+  softSeconds have mostly gone (a bit later if the best move just changed). onIteration(depth, score, move, nodes)
+  is called after each finished depth. A search started on another thread should be given a stopEvent made before
+  the thread starts, so a stop that comes before the search does isn't lost (set it instead of calling stop())
+  '''
+  @ChessProfile.profiled('ChessAI.findBestMove')
+  def findBestMove(self, gs, maxDepth=64, seconds=None, nodes=None, noise=0, onIteration=None, softSeconds=None,
+                   stopEvent=None):
+    self.stopEvent = stopEvent if stopEvent is not None else threading.Event()
+    self.nodes = 0
+    self.nodeLimit = nodes
+    self.startClock(softSeconds, seconds)
+    self.killers = [[None, None] for _ in range(maxDepth + 1)]
+    self.history = {}
+    self.table.newSearch()
+    self.rootNoise = {}
+    moves = gs.getValidMoves()
+    if len(moves) == 0:
+      return None, 0, 0
+    if noise:
+      self.rootNoise = {move.moveID: random.randint(-noise, noise) for move in moves}
+    bestMove, bestScore, depthReached = moves[0], 0, 0
+    logLength = len(gs.moveLog)
+    for depth in range(1, maxDepth + 1):
+      try:
+        score, move = self.searchRoot(gs, moves, depth)
+      except SearchStopped:
+        while len(gs.moveLog) > logLength: # put the board back to where the search started
+          gs.undoMove()
+        break
+      changed = depthReached > 0 and move.moveID != bestMove.moveID
+      bestMove, bestScore, depthReached = move, score, depth
+      if onIteration is not None:
+        onIteration(depth, score, move, self.nodes)
+      if self.softSeconds is not None:
+        # the next depth takes a few times longer than this one, so don't start it if it can't finish in time
+        if time.perf_counter() - self.clockStart >= self.softSeconds * (0.9 if changed else 0.6):
+          break
+      if abs(score) > MATE_BOUND: # found a forced mate, searching deeper won't change the move
+        break
+      if len(moves) == 1: # only one move, no need to think about it
+        break
+    gs.getValidMoves() # leave checkmate/stalemate set for the root position
+    ChessProfile.count('ChessAI.nodes', self.nodes)
+    return bestMove, bestScore, depthReached
+
+  '''
+  findBestMove with ChessLimits.SearchLimits, the TimeManager decides the soft and hard time for this move
+  '''
+  def searchWithLimits(self, gs, limits, timeManager=None, noise=0, onIteration=None, stopEvent=None):
+    soft, hard = (timeManager or defaultTimeManager).allocate(gs, limits)
+    return self.findBestMove(gs, limits.depth or 64, hard, limits.nodes, noise, onIteration, soft, stopEvent)
+
+  '''
+  Search every root move and return (score, best move). With noise each move's score gets its own random offset, and
+  the move is searched with the window shifted by it, so a move only beats the best one so far on an exact score and
+  never on the bound of a move that was refuted. The score returned and stored is without the noise
+  '''
+  def searchRoot(self, gs, moves, depth):
+    bound = MATE_SCORE + 1 + max(map(abs, self.rootNoise.values()), default=0) # shifted windows still hold every score
+    alpha, beta = -bound, bound
+    bestMove, bestScore = None, alpha
+    for move in self.orderMoves(gs, moves, 0, self.hashMove(gs)):
+      noise = self.rootNoise.get(move.moveID, 0)
+      gs.makeMove(move)
+      score = -self.negamax(gs, depth - 1, -(beta - noise), -(alpha - noise), 1)
+      gs.undoMove()
+      if bestMove is None or score + noise > alpha:
+        alpha = score + noise
+        bestMove, bestScore = move, score
+    self.table.store(gs.zobristKey, depth, bestScore, ChessHash.EXACT, bestMove.moveID)
+    return bestScore, bestMove
+
+  def negamax(self, gs, depth, alpha, beta, ply):
+    self.checkBudget()
+    if gs.repetitionCount() > 0: # treat any repetition as a draw so the search avoids (or aims for) it
+      return 0
+    alphaStart = alpha
+    entry = self.table.probe(gs.zobristKey)
+    if entry is not None and entry[0] >= depth:
+      value = self.fromTable(entry[1], ply)
+      if entry[2] == ChessHash.EXACT:
+        return value
+      elif entry[2] == ChessHash.LOWERBOUND:
+        alpha = max(alpha, value)
+      else:
+        beta = min(beta, value)
+      if alpha >= beta:
+        return value
+    if depth <= 0:
+      return self.quiescence(gs, alpha, beta, ply)
+    self.nodes += 1
+
+    bestScore = -MATE_SCORE - 1
+    bestMove = None
+    for move in self.searchMoves(gs, ply, entry[3] if entry is not None else None):
+      gs.makeMove(move)
+      score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+      gs.undoMove()
+      if score > bestScore:
+        bestScore = score
+        bestMove = move
+      if score > alpha:
+        alpha = score
+      if alpha >= beta: # beta cutoff, remember quiet moves that caused it
+        if move.pieceCaptured == '--':
+          killers = self.killers[ply] if ply < len(self.killers) else None
+          if killers is not None and killers[0] != move.moveID:
+            killers[1] = killers[0]
+            killers[0] = move.moveID
+          historyKey = (move.pieceMoved, move.endRow, move.endCol)
+          self.history[historyKey] = self.history.get(historyKey, 0) + depth * depth
+        break
+
+    if bestMove is None: # no legal moves
+      return -MATE_SCORE + ply if gs.inCheck() else 0
+    if bestScore <= alphaStart:
+      flag = ChessHash.UPPERBOUND
+    elif bestScore >= beta:
+      flag = ChessHash.LOWERBOUND
+    else:
+      flag = ChessHash.EXACT
+    self.table.store(gs.zobristKey, depth, self.toTable(bestScore, ply), flag, bestMove.moveID)
+    return bestScore
+
+  '''
+  Only look at captures (all moves when in check) until the position is quiet, so the search doesn't stop in the
+  middle of an exchange
+  '''
+  def quiescence(self, gs, alpha, beta, ply):
+    self.checkBudget()
+    self.nodes += 1
+    moves = gs.getValidMoves()
+    if len(moves) == 0:
+      return -MATE_SCORE + ply if gs.checkmate else 0
+    inCheck = gs.inCheck()
+    if not inCheck:
+      standPat = evaluate(gs)
+      if standPat >= beta:
+        return standPat
+      if standPat > alpha:
+        alpha = standPat
+      moves = [move for move in moves if move.pieceCaptured != '--' or move.isPawnPromotion]
+    for move in self.orderMoves(gs, moves, ply, None):
+      gs.makeMove(move)
+      score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+      gs.undoMove()
+      if score >= beta:
+        return score
+      if score > alpha:
+        alpha = score
+    return alpha
+
+  '''
+  Sort moves so the best ones are searched first: hash move, captures by MVV-LVA, promotions, killers, then by history
+  '''
+  def orderMoves(self, gs, moves, ply, hashMove):
+    killers = self.killers[ply] if ply < len(self.killers) else (None, None)
+    def moveScore(move):
+      if move.moveID == hashMove:
+        return 1000000
+      score = 0
+      if move.pieceCaptured != '--':
+        score += 100000 + 10 * PIECE_VALUES[move.pieceCaptured[1]] - PIECE_VALUES[move.pieceMoved[1]] // 10
+      elif move.moveID == killers[0]:
+        score += 90000
+      elif move.moveID == killers[1]:
+        score += 80000
+      else:
+        score += self.history.get((move.pieceMoved, move.endRow, move.endCol), 0)
+      if move.isPawnPromotion:
+        score += 95000
+      return score
+    return sorted(moves, key=moveScore, reverse=True)
+
+  '''
+  The moves for negamax: the hash move straight from the staged generator, and only if it doesn't cut off are the
+  rest generated and sorted with orderMoves
+  '''
+  def searchMoves(self, gs, ply, hashMove):
+    moves = gs.generateMoves(hashMove)
+    first = next(moves, None)
+    if first is None:
+      return
+    if first.moveID == hashMove:
+      yield first
+      yield from self.orderMoves(gs, list(moves), ply, None)
+    else:
+      yield from self.orderMoves(gs, [first] + list(moves), ply, None)
+
+  def hashMove(self, gs):
+    entry = self.table.probe(gs.zobristKey)
+    return entry[3] if entry is not None else None
+
+  '''
+  Give the search soft and hard seconds (None for no limit) from now on. findBestMove starts with its own, a
+  ponder search gets them from another thread at ponderhit
+  '''
+  def startClock(self, softSeconds, seconds):
+    self.clockStart = time.perf_counter()
+    self.softSeconds = softSeconds
+    self.deadline = self.clockStart + seconds if seconds is not None else None
+
+  '''
+  Make a running findBestMove finish (with the last finished depth) as soon as possible, safe to call from another thread
+  '''
+  def stop(self):
+    self.stopEvent.set()
+
+  def checkBudget(self):
+    if self.stopEvent.is_set():
+      raise SearchStopped()
+    if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+      raise SearchStopped()
+    if self.deadline is not None and self.nodes & 255 == 0 and time.perf_counter() >= self.deadline:
+      raise SearchStopped()
+
+  # mate scores are stored relative to the position so they stay right when found again at another ply
+  def toTable(self, score, ply):
+    if score > MATE_BOUND:
+      return score + ply
+    if score < -MATE_BOUND:
+      return score - ply
+    return score
+
+  def fromTable(self, score, ply):
+    if score > MATE_BOUND:
+      return score - ply
+    if score < -MATE_BOUND:
+      return score + ply
+    return score
+
+
+'''
+Functions for using the AI the same way as ChickenStock. It follows the game on its own GameState
+'''
+gameState = ChessEngine.GameState()
+searcher = Search()
+settings = dict(LEVELS[3])
+executor = ThreadPoolExecutor(max_workers=1) # runs the search in the background for startAIMove
+thinking = None # future of the search startAIMove started
+thinkingSince = 0.0
+thinkingStop = threading.Event() # stops that search, see stopThinking
+searchSeconds = [0.0, 0] # total time and number of searches, the average is what a book move saves
+
+
+def setLevel(level):
+  settings.clear()
+  settings.update(LEVELS[level])
+
+
+def newGame():
+  global gameState
+  stopThinking()
+  gameState = ChessEngine.GameState()
+  searcher.table.clear()
+
+
+def addMove(move):
+  for validMove in gameState.getValidMoves():
+    if validMove.getChessNotation() == move:
+      gameState.makeMove(validMove)
+      return
+  raise ValueError("Illegal move for ChessAI: " + move)
+
+
+'''
+A move from the opening book (see ChessBook) while the game is shorter than the level's bookDepth, or None
+'''
+def bookMove():
+  book = ChessBook.openBook()
+  if book is None:
+    return None
+  averageSeconds = searchSeconds[0] / searchSeconds[1] if searchSeconds[1] else settings['limits'].movetime / 1000
+  return book.bookMove(gameState, gameState.getValidMoves(), settings['bookDepth'], searchSeconds=averageSeconds)
+
+
+@ChessProfile.profiled('ChessAI.getAIMove')
+def getAIMove(validMoves):
+  move = bookMove()
+  if move is None:
+    start = time.perf_counter()
+    move = searcher.searchWithLimits(gameState, settings['limits'], noise=settings['noise'])[0]
+    searchSeconds[0] += time.perf_counter() - start
+    searchSeconds[1] += 1
+  addMove(move.getChessNotation())
+  for temp_move in validMoves:
+    if temp_move.getChessNotation() == move.getChessNotation():
+      return temp_move
+
+
+'''
+Start looking for a move on a background thread so the window keeps responding. Returns a future, poll done() and
+then pass it to finishAIMove
+'''
+def startAIMove():
+  global thinking, thinkingSince, thinkingStop
+  move = bookMove()
+  if move is not None: # no need to search, hand back a future that is already done
+    book = Future()
+    book.set_result((move, 0, 0))
+    return book
+  thinkingSince = time.perf_counter()
+  thinkingStop = threading.Event()
+  thinking = executor.submit(searcher.searchWithLimits, gameState, settings['limits'], noise=settings['noise'],
+                             stopEvent=thinkingStop)
+  return thinking
+
+
+def finishAIMove(future, validMoves):
+  global thinking
+  if future is thinking:
+    searchSeconds[0] += time.perf_counter() - thinkingSince
+    searchSeconds[1] += 1
+    ChessProfile.record('ChessAI.search', time.perf_counter() - thinkingSince, thinkingSince) # start to finish
+    thinking = None
+  notation = future.result()[0].getChessNotation()
+  addMove(notation)
+  for temp_move in validMoves:
+    if temp_move.getChessNotation() == notation:
+      return temp_move
+
+
+def stopThinking(): # stop a search from startAIMove and wait for it to finish
+  global thinking
+  if thinking is not None:
+    thinkingStop.set() # works even if the search hasn't started yet
+    thinking.result()
+    thinking = None
+
+
+'''
+A small UCI engine on stdin/stdout (python ChessAI.py), enough to stand in for Stockfish when testing ChessUCI:
+uci, isready, setoption (Hash, Threads), ucinewgame, position, go (depth, nodes, movetime, wtime/btime, infinite,
+ponder), stop, ponderhit and quit. Each search starts with an info string of the hash and threads it was given
+'''
+def uciMain():
+  global gameState
+  outputLock = threading.Lock()
+  def send(line):
+    with outputLock:
+      sys.stdout.write(line + '\n')
+      sys.stdout.flush()
+
+  searchThread = None
+  waitingForStop = threading.Event() # set when an infinite or ponder search may give its bestmove
+  stopEvent = threading.Event() # stops the current search, made by go before its thread starts
+  ponderClock = None # (soft, hard) seconds the ponder search gets once ponderhit starts its clock
+  threads = 1 # only remembered and reported, the search runs on one thread
+  def search(gs, limits, hold, stopEvent):
+    def onIteration(depth, score, move, nodes):
+      score = 'mate ' + str((MATE_SCORE - abs(score) + 1) // 2 * (1 if score > 0 else -1)) if abs(score) > MATE_BOUND else 'cp ' + str(score)
+      send('info depth %d score %s nodes %d pv %s' % (depth, score, nodes, move.getChessNotation()))
+    send('info string hash %d threads %d' % (searcher.table.sizeMB, threads))
+    move = searcher.searchWithLimits(gs, limits, onIteration=onIteration, stopEvent=stopEvent)[0]
+    if hold: # infinite and ponder searches only answer after stop or ponderhit
+      waitingForStop.wait()
+    if move is None:
+      send('bestmove (none)')
+      return
+    ponder = ''
+    gs.makeMove(move)
+    hashMove = searcher.hashMove(gs)
+    for reply in gs.getValidMoves():
+      if reply.moveID == hashMove:
+        ponder = ' ponder ' + reply.getChessNotation()
+    gs.undoMove()
+    send('bestmove ' + move.getChessNotation() + ponder)
+
+  for line in sys.stdin:
+    tokens = line.split()
+    if not tokens:
+      continue
+    command = tokens[0]
+    if command == 'uci':
+      send('id name ChessAI')
+      send('option name Hash type spin default 16 min 1 max 1024')
+      send('option name Threads type spin default 1 min 1 max 512')
+      send('uciok')
+    elif command == 'isready':
+      send('readyok')
+    elif command == 'setoption' and len(tokens) >= 5 and tokens[2].lower() == 'hash':
+      searcher.table.resize(int(tokens[4]))
+    elif command == 'setoption' and len(tokens) >= 5 and tokens[2].lower() == 'threads':
+      threads = int(tokens[4])
+    elif command == 'ucinewgame':
+      searcher.table.clear()
+    elif command == 'position':
+      if 'moves' in tokens:
+        movesIndex = tokens.index('moves')
+      else:
+        movesIndex = len(tokens)
+      if tokens[1] == 'fen':
+        gameState = ChessEngine.GameState.fromFEN(' '.join(tokens[2:movesIndex]))
+      else:
+        gameState = ChessEngine.GameState()
+      for move in tokens[movesIndex + 1:]:
+        addMove(move)
+    elif command == 'go':
+      limits = ChessLimits.SearchLimits.fromGo(tokens)
+      hold = limits.infinite or 'ponder' in tokens
+      ponderClock = None
+      if 'ponder' in tokens: # the clock only starts at ponderhit, so ponder until told otherwise
+        ponderClock = defaultTimeManager.allocate(gameState, limits) # worked out now, the search thread owns gameState
+        limits = limits.copy(movetime=None, wtime=None, btime=None)
+      waitingForStop.clear()
+      stopEvent = threading.Event()
+      searchThread = threading.Thread(target=search, args=(gameState, limits, hold, stopEvent), daemon=True)
+      searchThread.start()
+    elif command in ('stop', 'ponderhit', 'quit'):
+      if command == 'ponderhit':
+        if ponderClock is not None: # now it is our move, search with the time the go command gave
+          searcher.startClock(*ponderClock)
+          ponderClock = None
+      else:
+        stopEvent.set()
+      waitingForStop.set()
+      if command == 'quit':
+        break
+  if searchThread is not None:
+    searchThread.join()
+
+
+if __name__ == '__main__':
+  uciMain()
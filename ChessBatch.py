@@ -0,0 +1,195 @@
+'''
+NumPy versions of the board helpers for working on large batches of positions at once (datasets, offline analysis).
+Positions are packed into an int8 array of shape (N, 8, 8), row 0 is the 8th rank like GameState.board, with 0 for
+an empty square, 1-6 for the white pawn, knight, bishop, rook, queen and king and -1 to -6 for the black ones.
+
+  boards, whiteToMove = ChessBatch.encodeFENs(fens)
+  scores = ChessBatch.evaluate(boards, whiteToMove) # same numbers as ChessAI.evaluate
+  white, black = ChessBatch.mobility(boards)
+  gs = ChessBatch.decode(boards[0], whiteToMove[0])
+'''
+import numpy as np
+import ChessEngine
+import ChessAI
+
+PIECE_TYPES = ('p', 'N', 'B', 'R', 'Q', 'K') # piece type of codes 1-6
+PIECE_CODES = {'--': 0}
+for i in range(len(PIECE_TYPES)):
+  PIECE_CODES['w' + PIECE_TYPES[i]] = i + 1
+  PIECE_CODES['b' + PIECE_TYPES[i]] = -(i + 1)
+CODE_PIECES = {code: piece for piece, code in PIECE_CODES.items()}
+
+PLANE_CODES = np.array([PIECE_CODES[piece] for piece in ChessEngine.PIECES], dtype=np.int8) # bitplane order
+
+# FEN board characters to codes, '.' is an empty square (the digits are expanded to dots first)
+FEN_CODES = np.zeros(256, dtype=np.int8)
+for char, piece in ChessEngine.FEN_PIECES.items():
+  FEN_CODES[ord(char)] = PIECE_CODES[piece]
+FEN_EXPAND = str.maketrans({str(n): '.' * n for n in range(1, 9)} | {'/': ''})
+
+'''
+Score of every piece on every square, indexed by [code + 6, row * 8 + col], white pieces count up and black pieces
+count down, so summing over a board gives ChessAI's material plus piece-square score from white's point of view
+'''
+SCORE_TABLE = np.zeros((13, 64), dtype=np.int32)
+MATERIAL_TABLE = np.zeros(13, dtype=np.int32)
+for i in range(len(PIECE_TYPES)):
+  pieceType = PIECE_TYPES[i]
+  table = np.array(ChessAI.PIECE_SQUARE_TABLES[pieceType], dtype=np.int32)
+  value = ChessAI.PIECE_VALUES[pieceType]
+  SCORE_TABLE[6 + i + 1] = (value + table).ravel()
+  SCORE_TABLE[6 - i - 1] = -(value + table[::-1]).ravel() # black reads the table from its side of the board
+  MATERIAL_TABLE[6 + i + 1] = value
+  MATERIAL_TABLE[6 - i - 1] = -value
+
+KNIGHT_STEPS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_STEPS = ((-1, -1), (-1, 0), (-1, 1), (0, 1), (0, -1), (1, -1), (1, 0), (1, 1))
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+FEATURE_NAMES = ('score', 'material', 'whiteMobility', 'blackMobility') + ChessEngine.PIECES # columns of features()
+
+
+'''
+Pack GameStates (or 8x8 boards like GameState.board) into an int8 array of shape (N, 8, 8)
+'''
+def encode(positions):
+  positions = list(positions)
+  codes = PIECE_CODES
+  squares = (codes[piece] for position in positions for row in getattr(position, 'board', position) for piece in row)
+  return np.fromiter(squares, dtype=np.int8, count=len(positions) * 64).reshape(len(positions), 8, 8)
+
+
+'''
+Pack FEN strings straight into (boards, whiteToMove) without making GameStates. The piece placement of every FEN
+is expanded to 64 characters and all of them are looked up in FEN_CODES at once
+'''
+def encodeFENs(fens):
+  placements = []
+  whiteToMove = []
+  for fen in fens:
+    fields = fen.split(None, 2)
+    placements.append(fields[0].translate(FEN_EXPAND))
+    whiteToMove.append(len(fields) < 2 or fields[1] == 'w')
+  text = ''.join(placements)
+  if len(text) != len(placements) * 64:
+    raise ValueError('Invalid FEN, every board must have 64 squares')
+  boards = FEN_CODES[np.frombuffer(text.encode('ascii'), dtype=np.uint8)].reshape(len(placements), 8, 8)
+  return boards, np.array(whiteToMove, dtype=bool)
+
+
+'''
+The player to move in each GameState, as a bool array
+'''
+def sideToMove(states):
+  return np.array([gs.whiteToMove for gs in states], dtype=bool)
+
+
+'''
+One plane of 64 squares per piece in ChessEngine.PIECES order, shape (N, 12, 64)
+'''
+def bitplanes(boards):
+  return (boards.reshape(len(boards), 1, 64) == PLANE_CODES.reshape(1, 12, 1)).astype(np.uint8)
+
+
+'''
+Number of each piece on every board, shape (N, 12) in ChessEngine.PIECES order
+'''
+def pieceCounts(boards):
+  return bitplanes(boards).sum(axis=2, dtype=np.int32)
+
+
+'''
+Material balance from white's point of view, shape (N,)
+'''
+def material(boards):
+  return MATERIAL_TABLE[boards.reshape(len(boards), 64).astype(np.intp) + 6].sum(axis=1)
+
+
+'''
+Material plus piece-square score, the same as ChessAI.evaluate for every board. From white's point of view, or from
+the side to move if whiteToMove (bool array) is given
+'''
+def evaluate(boards, whiteToMove=None):
+  scores = SCORE_TABLE[boards.reshape(len(boards), 64).astype(np.intp) + 6, np.arange(64)].sum(axis=1)
+  if whiteToMove is not None:
+    scores = np.where(whiteToMove, scores, -scores)
+  return scores
+
+
+'''
+Move a (N, 8, 8) array dr rows and dc columns, squares moved off the board are dropped
+'''
+def shift(planes, dr, dc):
+  moved = np.zeros_like(planes)
+  moved[:, max(dr, 0):8 + min(dr, 0), max(dc, 0):8 + min(dc, 0)] = planes[:, max(-dr, 0):8 - max(dr, 0), max(-dc, 0):8 - max(dc, 0)]
+  return moved
+
+
+'''
+Pseudo-legal move counts of one side (ignores pins, checks, castling and enpassant), shape (N,)
+'''
+def sideMobility(boards, white):
+  sign = 1 if white else -1
+  own = boards * sign > 0
+  enemy = boards * sign < 0
+  empty = boards == 0
+  targets = ~own
+  reached = np.zeros(boards.shape, dtype=np.uint8) # how many moves land on each square, summed at the end
+  for steps, code in ((KNIGHT_STEPS, 2), (KING_STEPS, 6)):
+    pieces = boards == code * sign
+    if not pieces.any():
+      continue
+    for dr, dc in steps:
+      reached += shift(pieces, dr, dc) & targets
+  for directions, codes in ((ROOK_DIRECTIONS, (4, 5)), (BISHOP_DIRECTIONS, (3, 5))):
+    sliders = (boards == codes[0] * sign) | (boards == codes[1] * sign)
+    for dr, dc in directions:
+      ray = sliders
+      for _ in range(7): # step along the ray, only carrying on through empty squares
+        ray = shift(ray, dr, dc)
+        if not ray.any():
+          break
+        reached += ray & targets
+        ray &= empty
+  pawns = boards == sign
+  forward = -sign # white pawns move up the board (towards row 0)
+  single = shift(pawns, forward, 0) & empty
+  startRank = np.zeros_like(pawns)
+  startRank[:, 5 if white else 2] = True # squares a pawn lands on after its first single push
+  reached += single
+  reached += shift(single & startRank, forward, 0) & empty # double pushes
+  for dc in (-1, 1):
+    reached += shift(pawns, forward, dc) & enemy
+  return reached.reshape(len(boards), 64).sum(axis=1, dtype=np.int32)
+
+
+'''
+Pseudo-legal mobility of both sides, returns (white, black) arrays of shape (N,)
+'''
+def mobility(boards):
+  return sideMobility(boards, True), sideMobility(boards, False)
+
+
+'''
+All features in one (N, len(FEATURE_NAMES)) int32 array: the evaluation (from white's point of view), material,
+the mobility of each side and the count of each piece
+'''
+def features(boards):
+  white, black = mobility(boards)
+  columns = [evaluate(boards), material(boards), white, black]
+  return np.column_stack(columns + [pieceCounts(boards)]).astype(np.int32)
+
+
+'''
+Make a GameState from one encoded board. Castling rights are not stored in the array, so by default they are
+given for every king and rook still on its starting square
+'''
+def decode(board, whiteToMove=True, castleRights=None, enpassantPossible=(), backend=None):
+  rows = [[CODE_PIECES[int(code)] for code in row] for row in board]
+  if castleRights is None:
+    castleRights = ChessEngine.CastleRights(rows[7][4] == 'wK' and rows[7][7] == 'wR', rows[0][4] == 'bK' and rows[0][7] == 'bR',
+                                            rows[7][4] == 'wK' and rows[7][0] == 'wR', rows[0][4] == 'bK' and rows[0][0] == 'bR')
+  gs = ChessEngine.createGameState(backend)
+  gs.loadPosition(rows, bool(whiteToMove), castleRights, enpassantPossible)
+  return gs
@@ -0,0 +1,265 @@
+'''
+Microbenchmarks for the ChessEngine primitives perft is built from: making a Move, a makeMove/undoMove pair, each
+get*Moves generator, squareUnderAttack, inCheck and getCastleMoves. Each one runs over a fixed corpus of middlegame
+and endgame positions, is timed several times over (best, median and spread per call) and run once more under
+tracemalloc to see what it allocates.
+
+  python ChessBench.py                                  run everything and print the results
+  python ChessBench.py -b makeMove+undoMove -b getKnightMoves --phase endgame
+  python ChessBench.py --json baseline.json             save the results as a baseline
+  python ChessBench.py --compare baseline.json -t 15    exit with 1 if anything got more than 15% slower or allocates more
+'''
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+import tracemalloc
+import ChessEngine
+import ChessPerft
+
+'''
+The fixed corpus, (name, phase, fen). Changing it makes old baselines meaningless, so add positions rather than edit
+them
+'''
+CORPUS = [
+  ('kiwipete', 'middlegame', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1'),
+  ('italian', 'middlegame', 'r1bqk2r/pppp1ppp/2n2n2/2b1p3/2B1P3/3P1N2/PPP2PPP/RNBQK2R w KQkq - 1 5'),
+  ('queens-gambit', 'middlegame', 'r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP3PPP/R2QKB1R w KQ - 0 8'),
+  ('slav', 'middlegame', 'r2q1rk1/pp1nbppp/2p1pn2/3p1b2/2PP4/1PN1PN2/PB2BPPP/R2Q1RK1 w - - 0 9'),
+  ('open-center', 'middlegame', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10'),
+  ('opposite-castling', 'middlegame', 'r3k2r/pp1n1ppp/2pbpn2/q7/3P4/2NBPN2/PPQ2PPP/R3K2R b KQkq - 0 10'),
+  ('in-check', 'middlegame', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1'),
+  ('rook-ending', 'endgame', '6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1'),
+  ('pawn-ending', 'endgame', '8/5k2/3p4/1p1Pp2p/pP2Pp1P/P4P1K/8/8 b - - 0 50'),
+  ('king-pawn', 'endgame', '4k3/8/8/8/8/8/4P3/4K3 w - - 0 1'),
+  ('rook-pawns', 'endgame', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1'),
+  ('bishop-ending', 'endgame', '8/3K4/2p5/p2b4/P7/1P6/8/6k1 w - - 0 1'),
+  ('queen-rook', 'endgame', 'r5k1/5ppp/8/8/8/8/5PPP/3Q2K1 b - - 0 1'),
+  ('knight-ending', 'endgame', '8/8/4kpp1/3n4/8/4N1PP/5PK1/8 w - - 0 40'),
+]
+PHASES = ('middlegame', 'endgame')
+# how much more memory than the baseline is still noise (a list growing once in a few hundred calls), on top of the threshold
+MEMORY_SLACK = {'blocksPerCall': 0.05, 'peakBytesPerCall': 16}
+
+
+'''
+Run moveFunction (a get*Moves method) for the piece on r, c and return the move codes it added
+'''
+def collect(moveFunction, r, c):
+  moves = []
+  moveFunction(r, c, moves)
+  return moves
+
+
+def makeUndo(gs, move):
+  gs.makeMove(move)
+  gs.undoMove()
+
+
+def noop():
+  pass
+
+
+'''
+What each benchmark calls, as (function, args) pairs over the positions (a list of GameStates). One pass of a
+benchmark is one call for each pair
+'''
+def moveArguments(positions):
+  return [(ChessEngine.Move, ((move.startRow, move.startCol), (move.endRow, move.endCol), gs.board, move.isEnpassantMove,
+                              move.isCastleMove)) for gs in positions for move in gs.getValidMoves()]
+
+def fromCodeArguments(positions):
+  return [(ChessEngine.Move.fromCode, (move.code, gs.board)) for gs in positions for move in gs.getValidMoves()]
+
+def makeUndoArguments(positions):
+  return [(makeUndo, (gs, move)) for gs in positions for move in gs.getValidMoves()]
+
+def pieceArguments(pieceType):
+  def arguments(positions):
+    work = []
+    for gs in positions:
+      moveFunction = gs.moveFunctions[pieceType]
+      for r, c in gs.pieceLocations[('w' if gs.whiteToMove else 'b') + pieceType]:
+        work.append((collect, (moveFunction, r, c)))
+    return work
+  return arguments
+
+def squareUnderAttackArguments(positions):
+  return [(gs.squareUnderAttack, (r, c)) for gs in positions for r in range(8) for c in range(8)]
+
+def inCheckArguments(positions):
+  return [(gs.inCheck, ()) for gs in positions]
+
+def castleArguments(positions):
+  return [(collect, (gs.getCastleMoves,) + (gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation))
+          for gs in positions]
+
+BENCHMARKS = {
+  'Move': moveArguments,
+  'Move.fromCode': fromCodeArguments,
+  'makeMove+undoMove': makeUndoArguments,
+  'getPawnMoves': pieceArguments('p'),
+  'getKnightMoves': pieceArguments('N'),
+  'getBishopMoves': pieceArguments('B'),
+  'getRookMoves': pieceArguments('R'),
+  'getQueenMoves': pieceArguments('Q'),
+  'getKingMoves': pieceArguments('K'),
+  'squareUnderAttack': squareUnderAttackArguments,
+  'inCheck': inCheckArguments,
+  'getCastleMoves': castleArguments,
+}
+
+
+def runPass(work):
+  for function, args in work:
+    function(*args)
+
+
+'''
+Time work: passes are added up until a repeat takes at least minSeconds, then repeat repeats are timed (with the
+garbage collector off, like timeit). Returns nanoseconds per call of each repeat and the passes per repeat
+'''
+def timeWork(work, repeat, minSeconds):
+  timer = timeit.Timer(lambda: runPass(work))
+  passes = 1
+  while timer.timeit(passes) < minSeconds:
+    passes *= 2
+  return [seconds / (passes * len(work)) * 1e9 for seconds in timer.repeat(repeat, passes)], passes
+
+
+'''
+One pass of work under tracemalloc, keeping what every call returns. Returns (blocks, bytes, peak bytes) per call:
+the allocations still alive after the call (the moves it made), their size, and the most memory the call had in use
+above what it started with, temporaries included. The loop's own cost (an empty call) is taken off, and a first
+pass is thrown away, the first tracing in a process counts a few extra blocks
+'''
+def allocationsPerCall(work):
+  def measure(work):
+    kept = [None] * len(work) # allocated before tracing starts
+    peaks = 0
+    tracemalloc.start()
+    for i in range(len(work)):
+      function, args = work[i]
+      tracemalloc.reset_peak()
+      before = tracemalloc.get_traced_memory()[0]
+      kept[i] = function(*args)
+      peaks += tracemalloc.get_traced_memory()[1] - before
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = snapshot.statistics('filename')
+    return (sum(stat.count for stat in stats) / len(work), sum(stat.size for stat in stats) / len(work),
+            peaks / len(work))
+  gc.disable()
+  try:
+    measure(work)
+    emptyBlocks, emptyBytes, emptyPeak = measure([(noop, ())] * len(work))
+    blocks, size, peak = measure(work)
+  finally:
+    gc.enable()
+  return max(0.0, blocks - emptyBlocks), max(0.0, size - emptyBytes), max(0.0, peak - emptyPeak)
+
+
+def runBenchmark(name, positions, repeat, minSeconds, memory=True):
+  work = BENCHMARKS[name](positions)
+  result = {'benchmark': name, 'calls': len(work), 'passes': 0, 'repeat': repeat, 'minNs': 0.0, 'medianNs': 0.0,
+            'meanNs': 0.0, 'stdevNs': 0.0, 'blocksPerCall': None, 'bytesPerCall': None, 'peakBytesPerCall': None,
+            'bytesPerPosition': None}
+  if not work: # e.g. no queens in an endgame only run
+    return result
+  times, result['passes'] = timeWork(work, repeat, minSeconds)
+  result.update(minNs=min(times), medianNs=statistics.median(times), meanNs=statistics.mean(times),
+                stdevNs=statistics.stdev(times) if len(times) > 1 else 0.0)
+  if memory:
+    blocks, size, peak = allocationsPerCall(work)
+    result.update(blocksPerCall=blocks, bytesPerCall=size, peakBytesPerCall=peak,
+                  bytesPerPosition=size * len(work) / len(positions))
+  return result
+
+
+def printResult(result):
+  line = '%-18s %6d calls  best %8.1fns  median %8.1fns  +-%4.1f%%' % (
+    result['benchmark'], result['calls'], result['minNs'], result['medianNs'],
+    result['stdevNs'] / result['meanNs'] * 100 if result['meanNs'] else 0.0)
+  if result['blocksPerCall'] is not None:
+    line += '  %5.2f blocks %7.1f B/call  peak %7.1f B/call  %8.0f B/position' % (
+      result['blocksPerCall'], result['bytesPerCall'], result['peakBytesPerCall'], result['bytesPerPosition'])
+  print(line)
+
+
+'''
+Compare results with an earlier --json file. A benchmark regressed when its best time is more than threshold percent
+above the baseline's, or when it allocates more (blocks or peak bytes per call) by more than memoryThreshold percent.
+Returns the names of the ones that regressed
+'''
+def compareResults(report, baselineFile, threshold, memoryThreshold):
+  with open(baselineFile) as f:
+    baseline = json.load(f)
+  print('\nCompared to ' + baselineFile + ' (' + str(baseline.get('commit')) + '):')
+  for key in ('backend', 'python', 'corpus'):
+    if baseline.get(key) != report[key]:
+      print('  note: the baseline has a different ' + key + ', the numbers may not be comparable')
+  old = {r['benchmark']: r for r in baseline['results']}
+  regressed = []
+  for result in report['results']:
+    previous = old.get(result['benchmark'])
+    if previous is None or not previous['minNs'] or not result['calls']:
+      continue
+    problems = []
+    change = (result['minNs'] / previous['minNs'] - 1) * 100
+    if change > threshold:
+      problems.append('slower')
+    for key in ('blocksPerCall', 'peakBytesPerCall'):
+      if result[key] is not None and previous.get(key) is not None and \
+         result[key] > previous[key] * (1 + memoryThreshold / 100) + MEMORY_SLACK[key]:
+        problems.append(key + ' %.2f -> %.2f' % (previous[key], result[key]))
+    print('%-18s %8.1fns -> %8.1fns (%+.1f%%)  %s' % (result['benchmark'], previous['minNs'], result['minNs'], change,
+                                                     'REGRESSED: ' + ', '.join(problems) if problems else 'ok'))
+    if problems:
+      regressed.append(result['benchmark'])
+  return regressed
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Microbenchmarks and allocation counts for the ChessEngine primitives')
+  parser.add_argument('-b', '--benchmark', action='append', choices=list(BENCHMARKS),
+                      help='benchmark to run (can be given more than once, default: all)')
+  parser.add_argument('--phase', choices=PHASES, help='only use the middlegame or the endgame positions of the corpus')
+  parser.add_argument('--backend', choices=ChessEngine.BACKENDS, help='board backend (default: CHESS_BACKEND or list)')
+  parser.add_argument('-r', '--repeat', type=int, default=7, help='timed repeats of each benchmark (default: 7)')
+  parser.add_argument('--min-time', type=float, default=0.05, help='seconds each repeat runs for at least (default: 0.05)')
+  parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc pass")
+  parser.add_argument('--json', help='write the results to this file (a baseline for --compare)')
+  parser.add_argument('--compare', help='compare with an earlier --json file, exit with 1 if anything regressed')
+  parser.add_argument('-t', '--threshold', type=float, default=10.0,
+                      help='percent slower than the baseline that counts as a regression (default: 10)')
+  parser.add_argument('--memory-threshold', type=float, default=0.0,
+                      help='percent more allocation than the baseline that counts as a regression (default: 0)')
+  args = parser.parse_args(argv)
+
+  corpus = [(name, fen) for name, phase, fen in CORPUS if args.phase in (None, phase)]
+  positions = [ChessEngine.createGameState(args.backend, fen) for name, fen in corpus]
+  results = []
+  for name in args.benchmark or list(BENCHMARKS):
+    result = runBenchmark(name, positions, args.repeat, args.min_time, not args.no_memory)
+    printResult(result)
+    results.append(result)
+
+  report = {'commit': ChessPerft.gitCommit(), 'backend': args.backend or os.environ.get('CHESS_BACKEND', 'list'),
+            'python': platform.python_version(), 'corpus': [name for name, fen in corpus], 'results': results}
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(report, f, indent=2)
+  if args.compare:
+    regressed = compareResults(report, args.compare, args.threshold, args.memory_threshold)
+    if regressed:
+      print('regressed: ' + ', '.join(regressed))
+      return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
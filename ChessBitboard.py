@@ -0,0 +1,410 @@
+'''
+Bitboard backend for the GameState. Every piece type of each color gets a 64-bit integer where bit (row * 8 + col)
+is set if that piece stands on the square, so row 0 (the 8th rank) is bits 0-7. Moves are generated from
+precomputed knight, king and pawn attack tables and classical ray tables for the sliding pieces.
+The board list from ChessEngine.GameState is still kept up to date so Move, getChessNotation and ChessMain work
+exactly the same as with the list backend.
+'''
+import ChessEngine
+import ChessProfile
+
+FULL = (1 << 64) - 1
+FILE_A = 0x0101010101010101 # col 0
+FILE_H = FILE_A << 7 # col 7
+
+# ray directions as (row, col) steps, the first 4 are rook directions and the last 4 are bishop directions
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+# a ray whose square index goes up along the ray uses the lowest set bit as its first blocker, otherwise the highest
+POSITIVE = tuple(d[0] * 8 + d[1] > 0 for d in DIRECTIONS)
+ROOK_DIRECTIONS = (0, 1, 2, 3)
+BISHOP_DIRECTIONS = (4, 5, 6, 7)
+
+PIECES = ChessEngine.PIECES
+
+
+def square(r, c):
+  return r * 8 + c
+
+
+def stepTable(offsets):
+  table = []
+  for sq in range(64):
+    r, c = divmod(sq, 8)
+    bits = 0
+    for dr, dc in offsets:
+      if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+        bits |= 1 << square(r + dr, c + dc)
+    table.append(bits)
+  return table
+
+
+def rayTable(d):
+  table = []
+  for sq in range(64):
+    r, c = divmod(sq, 8)
+    bits = 0
+    for i in range(1, 8):
+      endRow = r + d[0] * i
+      endCol = c + d[1] * i
+      if not (0 <= endRow < 8 and 0 <= endCol < 8):
+        break
+      bits |= 1 << square(endRow, endCol)
+    table.append(bits)
+  return table
+
+
+KNIGHT_ATTACKS = stepTable(((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_ATTACKS = stepTable(((-1, -1), (-1, 0), (-1, 1), (0, 1), (0, -1), (1, -1), (1, 0), (1, 1)))
+PAWN_ATTACKS = {'w': stepTable(((-1, -1), (-1, 1))), 'b': stepTable(((1, -1), (1, 1)))} # squares a pawn captures on
+RAYS = [rayTable(d) for d in DIRECTIONS]
+
+# BETWEEN[a][b] are the squares strictly between a and b if they share a line, otherwise 0
+BETWEEN = [[0] * 64 for _ in range(64)]
+for a in range(64):
+  for d in DIRECTIONS:
+    between = 0
+    for i in range(1, 8):
+      endRow = a // 8 + d[0] * i
+      endCol = a % 8 + d[1] * i
+      if not (0 <= endRow < 8 and 0 <= endCol < 8):
+        break
+      BETWEEN[a][square(endRow, endCol)] = between
+      between |= 1 << square(endRow, endCol)
+
+'''
+Index of the first piece that blocks the ray j from sq, or -1 if nothing does
+'''
+def firstBlocker(j, sq, occupancy):
+  blockers = RAYS[j][sq] & occupancy
+  if not blockers:
+    return -1
+  if POSITIVE[j]:
+    return (blockers & -blockers).bit_length() - 1
+  return blockers.bit_length() - 1
+
+
+def slidingAttacks(sq, occupancy, directions):
+  attacks = 0
+  for j in directions:
+    ray = RAYS[j][sq]
+    blockers = ray & occupancy
+    if blockers:
+      b = (blockers & -blockers).bit_length() - 1 if POSITIVE[j] else blockers.bit_length() - 1
+      ray ^= RAYS[j][b] # cut the ray off behind the first blocker
+    attacks |= ray
+  return attacks
+
+
+def rookAttacks(sq, occupancy):
+  return slidingAttacks(sq, occupancy, ROOK_DIRECTIONS)
+
+
+def bishopAttacks(sq, occupancy):
+  return slidingAttacks(sq, occupancy, BISHOP_DIRECTIONS)
+
+
+def squares(bits): # yields the index of every set bit
+  while bits:
+    low = bits & -bits
+    yield low.bit_length() - 1
+    bits ^= low
+
+
+class GameState(ChessEngine.GameState):
+  def loadPosition(self, board, whiteToMove, castleRights, enpassantPossible, halfmoveClock=0, fullmoveNumber=1):
+    super().loadPosition(board, whiteToMove, castleRights, enpassantPossible, halfmoveClock, fullmoveNumber)
+    self.loadBitboards()
+
+  '''
+  Build the piece bitboards and occupancy masks from self.board
+  '''
+  def loadBitboards(self):
+    self.bitboards = {piece: 0 for piece in PIECES}
+    for r in range(8):
+      for c in range(8):
+        piece = self.board[r][c]
+        if piece != '--':
+          self.bitboards[piece] |= 1 << square(r, c)
+    self.updateOccupancy()
+
+  def updateOccupancy(self):
+    bb = self.bitboards
+    self.occupancy = {'w': bb['wp'] | bb['wN'] | bb['wB'] | bb['wR'] | bb['wQ'] | bb['wK'],
+                      'b': bb['bp'] | bb['bN'] | bb['bB'] | bb['bR'] | bb['bQ'] | bb['bK']}
+    self.allOccupancy = self.occupancy['w'] | self.occupancy['b']
+
+  '''
+  Squares a move can change on the board: start, end, the enpassant pawn and the castling rook
+  '''
+  def changedSquares(self, move):
+    changed = [(move.startRow, move.startCol), (move.endRow, move.endCol)]
+    if move.isEnpassantMove:
+      changed.append((move.startRow, move.endCol))
+    if move.isCastleMove:
+      if move.endCol - move.startCol == 2:
+        changed += [(move.endRow, move.endCol - 1), (move.endRow, move.endCol + 1)]
+      else:
+        changed += [(move.endRow, move.endCol + 1), (move.endRow, move.endCol - 2)]
+    return changed
+
+  '''
+  Run a board update and xor the pieces that changed on the given squares into the bitboards
+  '''
+  def syncBitboards(self, changed, update):
+    before = [self.board[r][c] for r, c in changed]
+    update()
+    for i in range(len(changed)):
+      r, c = changed[i]
+      after = self.board[r][c]
+      if after != before[i]:
+        bit = 1 << square(r, c)
+        if before[i] != '--':
+          self.bitboards[before[i]] ^= bit
+        if after != '--':
+          self.bitboards[after] ^= bit
+    self.updateOccupancy()
+
+  def makeMove(self, move):
+    self.syncBitboards(self.changedSquares(move), lambda: super(GameState, self).makeMove(move))
+
+  def undoMove(self):
+    if len(self.moveLog) != 0:
+      self.syncBitboards(self.changedSquares(self.moveLog[-1]), super().undoMove)
+
+  '''
+  Bitboard of the squares attacked by the given color. occupancy can be passed in to look through pieces (the king)
+  '''
+  def attacksBy(self, color, occupancy=None):
+    if occupancy is None:
+      occupancy = self.allOccupancy
+    bb = self.bitboards
+    pawns = bb[color + 'p']
+    if color == 'w':
+      attacks = ((pawns >> 9) & ~FILE_H) | ((pawns >> 7) & ~FILE_A)
+    else:
+      attacks = ((pawns << 7) & ~FILE_H & FULL) | ((pawns << 9) & ~FILE_A & FULL)
+    for sq in squares(bb[color + 'N']):
+      attacks |= KNIGHT_ATTACKS[sq]
+    for sq in squares(bb[color + 'K']):
+      attacks |= KING_ATTACKS[sq]
+    for sq in squares(bb[color + 'R'] | bb[color + 'Q']):
+      attacks |= rookAttacks(sq, occupancy)
+    for sq in squares(bb[color + 'B'] | bb[color + 'Q']):
+      attacks |= bishopAttacks(sq, occupancy)
+    return attacks
+
+  '''
+  Bitboard of the pieces of the given color that attack sq
+  '''
+  def attackersOf(self, sq, color, occupancy=None):
+    if occupancy is None:
+      occupancy = self.allOccupancy
+    bb = self.bitboards
+    other = 'b' if color == 'w' else 'w'
+    return (PAWN_ATTACKS[other][sq] & bb[color + 'p']) | (KNIGHT_ATTACKS[sq] & bb[color + 'N']) | \
+           (KING_ATTACKS[sq] & bb[color + 'K']) | \
+           (rookAttacks(sq, occupancy) & (bb[color + 'R'] | bb[color + 'Q'])) | \
+           (bishopAttacks(sq, occupancy) & (bb[color + 'B'] | bb[color + 'Q']))
+
+  @ChessProfile.profiled('squareUnderAttack')
+  def squareUnderAttack(self, r, c, byWhite=None):
+    if byWhite is None:
+      byWhite = not self.whiteToMove
+    return self.attackersOf(square(r, c), 'w' if byWhite else 'b') != 0
+
+  def getAttackedSquares(self, byWhite):
+    return {divmod(sq, 8) for sq in squares(self.attacksBy('w' if byWhite else 'b'))}
+
+  def inCheck(self):
+    allyColor = 'w' if self.whiteToMove else 'b'
+    enemyColor = 'b' if self.whiteToMove else 'w'
+    kingSq = (self.bitboards[allyColor + 'K']).bit_length() - 1
+    return self.attackersOf(kingSq, enemyColor) != 0
+
+  '''
+  Returns a dict {square: mask} of the pinned pieces of color, where mask is the line they are still allowed to
+  move along (up to and including the pinning piece)
+  '''
+  def pinnedPieces(self, kingSq, color, enemyColor):
+    pins = {}
+    bb = self.bitboards
+    own = self.occupancy[color]
+    occupancy = self.allOccupancy
+    orthogonal = bb[enemyColor + 'R'] | bb[enemyColor + 'Q']
+    diagonal = bb[enemyColor + 'B'] | bb[enemyColor + 'Q']
+    for j in range(8):
+      sliders = orthogonal if j < 4 else diagonal
+      if not (RAYS[j][kingSq] & sliders): # nothing that could pin in this direction
+        continue
+      first = firstBlocker(j, kingSq, occupancy)
+      if first == -1 or not (own >> first) & 1:
+        continue
+      second = firstBlocker(j, first, occupancy)
+      if second != -1 and (sliders >> second) & 1:
+        pins[first] = BETWEEN[kingSq][second] | (1 << second)
+    return pins
+
+  '''
+  All moves considering checks as packed move codes, generated straight from the bitboards
+  '''
+  def getValidMoveCodes(self):
+    moves = []
+    bb = self.bitboards
+    color = 'w' if self.whiteToMove else 'b'
+    enemyColor = 'b' if self.whiteToMove else 'w'
+    own = self.occupancy[color]
+    enemy = self.occupancy[enemyColor]
+    occupancy = self.allOccupancy
+    kingSq = bb[color + 'K'].bit_length() - 1
+    kingRow, kingCol = divmod(kingSq, 8)
+
+    # the king can't step onto attacked squares, and it must not block the attack on the square behind it
+    enemyAttacks = self.attacksBy(enemyColor, occupancy ^ (1 << kingSq))
+    for sq in squares(KING_ATTACKS[kingSq] & ~own & ~enemyAttacks):
+      moves.append(kingSq | sq << 6)
+
+    checkers = self.attackersOf(kingSq, enemyColor)
+    if checkers & (checkers - 1): # double check, only the king can move
+      self.setGameOver(moves, True)
+      return moves
+    if checkers: # capture the checking piece or block the check
+      checkerSq = checkers.bit_length() - 1
+      evasions = checkers | BETWEEN[kingSq][checkerSq]
+    else:
+      evasions = FULL
+    pins = self.pinnedPieces(kingSq, color, enemyColor)
+    targets = ~own & evasions
+
+    for piece, attacksFrom in (('N', None), ('B', bishopAttacks), ('R', rookAttacks), ('Q', None)):
+      for sq in squares(bb[color + piece]):
+        if piece == 'N':
+          if sq in pins: # a pinned knight can never move
+            continue
+          attacks = KNIGHT_ATTACKS[sq]
+        elif piece == 'Q':
+          attacks = rookAttacks(sq, occupancy) | bishopAttacks(sq, occupancy)
+        else:
+          attacks = attacksFrom(sq, occupancy)
+        attacks &= targets
+        if sq in pins:
+          attacks &= pins[sq]
+        for endSq in squares(attacks):
+          moves.append(sq | endSq << 6)
+
+    # pawns
+    forward = -8 if color == 'w' else 8
+    startRow = 6 if color == 'w' else 1
+    promotionRow = 1 if color == 'w' else 6 # pawns moving off this row promote
+    enpassantSq = square(*self.enpassantPossible) if self.enpassantPossible != () else -1
+    for sq in squares(bb[color + 'p']):
+      r = sq >> 3
+      allowed = evasions & pins.get(sq, FULL)
+      promotion = ChessEngine.PROMOTION_FLAGS if r == promotionRow else 0
+      oneStep = sq + forward
+      if not (occupancy >> oneStep) & 1:
+        if (allowed >> oneStep) & 1:
+          moves.append(sq | oneStep << 6 | promotion)
+        twoStep = oneStep + forward
+        if r == startRow and not (occupancy >> twoStep) & 1 and (allowed >> twoStep) & 1:
+          moves.append(sq | twoStep << 6)
+      captures = PAWN_ATTACKS[color][sq]
+      for endSq in squares(captures & enemy & allowed):
+        moves.append(sq | endSq << 6 | promotion)
+      if enpassantSq != -1 and (captures >> enpassantSq) & 1:
+        if self.enpassantIsLegal(sq, enpassantSq, kingSq, color, enemyColor):
+          moves.append(sq | enpassantSq << 6 | ChessEngine.ENPASSANT_FLAG)
+
+    if not checkers:
+      self.getBitboardCastleMoves(kingRow, kingCol, moves, enemyAttacks)
+    self.setGameOver(moves, checkers != 0)
+    return moves
+
+  '''
+  An enpassant capture moves two pawns at once, so test it by checking the king against the changed occupancy
+  '''
+  def enpassantIsLegal(self, fromSq, toSq, kingSq, color, enemyColor):
+    capturedSq = square(fromSq // 8, toSq % 8)
+    occupancy = (self.allOccupancy ^ (1 << fromSq) ^ (1 << capturedSq)) | (1 << toSq)
+    bb = self.bitboards
+    enemyPawns = bb[enemyColor + 'p'] & ~(1 << capturedSq)
+    if KNIGHT_ATTACKS[kingSq] & bb[enemyColor + 'N']:
+      return False
+    if PAWN_ATTACKS[color][kingSq] & enemyPawns:
+      return False
+    if rookAttacks(kingSq, occupancy) & (bb[enemyColor + 'R'] | bb[enemyColor + 'Q']):
+      return False
+    if bishopAttacks(kingSq, occupancy) & (bb[enemyColor + 'B'] | bb[enemyColor + 'Q']):
+      return False
+    return True
+
+  def getBitboardCastleMoves(self, r, c, moves, enemyAttacks):
+    if self.whiteToMove:
+      canKingside, canQueenside = self.currentCastlingRight.wks, self.currentCastlingRight.wqs
+    else:
+      canKingside, canQueenside = self.currentCastlingRight.bks, self.currentCastlingRight.bqs
+    kingSq = square(r, c)
+    if canKingside:
+      path = (1 << (kingSq + 1)) | (1 << (kingSq + 2))
+      if not (path & self.allOccupancy) and not (path & enemyAttacks):
+        moves.append(kingSq | (kingSq + 2) << 6 | ChessEngine.CASTLE_FLAG)
+    if canQueenside:
+      empty = (1 << (kingSq - 1)) | (1 << (kingSq - 2)) | (1 << (kingSq - 3))
+      path = (1 << (kingSq - 1)) | (1 << (kingSq - 2))
+      if not (empty & self.allOccupancy) and not (path & enemyAttacks):
+        moves.append(kingSq | (kingSq - 2) << 6 | ChessEngine.CASTLE_FLAG)
+
+  '''
+  The legal moves come straight from the bitboards anyway, so the staged generators just look codes up in them
+  '''
+  def legalCodeTest(self):
+    checkmate, stalemate = self.checkmate, self.stalemate
+    legal = set(self.getValidMoveCodes())
+    self.checkmate, self.stalemate = checkmate, stalemate # generateMoves and hasLegalMove leave these alone
+    return self.inCheck(), False, legal.__contains__
+
+  def setGameOver(self, moves, inCheck):
+    self.checkmate = len(moves) == 0 and inCheck
+    self.stalemate = len(moves) == 0 and not inCheck
+
+  '''
+  All moves without considering checks as packed move codes
+  '''
+  def getAllPossibleMoveCodes(self):
+    moves = []
+    bb = self.bitboards
+    color = 'w' if self.whiteToMove else 'b'
+    own = self.occupancy[color]
+    enemy = self.occupancy['b' if self.whiteToMove else 'w']
+    occupancy = self.allOccupancy
+    for piece in ('N', 'B', 'R', 'Q', 'K'):
+      for sq in squares(bb[color + piece]):
+        if piece == 'N':
+          attacks = KNIGHT_ATTACKS[sq]
+        elif piece == 'K':
+          attacks = KING_ATTACKS[sq]
+        else:
+          attacks = 0
+          if piece != 'B':
+            attacks |= rookAttacks(sq, occupancy)
+          if piece != 'R':
+            attacks |= bishopAttacks(sq, occupancy)
+        for endSq in squares(attacks & ~own):
+          moves.append(sq | endSq << 6)
+    forward = -8 if color == 'w' else 8
+    startRow = 6 if color == 'w' else 1
+    promotionRow = 1 if color == 'w' else 6
+    enpassantSq = square(*self.enpassantPossible) if self.enpassantPossible != () else -1
+    for sq in squares(bb[color + 'p']):
+      r = sq >> 3
+      promotion = ChessEngine.PROMOTION_FLAGS if r == promotionRow else 0
+      oneStep = sq + forward
+      if not (occupancy >> oneStep) & 1:
+        moves.append(sq | oneStep << 6 | promotion)
+        twoStep = oneStep + forward
+        if r == startRow and not (occupancy >> twoStep) & 1:
+          moves.append(sq | twoStep << 6)
+      for endSq in squares(PAWN_ATTACKS[color][sq] & enemy):
+        moves.append(sq | endSq << 6 | promotion)
+      if enpassantSq != -1 and (PAWN_ATTACKS[color][sq] >> enpassantSq) & 1:
+        moves.append(sq | enpassantSq << 6 | ChessEngine.ENPASSANT_FLAG)
+    return moves
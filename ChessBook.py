@@ -0,0 +1,124 @@
+'''
+Polyglot opening books (.bin). The file is memory-mapped and binary-searched by position key, and ChessHash keys
+are the Polyglot keys, so a lookup is just gs.zobristKey. Every entry is 16 bytes, big-endian: key (8), move (2),
+weight (2), learn (4), sorted by key.
+
+The AIs look here before searching, set CHESS_BOOK to the book to use (book.bin next to the code by default).
+'''
+import mmap
+import os
+import random
+import struct
+
+ENTRY = struct.Struct('>QHHI')
+PROMOTIONS = ('', 'n', 'b', 'r', 'q')
+# polyglot writes castling as the king taking its own rook
+CASTLING = {'e1h1': 'e1g1', 'e1a1': 'e1c1', 'e8h8': 'e8g8', 'e8a8': 'e8c8'}
+BOOK_PATH = os.environ.get('CHESS_BOOK', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'book.bin'))
+
+defaultBooks = {} # path: OpeningBook or None if there is no such file, see openBook
+
+
+'''
+A polyglot move (16 bits) in the notation Move.getChessNotation uses, e.g. e2e4 or e7e8q
+'''
+def moveNotation(move, board=None):
+  toFile, toRank = move & 7, move >> 3 & 7
+  fromFile, fromRank = move >> 6 & 7, move >> 9 & 7
+  notation = 'abcdefgh'[fromFile] + str(fromRank + 1) + 'abcdefgh'[toFile] + str(toRank + 1) + PROMOTIONS[move >> 12 & 7]
+  if notation in CASTLING and (board is None or board[7 - fromRank][fromFile][1] == 'K'):
+    notation = CASTLING[notation]
+  return notation
+
+
+class OpeningBook():
+  def __init__(self, path):
+    self.path = path
+    self.file = open(path, 'rb')
+    size = os.fstat(self.file.fileno()).st_size
+    self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+    self.size = size // ENTRY.size # number of entries
+    self.lookups = 0
+    self.hits = 0
+    self.secondsSaved = 0.0 # search time the book moves saved
+
+  '''
+  All (move notation, weight) entries for the position key, [] if the book doesn't have it
+  '''
+  def find(self, key, board=None):
+    low, high = 0, self.size
+    while low < high: # first entry with a key >= key
+      middle = (low + high) // 2
+      if ENTRY.unpack_from(self.data, middle * ENTRY.size)[0] < key:
+        low = middle + 1
+      else:
+        high = middle
+    entries = []
+    while low < self.size:
+      entryKey, move, weight, _ = ENTRY.unpack_from(self.data, low * ENTRY.size)
+      if entryKey != key:
+        break
+      entries.append((moveNotation(move, board), weight))
+      low += 1
+    return entries
+
+  '''
+  Pick a book move for the GameState out of validMoves. mode is 'weighted' (random, by weight) or 'best' (highest
+  weight). Returns None when the book has nothing, or when the game is already maxPly half moves long.
+  searchSeconds is what the search would have cost, it is added to secondsSaved on a hit
+  '''
+  def bookMove(self, gs, validMoves, maxPly=None, mode='weighted', searchSeconds=0.0):
+    if maxPly is not None and len(gs.moveLog) >= maxPly:
+      return None
+    self.lookups += 1
+    byNotation = {move.getChessNotation(): move for move in validMoves}
+    entries = [(byNotation[notation], weight) for notation, weight in self.find(gs.zobristKey, gs.board)
+               if notation in byNotation and weight > 0]
+    if not entries:
+      return None
+    if mode == 'best':
+      move = max(entries, key=lambda entry: entry[1])[0]
+    else:
+      move = random.choices([entry[0] for entry in entries], [entry[1] for entry in entries])[0]
+    self.hits += 1
+    self.secondsSaved += searchSeconds
+    return move
+
+  def stats(self):
+    return {'entries': self.size, 'lookups': self.lookups, 'hits': self.hits,
+            'hitRate': self.hits / self.lookups if self.lookups else 0.0, 'secondsSaved': self.secondsSaved}
+
+  def close(self):
+    if isinstance(self.data, mmap.mmap):
+      self.data.close()
+    self.file.close()
+
+  def __len__(self):
+    return self.size
+
+
+'''
+The book at path (BOOK_PATH by default), opened once and shared. None if the file doesn't exist
+'''
+def openBook(path=None):
+  path = path or BOOK_PATH
+  if path not in defaultBooks:
+    defaultBooks[path] = OpeningBook(path) if os.path.isfile(path) else None
+  return defaultBooks[path]
+
+
+'''
+Write a polyglot book from {key: [(move notation, weight)]}, mostly for making small test books. Castling should be
+given as the king taking its rook (e1h1), like polyglot does
+'''
+def writeBook(path, entries):
+  rows = []
+  for key, moves in entries.items():
+    for notation, weight in moves:
+      fromFile, fromRank = 'abcdefgh'.index(notation[0]), int(notation[1]) - 1
+      toFile, toRank = 'abcdefgh'.index(notation[2]), int(notation[3]) - 1
+      promotion = PROMOTIONS.index(notation[4]) if len(notation) > 4 else 0
+      rows.append((key, toFile | toRank << 3 | fromFile << 6 | fromRank << 9 | promotion << 12, weight))
+  with open(path, 'wb') as f:
+    for key, move, weight in sorted(rows):
+      f.write(ENTRY.pack(key, move, weight, 0))
@@ -0,0 +1,184 @@
+'''
+Analysis results kept on disk in SQLite, so a position that was searched before with the same engine settings
+doesn't have to be searched again, even in a later run. Rows are keyed by the position (FEN without the move
+counters, and without an enpassant square nobody can use) plus the settings, e.g. 'depth=15;Skill Level=200;UCI_Elo=3000'.
+
+The database runs in WAL mode with a connection per thread, so several readers (the engine pool workers, other
+processes) can use it at once. When it grows past maxEntries rows (checked every EVICT_EVERY stores) the least
+recently used ones are dropped.
+
+Set CHESS_CACHE to choose the file (analysis.sqlite next to the code by default).
+'''
+import os
+import sqlite3
+import threading
+import time
+import ChessEngine
+import ChessHash
+
+CACHE_PATH = os.environ.get('CHESS_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analysis.sqlite'))
+EVICT_EVERY = 100 # check the size every this many stores
+
+defaultCaches = {} # path: AnalysisCache, see openCache
+
+
+'''
+The normalised position of a GameState: the first four FEN fields, with the enpassant square only when a pawn can
+take on it (the same rule the zobrist key uses)
+'''
+def positionKey(gs):
+  fields = gs.toFEN().split()[:4]
+  if ChessHash.enpassantKey(gs.board, gs.enpassantPossible, gs.whiteToMove) == 0:
+    fields[3] = '-'
+  return ' '.join(fields)
+
+
+'''
+Settings dict to the string stored with each row, sorted so the order they are given in doesn't matter
+'''
+def settingsKey(settings):
+  return ';'.join(str(name) + '=' + str(settings[name]) for name in sorted(settings))
+
+
+'''
+The score of a parsed UCI info line (see ChessUCI.parseInfo) as stored in the cache, 'cp 31' or 'mate 3'
+'''
+def scoreText(info):
+  score = info.get('score')
+  if not score:
+    return None
+  kind = 'mate' if 'mate' in score else 'cp'
+  return kind + ' ' + str(score.get(kind))
+
+
+class AnalysisCache():
+  def __init__(self, path=None, maxEntries=100000):
+    self.path = path or CACHE_PATH
+    self.maxEntries = maxEntries
+    self.local = threading.local() # sqlite connections can't be shared between threads
+    self.lock = threading.Lock() # for the counters
+    self.hits = 0
+    self.misses = 0
+    self.stores = 0
+    connection = self.connection()
+    connection.execute('PRAGMA journal_mode=WAL') # readers don't block each other or the writer
+    connection.execute('CREATE TABLE IF NOT EXISTS analysis (position TEXT NOT NULL, settings TEXT NOT NULL, '
+                       'bestmove TEXT, score TEXT, depth INTEGER, lastUsed REAL NOT NULL, '
+                       'PRIMARY KEY (position, settings))')
+    connection.execute('CREATE INDEX IF NOT EXISTS analysisLastUsed ON analysis (lastUsed)')
+    connection.commit()
+
+  def connection(self):
+    connection = getattr(self.local, 'connection', None)
+    if connection is None:
+      connection = self.local.connection = sqlite3.connect(self.path, timeout=30)
+    return connection
+
+  '''
+  The cached (bestmove, score, depth) for a GameState (or a positionKey) and settings dict, None if there isn't one.
+  score is in UCI form, 'cp 31' or 'mate 3'
+  '''
+  def get(self, position, settings):
+    if not isinstance(position, str):
+      position = positionKey(position)
+    settings = settingsKey(settings)
+    connection = self.connection()
+    row = connection.execute('SELECT bestmove, score, depth FROM analysis WHERE position = ? AND settings = ?',
+                             (position, settings)).fetchone()
+    with self.lock:
+      if row is None:
+        self.misses += 1
+      else:
+        self.hits += 1
+    if row is not None:
+      try:
+        connection.execute('UPDATE analysis SET lastUsed = ? WHERE position = ? AND settings = ?',
+                           (time.time(), position, settings))
+        connection.commit()
+      except sqlite3.OperationalError: # another writer holds the lock, the row just looks a little older
+        pass
+    return row
+
+  def put(self, position, settings, bestMove, score=None, depth=None):
+    if not isinstance(position, str):
+      position = positionKey(position)
+    connection = self.connection()
+    connection.execute('INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?, ?, ?)',
+                       (position, settingsKey(settings), bestMove, score, depth, time.time()))
+    connection.commit()
+    with self.lock:
+      self.stores += 1
+      evict = self.stores % EVICT_EVERY == 0
+    if evict:
+      self.evict()
+
+  '''
+  Drop the least recently used rows until there are at most maxEntries
+  '''
+  def evict(self):
+    connection = self.connection()
+    extra = connection.execute('SELECT COUNT(*) FROM analysis').fetchone()[0] - self.maxEntries
+    if extra > 0:
+      connection.execute('DELETE FROM analysis WHERE rowid IN (SELECT rowid FROM analysis ORDER BY lastUsed LIMIT ?)',
+                         (extra,))
+      connection.commit()
+
+  '''
+  Copy the rows of another cache file (e.g. from an earlier run or another machine) into this one. Rows this
+  cache already has are kept. Returns how many rows were added
+  '''
+  def importFrom(self, path):
+    connection = self.connection()
+    before = len(self)
+    connection.execute('ATTACH DATABASE ? AS other', (path,))
+    try:
+      connection.execute('INSERT OR IGNORE INTO analysis SELECT * FROM other.analysis')
+      connection.commit()
+    finally:
+      connection.execute('DETACH DATABASE other')
+    self.evict()
+    return len(self) - before
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {'entries': len(self), 'hits': self.hits, 'misses': self.misses, 'stores': self.stores,
+            'hitRate': self.hits / lookups if lookups else 0.0}
+
+  def clear(self):
+    connection = self.connection()
+    connection.execute('DELETE FROM analysis')
+    connection.commit()
+
+  def close(self): # closes this thread's connection
+    connection = getattr(self.local, 'connection', None)
+    if connection is not None:
+      connection.close()
+      self.local.connection = None
+
+  def __len__(self):
+    return self.connection().execute('SELECT COUNT(*) FROM analysis').fetchone()[0]
+
+
+'''
+The cache at path (CACHE_PATH by default), opened once and shared
+'''
+def openCache(path=None):
+  path = path or CACHE_PATH
+  if path not in defaultCaches:
+    defaultCaches[path] = AnalysisCache(path)
+  return defaultCaches[path]
+
+
+'''
+positionKey of a fen (the start position if None) plus moves in long algebraic notation
+'''
+def gamePositionKey(fen=None, moves=()):
+  gs = ChessEngine.GameState(fen)
+  for notation in moves:
+    for move in gs.getValidMoves():
+      if move.getChessNotation() == notation:
+        gs.makeMove(move)
+        break
+    else:
+      raise ValueError("Illegal move '" + notation + "' in " + gs.toFEN())
+  return positionKey(gs)
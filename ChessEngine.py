@@ -1,8 +1,16 @@
+import os
+from collections import OrderedDict
+import ChessHash
+import ChessProfile
+
 '''
 This class is responsible for all the information about the current state of the chess game. It will also be responsible for determining the valid moves at the current state. It will also have a move log.
 '''
 class GameState():
-  def __init__(self):
+  '''
+  Starts from the normal start position, or from the position in fen if one is given (see loadFEN)
+  '''
+  def __init__(self, fen=None):
     # board is a 8x8 2d list, and each lemenet of the list has 2 characters
     # the first character assigns the color (b,w)
     # the second character assigns the type of piece(k,q,r,b,n,p)
@@ -19,31 +27,133 @@ class GameState():
     self.moveFunctions = {'p': self.getPawnMoves, 'R': self.getRookMoves, 'N': self.getKnightMoves,
                           'B': self.getBishopMoves, 'Q': self.getQueenMoves, 'K': self.getKingMoves}
 
-    self.whiteToMove = True # white goes first
+    if fen is None:
+      self.loadPosition(self.board, True, CastleRights(True, True, True, True), ())
+    else:
+      self.loadFEN(fen)
+
+  '''
+  Make a GameState straight from a FEN string, without replaying any moves. Works for subclasses too
+  '''
+  @classmethod
+  def fromFEN(cls, fen):
+    return cls(fen)
+
+
+  '''
+  Set up the position from a board (8x8 list like above), the player to move, the castling rights, the
+  enpassant square and the move counters. Everything that depends on the position is rebuilt and the logs start empty
+  '''
+  def loadPosition(self, board, whiteToMove, castleRights, enpassantPossible, halfmoveClock=0, fullmoveNumber=1):
+    self.board = [row[:] for row in board]
+    self.whiteToMove = whiteToMove
+    self.halfmoveClock = halfmoveClock # moves since the last capture or pawn move, for the 50 move rule
+    self.fullmoveNumber = fullmoveNumber # starts at 1 and goes up after every black move
     self.moveLog = [] # make a new movelog
-    self.whiteKingLocation = (7, 4) # starting location of white king
-    self.blackKingLocation = (0, 4) # starting location of black king
+    # where every piece is, {piece: set of (row, col)}, so the move generators don't have to scan all 64 squares
+    self.pieceLocations = {piece: set() for piece in PIECES}
+    for r in range(8):
+      for c in range(8):
+        if self.board[r][c] != '--':
+          self.pieceLocations[self.board[r][c]].add((r, c))
     self.checkmate = False # set checkmate to false
     self.stalemate = False # set stalemate to false
-    self.enpassantPossible = () # coordinates for the square where enpassant is possible
-    self.currentCastlingRight = CastleRights(True, True, True, True) # castling rights for the current state of the game
-    self.castleRightsLog = [CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks, 
-                                         self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)] # log of castling rights so we can undo
+    self.enpassantPossible = enpassantPossible # coordinates for the square where enpassant is possible
+    self.currentCastlingRight = CastleRights(castleRights.wks, castleRights.bks, castleRights.wqs, castleRights.bqs) # castling rights for the current state of the game, changed in place
+    # what undoMove can't get back from the move itself, one packed int per move (see STATE_ENPASSANT_SHIFT)
+    self.stateStack = [0] * STATE_STACK_SIZE
+    self.stateCount = 0 # records in use
+    self.zobristKey = ChessHash.computeKey(self) # 64 bit key for the position, updated as moves are made
+    self.zobristLog = [] # keys of the earlier positions so we can undo and find repetitions
+
+  '''
+  Set up the position from a FEN string, raises ValueError if it can't be read
+  '''
+  def loadFEN(self, fen):
+    self.loadPosition(*parseFEN(fen))
+
+  '''
+  FEN string of the current position
+  '''
+  def toFEN(self):
+    ranks = []
+    for row in self.board:
+      rank = ''
+      empty = 0
+      for piece in row:
+        if piece == '--':
+          empty += 1
+          continue
+        if empty:
+          rank += str(empty)
+          empty = 0
+        letter = 'P' if piece[1] == 'p' else piece[1]
+        rank += letter if piece[0] == 'w' else letter.lower()
+      if empty:
+        rank += str(empty)
+      ranks.append(rank)
+    rights = self.currentCastlingRight
+    castling = ('K' if rights.wks else '') + ('Q' if rights.wqs else '') + ('k' if rights.bks else '') + ('q' if rights.bqs else '')
+    if self.enpassantPossible:
+      enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+    else:
+      enpassant = '-'
+    return ' '.join(('/'.join(ranks), 'w' if self.whiteToMove else 'b', castling or '-', enpassant,
+                     str(self.halfmoveClock), str(self.fullmoveNumber)))
+
+  '''
+  The kings are kept in pieceLocations like every other piece
+  '''
+  @property
+  def whiteKingLocation(self): # location of white king
+    return next(iter(self.pieceLocations['wK']), None)
+
+  @property
+  def blackKingLocation(self): # location of black king
+    return next(iter(self.pieceLocations['bK']), None)
 
 
   '''
   Takes a move as a parameter and executes it (this will not work for castling, pawn promotion, and en-passant)
   '''
   def makeMove(self, move):
+    # save the castling rights, enpassant square, captured piece and clock for undoMove
+    enpassant = self.enpassantPossible
+    state = (self.currentCastlingRight.bits() | (enpassant[0] * 8 + enpassant[1] + 1 if enpassant else 0) << STATE_ENPASSANT_SHIFT |
+             PIECE_INDEX[move.pieceCaptured] << STATE_CAPTURED_SHIFT | self.halfmoveClock << STATE_CLOCK_SHIFT)
+    if self.stateCount == len(self.stateStack): # deeper than ever before, double the stack
+      self.stateStack.extend([0] * len(self.stateStack))
+    self.stateStack[self.stateCount] = state
+    self.stateCount += 1
+    # take the moved and captured pieces and the old castling/enpassant state out of the key
+    key = self.zobristKey
+    self.zobristLog.append(key)
+    key ^= ChessHash.CASTLE_KEYS[state & 15] ^ ChessHash.enpassantKey(self.board, self.enpassantPossible, self.whiteToMove)
+    key ^= ChessHash.PIECE_KEYS[move.pieceMoved][move.startRow * 8 + move.startCol]
+    if move.isEnpassantMove:
+      key ^= ChessHash.PIECE_KEYS[move.pieceCaptured][move.startRow * 8 + move.endCol]
+    elif move.pieceCaptured != '--':
+      key ^= ChessHash.PIECE_KEYS[move.pieceCaptured][move.endRow * 8 + move.endCol]
+
     self.board[move.startRow][move.startCol] = "--"
     self.board[move.endRow][move.endCol] = move.pieceMoved
     self.moveLog.append(move) # log the move so we can undo it later
+    # move counters
+    if move.pieceMoved[1] == 'p' or move.pieceCaptured != '--':
+      self.halfmoveClock = 0
+    else:
+      self.halfmoveClock += 1
+    if not self.whiteToMove:
+      self.fullmoveNumber += 1
     self.whiteToMove = not self.whiteToMove # swap players
-    # update the kings location if moved
-    if move.pieceMoved == 'wK':
-      self.whiteKingLocation = (move.endRow, move.endCol)
-    elif move.pieceMoved == 'bK':
-      self.blackKingLocation = (move.endRow, move.endCol)
+    # update the piece lists (this also moves the kings)
+    locations = self.pieceLocations
+    locations[move.pieceMoved].remove((move.startRow, move.startCol))
+    if move.isEnpassantMove:
+      locations[move.pieceCaptured].remove((move.startRow, move.endCol))
+    elif move.pieceCaptured != '--':
+      locations[move.pieceCaptured].remove((move.endRow, move.endCol))
+    locations[move.pieceMoved[0] + 'Q' if move.isPawnPromotion else move.pieceMoved].add((move.endRow, move.endCol))
 
     # pawn promotion
     if move.isPawnPromotion:
@@ -61,17 +171,31 @@ class GameState():
 
     # castle move
     if move.isCastleMove:
+      rookLocations = locations[move.pieceMoved[0] + 'R']
       if move.endCol - move.startCol == 2: # kingside castle move
         self.board[move.endRow][move.endCol-1] = self.board[move.endRow][move.endCol+1] # moves the rook
         self.board[move.endRow][move.endCol+1] = '--' # erase old rook
+        rookLocations.remove((move.endRow, move.endCol+1))
+        rookLocations.add((move.endRow, move.endCol-1))
       else: # queenside castle move
         self.board[move.endRow][move.endCol+1] = self.board[move.endRow][move.endCol-2] # moves the rook
         self.board[move.endRow][move.endCol-2] = '--' # erase old rook
+        rookLocations.remove((move.endRow, move.endCol-2))
+        rookLocations.add((move.endRow, move.endCol+1))
 
     # Update castling rights - whenever it is a rook or a king move
     self.updateCastleRights(move)
-    self.castleRightsLog.append(CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
-                                              self.currentCastlingRight.wqs, self.currentCastlingRight.bqs))
+
+    # put the piece on its new square (the promoted piece or the castled rook) and the new state into the key
+    key ^= ChessHash.PIECE_KEYS[self.board[move.endRow][move.endCol]][move.endRow * 8 + move.endCol]
+    if move.isCastleMove:
+      rookPiece = move.pieceMoved[0] + 'R'
+      if move.endCol - move.startCol == 2: # kingside, rook goes from col 7 to col 5
+        key ^= ChessHash.PIECE_KEYS[rookPiece][move.endRow * 8 + move.endCol + 1] ^ ChessHash.PIECE_KEYS[rookPiece][move.endRow * 8 + move.endCol - 1]
+      else: # queenside, rook goes from col 0 to col 3
+        key ^= ChessHash.PIECE_KEYS[rookPiece][move.endRow * 8 + move.endCol - 2] ^ ChessHash.PIECE_KEYS[rookPiece][move.endRow * 8 + move.endCol + 1]
+    key ^= ChessHash.castleKey(self.currentCastlingRight) ^ ChessHash.enpassantKey(self.board, self.enpassantPossible, self.whiteToMove)
+    self.zobristKey = key ^ ChessHash.TURN_KEY # the other player is to move now
  
 
   '''
@@ -80,35 +204,50 @@ class GameState():
   def undoMove(self):
     if len(self.moveLog) != 0: # make sure that there is a move to undo
       move = self.moveLog.pop()
+      self.stateCount -= 1
+      state = self.stateStack[self.stateCount]
+      # update the piece lists (this also moves the kings back)
+      locations = self.pieceLocations
+      locations[self.board[move.endRow][move.endCol]].remove((move.endRow, move.endCol)) # the moved or promoted piece
+      locations[move.pieceMoved].add((move.startRow, move.startCol))
+      if move.isEnpassantMove:
+        locations[move.pieceCaptured].add((move.startRow, move.endCol))
+      elif move.pieceCaptured != '--':
+        locations[move.pieceCaptured].add((move.endRow, move.endCol))
       self.board[move.startRow][move.startCol] = move.pieceMoved
-      self.board[move.endRow][move.endCol] = move.pieceCaptured
+      self.board[move.endRow][move.endCol] = STATE_PIECES[state >> STATE_CAPTURED_SHIFT & 15]
       self.whiteToMove = not self.whiteToMove # switch turns back
-      # update kings position if needed
-      if move.pieceMoved == "wK": # if the white king was moved
-        self.whiteKingLocation = (move.startRow, move.startCol) # set the white king location
-      elif move.pieceMoved == "bK": # if the black king was moved
-        self.blackKingLocation = (move.startRow, move.startCol) # set the black king location
+      self.halfmoveClock = state >> STATE_CLOCK_SHIFT
+      if not self.whiteToMove:
+        self.fullmoveNumber -= 1
       # undo enpassant move
       if move.isEnpassantMove:
         self.board[move.endRow][move.endCol] = '--' # leave landing square blank
         self.board[move.startRow][move.endCol] = move.pieceCaptured # put the captured piece back
-        self.enpassantPossible = (move.endRow, move.endCol) # set the enpassantPossible to the square where the pawn was captured
-      # undo 2 square pawn advance
-      if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-        self.enpassantPossible = ()
-      # undo castling rights
-      self.castleRightsLog.pop() # get rid of the new castle rights from the move we are undoing
-      newRights = self.castleRightsLog[-1] # set the current castle rights to the last one in the list
-      self.currentCastlingRight = CastleRights(newRights.wks, newRights.bks, newRights.wqs, newRights.bqs) # set the current castle rights to the last one in the list
+      # the enpassant square and castling rights go back to what they were before the move
+      enpassant = state >> STATE_ENPASSANT_SHIFT & 127
+      self.enpassantPossible = SQUARES[enpassant - 1] if enpassant else ()
+      self.currentCastlingRight.setBits(state & 15)
       # undo castle move
       if move.isCastleMove:
+        rookLocations = locations[move.pieceMoved[0] + 'R']
         if move.endCol - move.startCol == 2: # kingside
           self.board[move.endRow][move.endCol+1] = self.board[move.endRow][move.endCol-1] # move the rook back
           self.board[move.endRow][move.endCol-1] = '--' # leave blank space where the rook was
+          rookLocations.remove((move.endRow, move.endCol-1))
+          rookLocations.add((move.endRow, move.endCol+1))
         else: # queenside
           self.board[move.endRow][move.endCol-2] = self.board[move.endRow][move.endCol+1] # move the rook back
           self.board[move.endRow][move.endCol+1] = '--' # leave blank space where the rook was
-    
+          rookLocations.remove((move.endRow, move.endCol+1))
+          rookLocations.add((move.endRow, move.endCol-2))
+      self.zobristKey = self.zobristLog.pop() # the key from before the move
+
+  '''
+  How many times the current position was reached before (same pieces, player to move, castling and enpassant)
+  '''
+  def repetitionCount(self):
+    return self.zobristLog.count(self.zobristKey)
 
   '''
   Update the castle rights given the move
@@ -149,36 +288,311 @@ class GameState():
   '''
   All moves considering checks
   '''
+  @ChessProfile.profiled('getValidMoves', len) # items are the moves generated
   def getValidMoves(self):
-    tempEnpassantPossible = self.enpassantPossible # save the current enpassantPossible
-    tempCastleRights = CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks,
-                                    self.currentCastlingRight.wqs, self.currentCastlingRight.bqs) # save the current castle rights
-    # 1.) generate all possible moves
-    moves = self.getAllPossibleMoves()
-
-    # 2,) for each move, make the move
-    for i in range(len(moves)-1, -1, -1): # when removing from a list, go backwards in order not to skip
-      self.makeMove(moves[i])
-      # 3.) generate all opponent moves
-      # 4.) for each of those moves, see if they attack the king
-      self.whiteToMove = not self.whiteToMove # swap moves since make move switches the turns, so we switch back to check for checks
-      if self.inCheck():
-        moves.remove(moves[i]) # 5.) if they do attack the king, not valid move 
-      self.whiteToMove = not self.whiteToMove
-      self.undoMove() # undo the move
-    if len(moves) == 0: # either checkmate or stalemate
-      if self.inCheck(): # if in check
-        self.checkmate = True # set checkmate to true
+    board = self.board
+    return [Move.fromCode(code, board) for code in self.getValidMoveCodes()]
+
+  '''
+  The legal moves of the current position as a LegalMoves, indexed by start square and by (start, end) for the UI.
+  Results are shared through legalMoveCache by zobrist key, so going back to an earlier position (undo, a new game)
+  doesn't generate the moves again
+  '''
+  def getLegalMoves(self):
+    legalMoves = legalMoveCache.get(self.zobristKey)
+    if legalMoves is None:
+      legalMoves = LegalMoves(self.getValidMoves(), self.checkmate, self.stalemate)
+      legalMoveCache.put(self.zobristKey, legalMoves)
+    else:
+      self.checkmate = legalMoves.checkmate
+      self.stalemate = legalMoves.stalemate
+    return legalMoves
+
+  '''
+  The legal moves of the piece on (row, col)
+  '''
+  def getMovesFrom(self, r, c):
+    return self.getLegalMoves().fromSquare.get((r, c), [])
+
+  '''
+  The legal move from startSq to endSq ((row, col) tuples), None if there isn't one
+  '''
+  def getMove(self, startSq, endSq):
+    return self.getLegalMoves().byStartEnd.get((startSq, endSq))
+
+  '''
+  The legal moves one at a time, in the order a search wants to try them: the hash move (a moveID, if it is legal),
+  captures and promotions (most valuable victim first, then least valuable attacker), quiet moves, then castling.
+  Legality checks and Move objects are only done for the moves that are asked for, so stopping early (a cutoff) skips
+  the rest. The position has to be the same again whenever the next move is asked for (make and undo in between is
+  fine). Unlike getValidMoves it leaves checkmate/stalemate alone
+  '''
+  def generateMoves(self, hashMove=None):
+    inCheck, doubleCheck, isLegal = self.legalCodeTest()
+    board = self.board
+    kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+    if doubleCheck: # only the king can move
+      codes = []
+      self.getKingMoves(kingRow, kingCol, codes)
+    else:
+      codes = self.getAllPossibleMoveCodes()
+    hashCode = None
+    castles = None
+    if hashMove is not None: # moveID is startRow * 1000 + startCol * 100 + endRow * 10 + endCol
+      hashSquares = (hashMove // 1000 * 8 + hashMove // 100 % 10) | (hashMove // 10 % 10 * 8 + hashMove % 10) << 6
+      for code in codes:
+        if code & 4095 == hashSquares:
+          if isLegal(code):
+            hashCode = code
+          break
+      else: # not a normal move, it could be castling
+        if not inCheck and (hashSquares & 63) == kingRow * 8 + kingCol:
+          castles = []
+          self.getCastleMoves(kingRow, kingCol, castles)
+          for code in castles:
+            if code & 4095 == hashSquares:
+              hashCode = code
+      if hashCode is not None:
+        yield Move.fromCode(hashCode, board)
+    captures = []
+    quiets = []
+    for code in codes:
+      if board[code >> 9 & 7][code >> 6 & 7] != '--' or code & (ENPASSANT_FLAG | PROMOTION_FLAG):
+        captures.append(code)
       else:
-        self.stalemate = True # set stalemate to true
+        quiets.append(code)
+    def captureOrder(code):
+      victim = 'p' if code & ENPASSANT_FLAG else board[code >> 9 & 7][code >> 6 & 7][1]
+      return -ORDER_VALUES[victim] * 8 + ORDER_VALUES[board[code >> 3 & 7][code & 7][1]]
+    captures.sort(key=captureOrder)
+    for stage in (captures, quiets):
+      for code in stage:
+        if code != hashCode and isLegal(code):
+          yield Move.fromCode(code, board)
+    if not inCheck: # can't castle out of check
+      if castles is None:
+        castles = []
+        self.getCastleMoves(kingRow, kingCol, castles)
+      for code in castles:
+        if code != hashCode:
+          yield Move.fromCode(code, board)
+
+  '''
+  True if the player to move has any legal move. Stops at the first one it finds, king moves first since they are
+  the only ones out of a double check
+  '''
+  def hasLegalMove(self):
+    cached = legalMoveCache.peek(self.zobristKey) # a probe, not a lookup the hit rate should count
+    if cached is not None:
+      return len(cached.moves) > 0
+    inCheck, doubleCheck, isLegal = self.legalCodeTest()
+    kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+    codes = []
+    self.getKingMoves(kingRow, kingCol, codes)
+    for code in codes:
+      if isLegal(code):
+        return True
+    if doubleCheck:
+      return False
+    for piece in (WHITE_PIECES if self.whiteToMove else BLACK_PIECES):
+      if piece[1] == 'K':
+        continue
+      moveFunction = self.moveFunctions[piece[1]]
+      for r, c in self.pieceLocations[piece]:
+        codes = []
+        moveFunction(r, c, codes)
+        for code in codes:
+          if isLegal(code):
+            return True
+    # castling needs the square next to the king to be empty and safe, so the king could have stepped there
+    return False
+
+  def isCheckmate(self):
+    return not self.hasLegalMove() and self.inCheck()
+
+  def isStalemate(self):
+    return not self.hasLegalMove() and not self.inCheck()
 
+  '''
+  What the staged generators need to check pseudo legal move codes one at a time: (in check, double check,
+  isLegal(code)). Castling isn't covered, getCastleMoves only makes legal castle moves
+  '''
+  def legalCodeTest(self):
+    inCheck, pins, checks = self.checkForPinsAndChecks()
+    kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+    kingSq = kingRow * 8 + kingCol
+    doubleCheck = len(checks) > 1
+    validSquares = self.checkBlockSquares(kingRow, kingCol, checks)
+    def isLegal(code):
+      startSq = code & 63
+      endSq = code >> 6 & 63
+      if startSq == kingSq:
+        return not self.kingMoveIntoCheck(kingRow, kingCol, endSq >> 3, endSq & 7)
+      if doubleCheck:
+        return False
+      if code & ENPASSANT_FLAG:
+        return not self.enpassantIntoCheck(startSq >> 3, startSq & 7, endSq >> 3, endSq & 7)
+      pin = pins.get((startSq >> 3, startSq & 7))
+      if pin is not None and ((endSq >> 3) - (startSq >> 3)) * pin[1] != ((endSq & 7) - (startSq & 7)) * pin[0]:
+        return False
+      return validSquares is None or endSq in validSquares
+    return inCheck, doubleCheck, isLegal
+
+  '''
+  With one check, the squares (row * 8 + col) a piece other than the king can move to: the checking piece and the
+  squares between it and the king. None when there is no check
+  '''
+  def checkBlockSquares(self, kingRow, kingCol, checks):
+    if len(checks) != 1:
+      return None
+    checkRow, checkCol, dr, dc = checks[0]
+    if dr == 0 and dc == 0: # knight check, the knight has to be captured
+      return {checkRow * 8 + checkCol}
+    validSquares = set()
+    for i in range(1, 8):
+      endRow = kingRow + dr * i
+      endCol = kingCol + dc * i
+      validSquares.add(endRow * 8 + endCol)
+      if endRow == checkRow and endCol == checkCol:
+        break
+    return validSquares
+
+  '''
+  All moves considering checks as packed move codes (see Move.fromCode). Checks and pins are found once by looking
+  outwards from the king, so moves can be filtered directly instead of making every move and regenerating all of the
+  opponents moves. Move objects are only made for the moves callers get back from getValidMoves
+  '''
+  def getValidMoveCodes(self):
+    inCheck, pins, checks = self.checkForPinsAndChecks()
     if self.whiteToMove:
-      self.getCastleMoves(self.whiteKingLocation[0], self.whiteKingLocation[1], moves)
+      kingRow, kingCol = self.whiteKingLocation
     else:
-      self.getCastleMoves(self.blackKingLocation[0], self.blackKingLocation[1], moves)
-    self.enpassantPossible = tempEnpassantPossible # set the enpassantPossible back to what it was before
-    self.currentCastlingRight = tempCastleRights # set the castle rights back to what they were before
-    return moves
+      kingRow, kingCol = self.blackKingLocation
+    if len(checks) > 1: # double check, the king has to move
+      moves = []
+      self.getKingMoves(kingRow, kingCol, moves)
+    else:
+      moves = self.getAllPossibleMoveCodes()
+    validSquares = self.checkBlockSquares(kingRow, kingCol, checks) # None if there is no check
+
+    board = self.board
+    kingSq = kingRow * 8 + kingCol
+    legalMoves = []
+    for code in moves:
+      startSq = code & 63
+      endSq = code >> 6 & 63
+      if startSq == kingSq:
+        if not self.kingMoveIntoCheck(kingRow, kingCol, endSq >> 3, endSq & 7):
+          legalMoves.append(code)
+      elif code & ENPASSANT_FLAG: # can uncover checks along the rank, so just test it on the board
+        if not self.enpassantIntoCheck(startSq >> 3, startSq & 7, endSq >> 3, endSq & 7):
+          legalMoves.append(code)
+      else:
+        pin = pins.get((startSq >> 3, startSq & 7))
+        if pin is not None and ((endSq >> 3) - (startSq >> 3)) * pin[1] != ((endSq & 7) - (startSq & 7)) * pin[0]:
+          continue # pinned pieces can only move along the pin
+        if validSquares is not None and endSq not in validSquares:
+          continue # doesn't deal with the check
+        legalMoves.append(code)
+
+    if not inCheck: # can't castle out of check
+      self.getCastleMoves(kingRow, kingCol, legalMoves)
+    if len(legalMoves) == 0: # either checkmate or stalemate
+      if inCheck:
+        self.checkmate = True
+      else:
+        self.stalemate = True
+    else:
+      self.checkmate = False
+      self.stalemate = False
+    return legalMoves
+
+  '''
+  Returns if the player is in check, a dict of pinned pieces {(row, col): (dirRow, dirCol)} and a list of checks
+  [(row, col, dirRow, dirCol)] for the king of the player to move. Knight checks have a direction of (0, 0)
+  '''
+  def checkForPinsAndChecks(self):
+    pins = {}
+    checks = []
+    inCheck = False
+    if self.whiteToMove:
+      enemyColor, allyColor = 'b', 'w'
+      startRow, startCol = self.whiteKingLocation
+    else:
+      enemyColor, allyColor = 'w', 'b'
+      startRow, startCol = self.blackKingLocation
+    # check outwards from the king for pins and checks, keep track of pins
+    directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+    for j in range(len(directions)):
+      d = directions[j]
+      possiblePin = () # reset possible pins
+      for i in range(1, 8):
+        endRow = startRow + d[0] * i
+        endCol = startCol + d[1] * i
+        if 0 <= endRow < 8 and 0 <= endCol < 8: # on board
+          endPiece = self.board[endRow][endCol]
+          if endPiece[0] == allyColor:
+            if possiblePin == (): # 1st allied piece could be pinned
+              possiblePin = (endRow, endCol)
+            else: # 2nd allied piece, so no pin or check possible in this direction
+              break
+          elif endPiece[0] == enemyColor:
+            pieceType = endPiece[1]
+            # 5 possibilities here in this complex conditional
+            # 1.) orthogonally away from the king and piece is a rook
+            # 2.) diagonally away from the king and piece is a bishop
+            # 3.) 1 square away diagonally from the king and piece is a pawn
+            # 4.) any direction and piece is a queen
+            # 5.) any direction 1 square away and piece is a king (stops kings from walking next to each other)
+            if (0 <= j <= 3 and pieceType == 'R') or \
+                (4 <= j <= 7 and pieceType == 'B') or \
+                (i == 1 and pieceType == 'p' and ((enemyColor == 'w' and 6 <= j <= 7) or (enemyColor == 'b' and 4 <= j <= 5))) or \
+                (pieceType == 'Q') or (i == 1 and pieceType == 'K'):
+              if possiblePin == (): # no piece blocking, so check
+                inCheck = True
+                checks.append((endRow, endCol, d[0], d[1]))
+              else: # piece blocking so pin
+                pins[possiblePin] = d
+            break # enemy piece blocks anything further in this direction
+        else: # off board
+          break
+    # check for knight checks
+    knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+    for m in knightMoves:
+      endRow = startRow + m[0]
+      endCol = startCol + m[1]
+      if 0 <= endRow < 8 and 0 <= endCol < 8:
+        if self.board[endRow][endCol] == enemyColor + 'N': # enemy knight attacking the king
+          inCheck = True
+          checks.append((endRow, endCol, 0, 0))
+    return inCheck, pins, checks
+
+  '''
+  Determine if a king move would leave the king in check. The king is taken off its square first so it can't
+  hide behind itself from a sliding piece
+  '''
+  def kingMoveIntoCheck(self, startRow, startCol, endRow, endCol):
+    king = self.board[startRow][startCol]
+    self.board[startRow][startCol] = '--'
+    inCheck = self.squareUnderAttack(endRow, endCol)
+    self.board[startRow][startCol] = king
+    return inCheck
+
+  '''
+  Determine if an enpassant capture would leave the king in check. Both pawns leave their squares, which pins
+  can't describe, so the capture is tried out on the board
+  '''
+  def enpassantIntoCheck(self, startRow, startCol, endRow, endCol):
+    pawn = self.board[startRow][startCol]
+    capturedPawn = self.board[startRow][endCol]
+    self.board[startRow][startCol] = '--'
+    self.board[endRow][endCol] = pawn
+    self.board[startRow][endCol] = '--'
+    inCheck = self.inCheck()
+    self.board[startRow][startCol] = pawn
+    self.board[endRow][endCol] = '--'
+    self.board[startRow][endCol] = capturedPawn
+    return inCheck
         
   '''
   Determine if the current player is in check
@@ -190,68 +604,154 @@ class GameState():
       return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
 
   '''
-  Determine if the enemy can attack the square r, c
+  Determine if the enemy (or the given side) can attack the square r, c. Looks outwards from the square for each
+  kind of attacker and stops at the first one found, so nothing is allocated and the turn is left alone
   '''
-  def squareUnderAttack(self, r, c):
-    self.whiteToMove = not self.whiteToMove # switch to opponents POV
-    oppMoves = self.getAllPossibleMoves() 
-    self.whiteToMove = not self.whiteToMove # switch back
-    for move in oppMoves:
-      if move.endRow == r and move.endCol == c: # square is under attack
+  @ChessProfile.profiled('squareUnderAttack')
+  def squareUnderAttack(self, r, c, byWhite=None):
+    if byWhite is None:
+      byWhite = not self.whiteToMove # the enemy of the player to move
+    enemyColor = 'w' if byWhite else 'b'
+    board = self.board
+    # pawns attack diagonally forwards, so look diagonally backwards from the square
+    pawnRow = r + 1 if byWhite else r - 1
+    if 0 <= pawnRow < 8:
+      if c - 1 >= 0 and board[pawnRow][c - 1] == enemyColor + 'p':
+        return True
+      if c + 1 <= 7 and board[pawnRow][c + 1] == enemyColor + 'p':
+        return True
+    for m in ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)): # knights
+      endRow = r + m[0]
+      endCol = c + m[1]
+      if 0 <= endRow < 8 and 0 <= endCol < 8 and board[endRow][endCol] == enemyColor + 'N':
         return True
+    for d in ((-1, 0), (0, -1), (1, 0), (0, 1)): # rooks and queens
+      for i in range(1, 8):
+        endRow = r + d[0] * i
+        endCol = c + d[1] * i
+        if not (0 <= endRow < 8 and 0 <= endCol < 8): # off board
+          break
+        endPiece = board[endRow][endCol]
+        if endPiece != '--': # first piece in this direction blocks anything further
+          if endPiece[0] == enemyColor and (endPiece[1] == 'R' or endPiece[1] == 'Q' or (i == 1 and endPiece[1] == 'K')):
+            return True
+          break
+    for d in ((-1, -1), (-1, 1), (1, -1), (1, 1)): # bishops and queens
+      for i in range(1, 8):
+        endRow = r + d[0] * i
+        endCol = c + d[1] * i
+        if not (0 <= endRow < 8 and 0 <= endCol < 8): # off board
+          break
+        endPiece = board[endRow][endCol]
+        if endPiece != '--':
+          if endPiece[0] == enemyColor and (endPiece[1] == 'B' or endPiece[1] == 'Q' or (i == 1 and endPiece[1] == 'K')):
+            return True
+          break
     return False
 
+  '''
+  Returns the set of (row, col) squares attacked by the given side. Used when several squares have to be tested at
+  once, like the squares the king passes over when castling
+  '''
+  def getAttackedSquares(self, byWhite):
+    attacked = set()
+    board = self.board
+    for piece in (WHITE_PIECES if byWhite else BLACK_PIECES):
+      pieceType = piece[1]
+      for r, c in self.pieceLocations[piece]:
+        if pieceType == 'p':
+          endRow = r - 1 if byWhite else r + 1
+          if 0 <= endRow < 8:
+            if c - 1 >= 0:
+              attacked.add((endRow, c - 1))
+            if c + 1 <= 7:
+              attacked.add((endRow, c + 1))
+        elif pieceType == 'N' or pieceType == 'K':
+          if pieceType == 'N':
+            offsets = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+          else:
+            offsets = ((-1, -1), (-1, 0), (-1, 1), (0, 1), (0, -1), (1, -1), (1, 0), (1, 1))
+          for m in offsets:
+            endRow = r + m[0]
+            endCol = c + m[1]
+            if 0 <= endRow < 8 and 0 <= endCol < 8:
+              attacked.add((endRow, endCol))
+        else: # sliding pieces
+          if pieceType == 'R':
+            directions = ((-1, 0), (0, -1), (1, 0), (0, 1))
+          elif pieceType == 'B':
+            directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+          else:
+            directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+          for d in directions:
+            for i in range(1, 8):
+              endRow = r + d[0] * i
+              endCol = c + d[1] * i
+              if not (0 <= endRow < 8 and 0 <= endCol < 8):
+                break
+              attacked.add((endRow, endCol))
+              if board[endRow][endCol] != '--': # attacks stop at the first piece
+                break
+    return attacked
+
 
   '''
   All moves without considering checks
   '''
   def getAllPossibleMoves(self):
+    board = self.board
+    return [Move.fromCode(code, board) for code in self.getAllPossibleMoveCodes()]
+
+  '''
+  All moves without considering checks as packed move codes
+  '''
+  def getAllPossibleMoveCodes(self):
     moves = []
-    for r in range(len(self.board)):
-      for c in range(len(self.board[r])):
-        turn = self.board[r][c][0]
-        if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):
-          piece = self.board[r][c][1]
-          self.moveFunctions[piece](r, c, moves) # calls the appropriate move function based on piece type
+    for piece in (WHITE_PIECES if self.whiteToMove else BLACK_PIECES): # only visit the squares with our pieces
+      moveFunction = self.moveFunctions[piece[1]] # the appropriate move function based on piece type
+      for r, c in self.pieceLocations[piece]:
+        moveFunction(r, c, moves)
     return moves
 
   '''
-  Get all pawn moves for the pawn located at row, col and add these moves to the list
+  Get all pawn moves for the pawn located at row, col and add these moves (as move codes) to the list
   '''
   def getPawnMoves(self, r, c, moves):
+    start = r * 8 + c
     if self.whiteToMove: # white pawn moves
+      promotion = PROMOTION_FLAGS if r == 1 else 0 # pawns moving to the last row promote
       if self.board[r-1][c] == "--": # 1 square pawn movement
-        moves.append(Move((r, c), (r-1, c), self.board))
+        moves.append(start | (start - 8) << 6 | promotion)
         if r == 6 and self.board[r-2][c] == "--": # 2 square pawn movement
-          moves.append(Move((r,c), (r-2, c), self.board))
+          moves.append(start | (start - 16) << 6)
       if c-1 >= 0: # captures to left
         if self.board[r-1][c-1][0] == 'b': # enemy piece to capture
-          moves.append(Move((r, c), (r-1, c-1), self.board))
+          moves.append(start | (start - 9) << 6 | promotion)
         elif (r-1, c-1) == self.enpassantPossible:
-          moves.append(Move((r, c), (r-1, c-1), self.board, isEnpassantMove = True))
+          moves.append(start | (start - 9) << 6 | ENPASSANT_FLAG)
       if c+1 <= 7: # captures to right
         if self.board[r-1][c+1][0] == 'b': # enemy piece to capture
-          moves.append(Move((r, c), (r-1, c+1), self.board))
+          moves.append(start | (start - 7) << 6 | promotion)
         elif (r-1, c+1) == self.enpassantPossible:
-          moves.append(Move((r, c), (r-1, c+1), self.board, isEnpassantMove = True))
+          moves.append(start | (start - 7) << 6 | ENPASSANT_FLAG)
 
     else: # black pawn moves
+      promotion = PROMOTION_FLAGS if r == 6 else 0
       if self.board[r+1][c] == "--": # 1 square move
-        moves.append(Move((r, c), (r + 1, c), self.board))
+        moves.append(start | (start + 8) << 6 | promotion)
         if r == 1 and self.board[r + 2][c] == "--": #2 square move
-          moves.append(Move((r, c), ( r + 2, c), self.board))
+          moves.append(start | (start + 16) << 6)
       # captures
       if c - 1 >= 0: # capture to left
         if self.board[r + 1][c -1][0] == "w":
-          moves.append(Move((r, c), (r + 1, c - 1), self.board))
+          moves.append(start | (start + 7) << 6 | promotion)
         elif (r + 1, c - 1) == self.enpassantPossible:
-          moves.append(Move((r, c), (r + 1, c - 1), self.board, isEnpassantMove = True))
+          moves.append(start | (start + 7) << 6 | ENPASSANT_FLAG)
       if c + 1 <= 7: # capture to right
         if self.board[r + 1][c + 1][0] == 'w':
-          moves.append(Move((r, c), (r + 1, c+ 1), self.board))
+          moves.append(start | (start + 9) << 6 | promotion)
         elif (r + 1, c + 1) == self.enpassantPossible:
-          moves.append(Move((r, c), (r + 1, c + 1), self.board, isEnpassantMove = True))
-    # add pawn promotions later
+          moves.append(start | (start + 9) << 6 | ENPASSANT_FLAG)
 
   '''
   Get all the rook moves for the rook located at row, col and add these moves to the list
@@ -259,6 +759,7 @@ class GameState():
   def getRookMoves(self, r, c, moves):
     directions = ((-1, 0), (0, -1), (1, 0), (0, 1)) # up down right left
     enemyColor = "b" if self.whiteToMove else "w"
+    start = r * 8 + c
     for d in directions:
       for i in range(1, 8): # rook can move max of 7 squares
         endRow = r + d[0] * i
@@ -266,9 +767,9 @@ class GameState():
         if 0 <= endRow < 8 and 0 <= endCol < 8: # on board
           endPiece = self.board[endRow][endCol]
           if endPiece == "--": # if its empty space and on board 
-            moves.append(Move((r, c), (endRow, endCol), self.board))
+            moves.append(start | (endRow * 8 + endCol) << 6)
           elif endPiece[0] == enemyColor: # a enemy piece valid
-            moves.append(Move((r, c), (endRow, endCol), self.board))
+            moves.append(start | (endRow * 8 + endCol) << 6)
             break
           else: # if friendly piece 
             break
@@ -281,13 +782,14 @@ class GameState():
   def getKnightMoves(self, r, c, moves):
     knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)) # the L shape directions
     allyColor = "w" if self.whiteToMove else "b"
+    start = r * 8 + c
     for m in knightMoves:
       endRow = r + m[0]
       endCol = c + m[1]
       if 0 <= endRow < 8 and 0 <= endCol < 8: # on board
         endPiece = self.board[endRow][endCol]
         if endPiece[0] != allyColor: #not a ally piece (empty/enemy)
-          moves.append(Move((r, c), (endRow, endCol), self.board))
+          moves.append(start | (endRow * 8 + endCol) << 6)
 
   '''
   Get all the bishop moves for the bishop located at row, col and add these moves to the list
@@ -295,6 +797,7 @@ class GameState():
   def getBishopMoves(self, r, c, moves):
     directions = ((-1, -1), (-1, 1), (1, -1), (1, 1)) # 4 diagnol directions
     enemyColor = "b" if self.whiteToMove else "w"
+    start = r * 8 + c
     for d in directions:
       for i in range(1, 8): # bishop can move max of 7 squares
         endRow = r + d[0] * i
@@ -302,9 +805,9 @@ class GameState():
         if 0 <= endRow < 8 and 0 <= endCol < 8: # on board
           endPiece = self.board[endRow][endCol]
           if endPiece == "--": # if its empty space and on board 
-            moves.append(Move((r, c), (endRow, endCol), self.board))
+            moves.append(start | (endRow * 8 + endCol) << 6)
           elif endPiece[0] == enemyColor: # a enemy piece valid
-            moves.append(Move((r, c), (endRow, endCol), self.board))
+            moves.append(start | (endRow * 8 + endCol) << 6)
             break
           else: # if friendly piece 
             break
@@ -324,35 +827,45 @@ class GameState():
   def getKingMoves(self, r, c, moves):
     kingMoves = ((-1, -1), (-1, 0), (-1, 1,), (0, 1), (0, -1), (1, -1), (1, 0), (1, 1)) # possible 8 landing squares
     allyColor = "w" if self.whiteToMove else "b"
+    start = r * 8 + c
     for i in range (8):
       endRow = r + kingMoves[i][0]
       endCol = c + kingMoves[i][1]
       if 0 <= endRow < 8 and 0 <= endCol <8: # on board
         endPiece = self.board[endRow][endCol]
         if endPiece[0] != allyColor: # not an ally piece (empty/enemy)
-          moves.append(Move((r, c), (endRow, endCol), self.board))
+          moves.append(start | (endRow * 8 + endCol) << 6)
 
   '''
-  Generate all valid castle moves for the king at (r, c) and add them to the list of moves
+  Generate all valid castle moves for the king at (r, c) and add them to the list of move codes
   '''
   def getCastleMoves(self, r, c, moves):
-    if self.squareUnderAttack(r, c):
+    canKingside = (self.whiteToMove and self.currentCastlingRight.wks) or (not self.whiteToMove and self.currentCastlingRight.bks)
+    canQueenside = (self.whiteToMove and self.currentCastlingRight.wqs) or (not self.whiteToMove and self.currentCastlingRight.bqs)
+    if not canKingside and not canQueenside:
+      return
+    attackedSquares = self.getAttackedSquares(not self.whiteToMove) # every square the enemy attacks, found once
+    if (r, c) in attackedSquares:
       return # can't castle when in check
-    if (self.whiteToMove and self.currentCastlingRight.wks) or (not self.whiteToMove and self.currentCastlingRight.bks):
-      self.getKingsideCastlemoves(r, c, moves)
-    if (self.whiteToMove and self.currentCastlingRight.wqs) or (not self.whiteToMove and self.currentCastlingRight.bqs):
-      self.getQueensideCastleMoves(r, c, moves)
+    if canKingside:
+      self.getKingsideCastlemoves(r, c, moves, attackedSquares)
+    if canQueenside:
+      self.getQueensideCastleMoves(r, c, moves, attackedSquares)
 
     
-  def getKingsideCastlemoves(self, r, c, moves):
+  def getKingsideCastlemoves(self, r, c, moves, attackedSquares=None):
     if self.board[r][c + 1] == "--" and self.board[r][c + 2] == "--":
-      if not self.squareUnderAttack(r, c + 1) and not self.squareUnderAttack(r, c + 2):
-        moves.append(Move((r, c), (r, c + 2), self.board, isCastleMove = True))
+      if attackedSquares is None:
+        attackedSquares = self.getAttackedSquares(not self.whiteToMove)
+      if (r, c + 1) not in attackedSquares and (r, c + 2) not in attackedSquares:
+        moves.append(r * 8 + c | (r * 8 + c + 2) << 6 | CASTLE_FLAG)
 
-  def getQueensideCastleMoves(self, r, c, moves):
+  def getQueensideCastleMoves(self, r, c, moves, attackedSquares=None):
     if self.board[r][c - 1] == "--" and self.board[r][c - 2] == "--" and self.board[r][c - 3] == "--":
-      if not self.squareUnderAttack(r, c - 1) and not self.squareUnderAttack(r, c - 2):
-        moves.append(Move((r, c), (r, c - 2), self.board, isCastleMove = True))
+      if attackedSquares is None:
+        attackedSquares = self.getAttackedSquares(not self.whiteToMove)
+      if (r, c - 1) not in attackedSquares and (r, c - 2) not in attackedSquares:
+        moves.append(r * 8 + c | (r * 8 + c - 2) << 6 | CASTLE_FLAG)
 
 
 
@@ -363,8 +876,50 @@ class CastleRights(): # keeps track of castling rights
     self.wqs = wqs
     self.bqs = bqs
 
+  def bits(self): # wks 1, wqs 2, bks 4, bqs 8, the same order ChessHash.castleKey uses
+    return self.wks | self.wqs << 1 | self.bks << 2 | self.bqs << 3
+
+  def setBits(self, bits):
+    self.wks = bits & 1 != 0
+    self.wqs = bits & 2 != 0
+    self.bks = bits & 4 != 0
+    self.bqs = bits & 8 != 0
+
+
+WHITE_PIECES = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK')
+BLACK_PIECES = ('bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+PIECES = WHITE_PIECES + BLACK_PIECES # keys of GameState.pieceLocations
+ORDER_VALUES = {'-': 0, 'p': 1, 'N': 2, 'B': 3, 'R': 4, 'Q': 5, 'K': 6} # for ordering captures in generateMoves, '-' is a promotion without a capture
+SQUARES = tuple((r, c) for r in range(8) for c in range(8)) # row * 8 + col to (row, col)
+
+'''
+Undo records on GameState.stateStack are packed into one int:
+  bits 0-3 castling rights (CastleRights.bits), bits 4-10 enpassant square + 1 (0 for none),
+  bits 11-14 captured piece (its index in STATE_PIECES), bits 15 and up the halfmove clock
+The stack is allocated once per position with room for STATE_STACK_SIZE moves and doubles when a game goes longer
+'''
+STATE_ENPASSANT_SHIFT = 4
+STATE_CAPTURED_SHIFT = 11
+STATE_CLOCK_SHIFT = 15
+STATE_STACK_SIZE = 256
+STATE_PIECES = ('--',) + PIECES
+PIECE_INDEX = {piece: i for i, piece in enumerate(STATE_PIECES)}
+
+'''
+Moves inside the generator are packed into one int:
+  bits 0-5 start square (row * 8 + col), bits 6-11 end square, bits 12-14 flags, bits 16-18 promotion piece
+'''
+ENPASSANT_FLAG = 1 << 12
+CASTLE_FLAG = 2 << 12
+PROMOTION_FLAG = 4 << 12
+PROMOTION_PIECES = ('', 'N', 'B', 'R', 'Q') # promotion piece field, pawns always promote to queens for now
+PROMOTION_FLAGS = PROMOTION_FLAG | 4 << 16 # promote to a queen
+
 
 class Move(): # stores information about a move
+  # no __dict__ for each move, just these attributes
+  __slots__ = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured', 'isPawnPromotion',
+               'isEnpassantMove', 'isCastleMove', 'moveID', 'code')
   # maps keys to values
   # key : value
   ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,
@@ -391,6 +946,37 @@ class Move(): # stores information about a move
     self.isCastleMove = isCastleMove
 
     self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+    self.code = (self.startRow * 8 + self.startCol) | (self.endRow * 8 + self.endCol) << 6
+    if self.isEnpassantMove:
+      self.code |= ENPASSANT_FLAG
+    if self.isCastleMove:
+      self.code |= CASTLE_FLAG
+    if self.isPawnPromotion:
+      self.code |= PROMOTION_FLAGS
+
+  '''
+  Make a Move from a packed move code and the board it is played on
+  '''
+  @staticmethod
+  def fromCode(code, board):
+    move = Move.__new__(Move)
+    startSq = code & 63
+    endSq = code >> 6 & 63
+    move.startRow = startRow = startSq >> 3
+    move.startCol = startCol = startSq & 7
+    move.endRow = endRow = endSq >> 3
+    move.endCol = endCol = endSq & 7
+    move.pieceMoved = pieceMoved = board[startRow][startCol]
+    move.isPawnPromotion = code & PROMOTION_FLAG != 0
+    move.isEnpassantMove = code & ENPASSANT_FLAG != 0
+    move.isCastleMove = code & CASTLE_FLAG != 0
+    if move.isEnpassantMove:
+      move.pieceCaptured = 'wp' if pieceMoved == 'bp' else 'bp'
+    else:
+      move.pieceCaptured = board[endRow][endCol]
+    move.moveID = startRow * 1000 + startCol * 100 + endRow * 10 + endCol
+    move.code = code
+    return move
 
   '''
   Overriding the equals method
@@ -410,5 +996,166 @@ class Move(): # stores information about a move
   
 
 
+class LegalMoves(): # the legal moves of one position, with the indexes the UI looks moves up in
+  __slots__ = ('moves', 'fromSquare', 'byStartEnd', 'byPieceEnd', 'checkmate', 'stalemate')
+
+  def __init__(self, moves, checkmate, stalemate):
+    self.moves = moves # list of Move
+    self.fromSquare = {} # (row, col): list of moves starting there
+    self.byStartEnd = {} # ((startRow, startCol), (endRow, endCol)): move
+    self.byPieceEnd = {} # (piece type like 'N' or 'p', (endRow, endCol)): list of moves, for reading SAN
+    for move in moves:
+      start = (move.startRow, move.startCol)
+      end = (move.endRow, move.endCol)
+      self.fromSquare.setdefault(start, []).append(move)
+      self.byStartEnd[(start, end)] = move
+      self.byPieceEnd.setdefault((move.pieceMoved[1], end), []).append(move)
+    self.checkmate = checkmate
+    self.stalemate = stalemate
+
+
+'''
+Least recently used cache of LegalMoves by zobrist key, holding at most size positions
+'''
+class LegalMoveCache():
+  def __init__(self, size=1024):
+    self.size = size
+    self.entries = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key):
+    legalMoves = self.entries.get(key)
+    if legalMoves is None:
+      self.misses += 1
+      return None
+    self.entries.move_to_end(key) # most recently used
+    self.hits += 1
+    return legalMoves
+
+  def peek(self, key): # like get, but not counted as a hit or miss and not marked as used
+    return self.entries.get(key)
+
+  def put(self, key, legalMoves):
+    self.entries[key] = legalMoves
+    self.entries.move_to_end(key)
+    while len(self.entries) > self.size:
+      self.entries.popitem(last=False) # drop the least recently used
+
+  def clear(self):
+    self.entries.clear()
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+
+legalMoveCache = LegalMoveCache() # shared by every GameState, positions are told apart by their zobrist key
 
 
+BACKENDS = ('list', 'bitboard') # board representations a GameState can use
+
+'''
+Create a GameState using the given board backend, 'list' (the 8x8 list of strings) or 'bitboard' (see ChessBitboard).
+If no backend is given, the CHESS_BACKEND environment variable is used, and the list backend by default. The game
+starts from fen if it is given
+'''
+def createGameState(backend=None, fen=None):
+  if backend is None:
+    backend = os.environ.get('CHESS_BACKEND', 'list')
+  if backend == 'list':
+    return GameState(fen)
+  elif backend == 'bitboard':
+    import ChessBitboard # imported here since ChessBitboard builds on this module
+    return ChessBitboard.GameState(fen)
+  raise ValueError("Unknown backend '" + backend + "', expected one of " + ", ".join(BACKENDS))
+
+
+FEN_PIECES = {'P': 'wp', 'N': 'wN', 'B': 'wB', 'R': 'wR', 'Q': 'wQ', 'K': 'wK',
+              'p': 'bp', 'n': 'bN', 'b': 'bB', 'r': 'bR', 'q': 'bQ', 'k': 'bK'}
+
+'''
+Read a FEN string into the arguments of GameState.loadPosition: (board, whiteToMove, castleRights, enpassantPossible,
+halfmoveClock, fullmoveNumber). The move counters can be left out. Raises ValueError if the FEN is malformed
+'''
+def parseFEN(fen):
+  fields = fen.split()
+  if len(fields) not in (4, 6):
+    raise ValueError("Invalid FEN '" + fen + "': expected 4 or 6 fields")
+  ranks = fields[0].split('/')
+  if len(ranks) != 8:
+    raise ValueError("Invalid FEN '" + fen + "': expected 8 ranks")
+  board = []
+  for rank in ranks:
+    row = []
+    for char in rank:
+      if char in '12345678':
+        row += ['--'] * int(char)
+      elif char in FEN_PIECES:
+        row.append(FEN_PIECES[char])
+      else:
+        raise ValueError("Invalid FEN '" + fen + "': unknown piece '" + char + "'")
+    if len(row) != 8:
+      raise ValueError("Invalid FEN '" + fen + "': rank '" + rank + "' is not 8 squares")
+    board.append(row)
+  if fields[1] not in ('w', 'b'):
+    raise ValueError("Invalid FEN '" + fen + "': side to move must be w or b")
+  castling = fields[2]
+  if castling != '-' and (not castling or any(char not in 'KQkq' for char in castling)):
+    raise ValueError("Invalid FEN '" + fen + "': bad castling rights '" + castling + "'")
+  castleRights = CastleRights('K' in castling, 'k' in castling, 'Q' in castling, 'q' in castling)
+  enpassantPossible = ()
+  if fields[3] != '-':
+    if len(fields[3]) != 2 or fields[3][0] not in Move.filesToCols or fields[3][1] not in ('3', '6'):
+      raise ValueError("Invalid FEN '" + fen + "': bad enpassant square '" + fields[3] + "'")
+    enpassantPossible = (Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]])
+  halfmoveClock, fullmoveNumber = 0, 1
+  if len(fields) == 6:
+    if not (fields[4].isdigit() and fields[5].isdigit()):
+      raise ValueError("Invalid FEN '" + fen + "': move counters must be numbers")
+    halfmoveClock, fullmoveNumber = int(fields[4]), int(fields[5])
+  return board, fields[1] == 'w', castleRights, enpassantPossible, halfmoveClock, fullmoveNumber
+
+
+'''
+Split an EPD line into (fen, operations). The fen gets its move counters from the hmvc and fmvn operations (0 and 1
+if they aren't there), and operations is a dict of opcode: operand with the quotes taken off, e.g.
+  'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 bm e5; id "open";' ->
+  ('rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1', {'bm': 'e5', 'id': 'open'})
+'''
+def parseEPD(line):
+  fields = line.split(None, 4)
+  if len(fields) < 4:
+    raise ValueError("Invalid EPD '" + line.strip() + "': expected at least 4 fields")
+  operations = {}
+  if len(fields) == 5:
+    operation = ''
+    inQuotes = False
+    for char in fields[4] + ';':
+      if char == '"':
+        inQuotes = not inQuotes
+      if char == ';' and not inQuotes: # end of an operation
+        opcode, _, operand = operation.strip().partition(' ')
+        if opcode:
+          operand = operand.strip()
+          if len(operand) >= 2 and operand[0] == '"' and operand[-1] == '"':
+            operand = operand[1:-1]
+          operations[opcode] = operand
+        operation = ''
+      else:
+        operation += char
+  fen = ' '.join(fields[:4] + [operations.get('hmvc', '0'), operations.get('fmvn', '1')])
+  return fen, operations
+
+
+'''
+Yield (fen, operations) for every position in an EPD file, one line at a time so files of any size can be read
+with little memory. Blank lines and lines starting with # are skipped
+'''
+def readEPD(path):
+  with open(path) as f:
+    for line in f:
+      line = line.strip()
+      if line and not line.startswith('#'):
+        yield parseEPD(line)
@@ -0,0 +1,119 @@
+'''
+Search limits and time management, shared by the in-process search (ChessAI) and the UCI engines (ChickenStock).
+
+SearchLimits holds what a UCI go command can say: depth, nodes, movetime, the clocks (wtime/btime/winc/binc,
+movestogo) or infinite. TimeManager turns them into two deadlines for one move:
+  soft - don't start another iteration after this (the search may still finish the one it is on)
+  hard - stop the search no matter what, this is the per-move latency limit
+The soft time is shortened for forced and obvious moves (one legal move, a recapture) and lengthened for critical
+positions (in check, lots of captures around), never past the hard time.
+'''
+
+
+class SearchLimits():
+  def __init__(self, depth=None, nodes=None, movetime=None, wtime=None, btime=None, winc=0, binc=0, movestogo=None,
+               infinite=False):
+    self.depth = depth
+    self.nodes = nodes
+    self.movetime = movetime # milliseconds
+    self.wtime = wtime # milliseconds left on white's clock
+    self.btime = btime
+    self.winc = winc # increment per move in milliseconds
+    self.binc = binc
+    self.movestogo = movestogo # moves until the next time control
+    self.infinite = infinite
+
+  '''
+  Read the arguments of a UCI go command, e.g. ['go', 'wtime', '60000', 'btime', '60000', 'winc', '1000']
+  '''
+  @staticmethod
+  def fromGo(tokens):
+    limits = SearchLimits()
+    for i in range(len(tokens)):
+      if tokens[i] in ('depth', 'nodes', 'movetime', 'wtime', 'btime', 'winc', 'binc', 'movestogo') and i + 1 < len(tokens):
+        setattr(limits, tokens[i], int(tokens[i + 1]))
+      elif tokens[i] == 'infinite':
+        limits.infinite = True
+    return limits
+
+  '''
+  The limits as keyword arguments for ChessUCI.UCIEngine.go
+  '''
+  def goArguments(self):
+    arguments = {}
+    for name in ('depth', 'nodes', 'movetime', 'wtime', 'btime', 'winc', 'binc', 'movestogo'):
+      value = getattr(self, name)
+      if value is not None and not (name in ('winc', 'binc') and value == 0):
+        arguments[name] = value
+    if self.infinite:
+      arguments['infinite'] = True
+    return arguments
+
+  def copy(self, **changes):
+    limits = SearchLimits(self.depth, self.nodes, self.movetime, self.wtime, self.btime, self.winc, self.binc,
+                          self.movestogo, self.infinite)
+    for name, value in changes.items():
+      setattr(limits, name, value)
+    return limits
+
+  def hasClock(self, whiteToMove):
+    return (self.wtime if whiteToMove else self.btime) is not None
+
+
+class TimeManager():
+  '''
+  overheadMs is kept back from every move for the GUI and process round trips, movesToGo is how many more moves
+  the clock is assumed to have to last when the time control doesn't say
+  '''
+  def __init__(self, overheadMs=30, movesToGo=30, minSeconds=0.01):
+    self.overheadMs = overheadMs
+    self.movesToGo = movesToGo
+    self.minSeconds = minSeconds
+
+  '''
+  (soft seconds, hard seconds) for the move the player to move in gs is about to make, None where there is no limit.
+  validMoves can be passed in if they were already generated
+  '''
+  def allocate(self, gs, limits, validMoves=None):
+    if limits.infinite:
+      return None, None
+    hard = None
+    target = None
+    if limits.movetime is not None:
+      hard = max(self.minSeconds, (limits.movetime - self.overheadMs) / 1000)
+      target = hard
+    if limits.hasClock(gs.whiteToMove):
+      remaining = limits.wtime if gs.whiteToMove else limits.btime
+      increment = limits.winc if gs.whiteToMove else limits.binc
+      movesToGo = limits.movestogo or self.movesToGo
+      target = max(self.minSeconds, (remaining / movesToGo + increment * 0.75 - self.overheadMs) / 1000)
+      clockHard = max(self.minSeconds, min(target * 4, remaining * 0.3 / 1000)) # never bet much of the clock on one move
+      hard = clockHard if hard is None else min(hard, clockHard)
+      target = min(target, hard)
+    if target is None: # only depth or node limits
+      return None, None
+    if validMoves is None:
+      validMoves = gs.getValidMoves()
+    soft = max(self.minSeconds, min(hard, target * self.moveFactor(gs, validMoves)))
+    return soft, hard
+
+  '''
+  How much of the usual time this position deserves: very little for a forced move, less for a recapture, more
+  when in check or with a lot of captures on the board
+  '''
+  def moveFactor(self, gs, validMoves):
+    if len(validMoves) <= 1:
+      return 0.0 # nothing to think about, the search stops after its first iteration
+    factor = 1.0
+    if len(validMoves) <= 3:
+      factor *= 0.5 # almost forced
+    if gs.moveLog and gs.moveLog[-1].pieceCaptured != '--':
+      lastMove = gs.moveLog[-1]
+      if any(move.endRow == lastMove.endRow and move.endCol == lastMove.endCol for move in validMoves):
+        factor *= 0.6 # a recapture is usually obvious
+    captures = sum(1 for move in validMoves if move.pieceCaptured != '--')
+    if gs.inCheck():
+      factor *= 1.3
+    elif captures >= 4:
+      factor *= 1.2 # lots going on, worth looking harder
+    return factor
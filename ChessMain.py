@@ -3,8 +3,11 @@ This is our main driver file, it wiill be responsible for handling user inpu and
 '''
 
 import pygame as p
-import ChessEngine, ChickenStock
+import ChessEngine, ChessAI
+import ChessProfile
 import os
+import sys
+import threading
 import time
 import chalk
 
@@ -30,11 +33,20 @@ DIMENSION = 8 # dimensions of a hess board are 8x8
 SQUARE_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15 # for animations
 IMAGES = {}
+COLORS = [p.Color("blanchedalmond"), p.Color("burlywood")] # colors of the squares (light, dark)
+BOARD_SURFACE = None # the empty board, see drawBoard
+HIGHLIGHTS = {} # color: translucent square
+FONTS = {} # (name, size, bold, italic): font
+TEXTS = {} # text: rendered text, see drawText
+AI = ChessAI # module that plays the computer's moves, ChessAI (in-process) or ChickenStock (Stockfish)
 
 '''
-Initialize a global dictionary of images. This will be called exactly once in the main
+Initialize a global dictionary of images. They are loaded the first time only, later calls (a new game, measureFrames)
+reuse them
 '''
 def loadImages():
+  if IMAGES:
+    return
   pieces = ['wp', 'wR', 'wN', 'wK', 'wB', 'wQ', 'bp', 'bR', 'bN', 'bB', 'bK', 'bQ']
   for piece in pieces:
     IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQUARE_SIZE, SQUARE_SIZE))
@@ -44,26 +56,34 @@ def loadImages():
 The main driver for our code. This will hander user input and updating graphics
 '''
 def main():
+  mainStart = time.perf_counter() # for the time to the first frame
+  firstFrame = True
   p.init()
   screen = p.display.set_mode((WIDTH, HEIGHT))
   clock = p.time.Clock()
-  screen.fill(p.Color("white"))
-  game_state = ChessEngine.GameState()
-  validMoves = game_state.getValidMoves()
+  drawn = newDrawn() # what each square on the screen shows, so a frame only draws the squares that changed
+  text = None # the game over text on the screen
+  game_state = ChessEngine.createGameState() # list or bitboard backend, picked with the CHESS_BACKEND environment variable
+  validMoves = game_state.getLegalMoves() # legal moves indexed by square, cached by position
   moveMade = False # flag variable for when a move is made
   animate = False # flag variable for when we should animate a move
-  loadImages() # only do this once, before the while loop
+  loadImages() # only loads them the first time
   running = True
   sqSelected = () # no square selected initially, keep track of last click (tuple(row, coloumn))
   playerClicks = [] # keep track of player clicks (two tuples: [(x,y), (x,y)])
   gameOver = False
+  aiThinking = None # the AI's search, it runs in the background so the window keeps responding
   playerOne = True # if a human is playing white, then this will be True, else False
   playerTwo = False # if a human is playing black, then this will be True, else False
   while running:
+    frameStart = time.perf_counter()
     humanTurn = (game_state.whiteToMove and playerOne) or (not game_state.whiteToMove and playerTwo) # check if it is a human's turn
     for e in p.event.get():
       if e.type == p.QUIT: # quit the game when the user presses the x button
         running = False
+      elif e.type in (p.VIDEOEXPOSE, p.WINDOWEXPOSED): # the window was covered up, draw it all again
+        drawn = newDrawn()
+        text = None
       # mouse handler
       elif e.type == p.MOUSEBUTTONDOWN:
         if not gameOver and humanTurn: # if the game is not over and it is a human's turn
@@ -77,146 +97,293 @@ def main():
             sqSelected = (row, col)
             playerClicks.append(sqSelected) # add for both 1st and 2nd clicks
           if len(playerClicks) == 2: # after second click
-            move = ChessEngine.Move(playerClicks[0], playerClicks[1], game_state.board)
-            for i in range(len(validMoves)):
-              if move == validMoves[i]:
-                ChickenStock.addMove(move.getChessNotation())
-                game_state.makeMove(validMoves[i])
-                moveMade = True
-                animate = True
-                sqSelected = () # reset user clicks
-                playerClicks = []
+            move = validMoves.byStartEnd.get((playerClicks[0], playerClicks[1])) # None if the move isn't legal
+            if move is not None:
+              AI.addMove(move.getChessNotation())
+              game_state.makeMove(move)
+              moveMade = True
+              animate = True
+              sqSelected = () # reset user clicks
+              playerClicks = []
             if not moveMade: 
               playerClicks = [sqSelected]
       # key handlers
       
       elif e.type == p.KEYDOWN:
-        if e.key == p.K_r: # reset the game when r is pressed
-          running = False
-          ChickenStock.stockfishInit()
-          main()
+        if e.key == p.K_r: # reset the game when r is pressed, in the same window
+          AI.newGame() # also stops the AI's search if it is thinking
+          game_state = ChessEngine.createGameState()
+          validMoves = game_state.getLegalMoves()
+          moveMade = animate = gameOver = False
+          aiThinking = None
+          sqSelected = ()
+          playerClicks = []
+          drawn = newDrawn()
+          text = None
         if e.key == p.K_q: # quit the game when q is pressed
           running = False
 
 
     # AI move finder logic
     if not gameOver and not humanTurn:
-      AIMove = ChickenStock.getAIMove(validMoves)
-      game_state.makeMove(AIMove)
-      moveMade = True
-      animate = True
+      if aiThinking is None:
+        aiThinking = AI.startAIMove()
+      elif aiThinking.done(): # check every frame, the move is made once the search has finished
+        AIMove = AI.finishAIMove(aiThinking, validMoves.moves)
+        aiThinking = None
+        game_state.makeMove(AIMove)
+        moveMade = True
+        animate = True
 
     if moveMade: # if a move is made, update valid moves
       if animate: 
-        animateMove(game_state.moveLog[-1], screen, game_state.board, clock)
-      validMoves = game_state.getValidMoves()
+        animateMove(game_state.moveLog[-1], screen, game_state.board, clock, drawn)
+      validMoves = game_state.getLegalMoves()
       moveMade = False
       animate = False
 
-    drawGameState(screen, game_state, validMoves, sqSelected)
+    rects = drawGameState(screen, game_state, validMoves, sqSelected, drawn)
 
+    newText = None
     if game_state.checkmate: # check if the game is over
       gameOver = True 
       if game_state.whiteToMove:# if white is in checkmate
-        drawText(screen, 'Black wins by checkmate')
+        newText = 'Black wins by checkmate'
       else: # if black is in checkmate
-        drawText(screen, 'White wins by checkmate')
+        newText = 'White wins by checkmate'
     elif game_state.stalemate: # check if the game is in stalemate
       gameOver = True
-      drawText(screen, 'Stalemate')
+      newText = 'Stalemate'
+    if newText is not None and (newText != text or textRect.collidelist(rects) != -1):
+      textRect = drawText(screen, newText) # new, or squares under it were just drawn over it
+      rects.append(textRect)
+    text = newText
 
+    ChessProfile.record('frame', time.perf_counter() - frameStart, frameStart) # without the wait for the next frame
     clock.tick(MAX_FPS)
-    p.display.flip()
+    if rects: # idle frames don't touch the screen
+      p.display.update(rects)
+    if firstFrame:
+      firstFrame = False
+      firstFrameSeconds = time.perf_counter() - mainStart
+      ChessProfile.record('firstFrame', firstFrameSeconds, mainStart)
+      print('First frame after %.0fms' % (firstFrameSeconds * 1000))
+  if AI is not ChessAI:
+    printEngineStartup()
+
+'''
+How long Stockfish took to be ready after its warm-up started, and how long moves had to wait for it
+'''
+def printEngineStartup():
+  startup = AI.startup
+  if startup['readySeconds'] is None:
+    print('Stockfish was never needed (every move came from the book or the cache)' if startup['began'] is None
+          else 'Stockfish was still starting')
+  else:
+    print('Stockfish ready %.0fms after its warm-up started, moves waited %.0fms for it' %
+          (startup['readySeconds'] * 1000, startup['waitedSeconds'] * 1000))
 
 """
-Highlight square selected and moves for piece selected
+Highlight square selected and moves for piece selected. Returns {(row, col): highlight color} for squareStates
 """
-def highlightSquares(screen, game_state, validMoves, sqSelected):
+def highlightSquares(game_state, validMoves, sqSelected):
+  highlights = {}
   if sqSelected != (): # if a square is selected
     r, c = sqSelected # get row and coloumn of selected square
     if game_state.board[r][c][0] == ('w' if game_state.whiteToMove else 'b'): # sqSelected is a piece that can be moved
-      # highlight selected square
-      s = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
-      s.set_alpha(100) # transparency value -> 0 transparent; 255 opaque
-      s.fill(p.Color('gold'))
-      screen.blit(s, (c*SQUARE_SIZE, r*SQUARE_SIZE))
-      # highlight moves from that square
-      s.fill(p.Color('lightsteelblue'))
-      for move in validMoves:
-        if move.startRow == r and move.startCol == c:
-          screen.blit(s, (move.endCol*SQUARE_SIZE, move.endRow*SQUARE_SIZE))
+      highlights[(r, c)] = 'gold' # highlight selected square
+      for move in validMoves.fromSquare.get((r, c), ()): # highlight moves from that square
+        highlights[(move.endRow, move.endCol)] = 'lightsteelblue'
+  return highlights
 
 
-'''    
-Responsible for all the graphics within a current game state
 '''
-def drawGameState(screen, game_state, validMoves, sqSelected):
-  drawBoard(screen) # draw squares on the board
-  highlightSquares(screen, game_state, validMoves, sqSelected) # highlight square selected and moves for piece selected
-  drawPieces(screen, game_state.board) # draw pieces on top of those squares
+What every square should show this frame, an 8x8 list of (piece, highlight color or None)
+'''
+def squareStates(game_state, validMoves, sqSelected):
+  highlights = highlightSquares(game_state, validMoves, sqSelected)
+  board = game_state.board
+  return [[(board[r][c], highlights.get((r, c))) for c in range(DIMENSION)] for r in range(DIMENSION)]
 
 
 '''
-Draw the squares on the board. The top left square is always light
+Responsible for all the graphics within a current game state. drawn is what the screen shows now (see newDrawn),
+only the squares that changed are drawn again. Returns the rectangles that changed, for p.display.update
 '''
-def drawBoard(screen):
-  global colors
-  colors = [p.Color("blanchedalmond"), p.Color("burlywood")] # colors of the squares (light, dark)
-  screen.fill(p.Color("white"))
+@ChessProfile.profiled('drawGameState', len) # items are the squares drawn
+def drawGameState(screen, game_state, validMoves, sqSelected, drawn):
+  rects = []
+  states = squareStates(game_state, validMoves, sqSelected)
   for r in range(DIMENSION):
     for c in range(DIMENSION):
-      color = colors[((r+c) % 2)]
-      p.draw.rect(screen,color, p.Rect(c*SQUARE_SIZE, r*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+      if drawn[r][c] != states[r][c]:
+        piece, highlight = states[r][c]
+        rects.append(drawSquare(screen, r, c, piece, highlight))
+        drawn[r][c] = states[r][c]
+  return rects
+
 
 '''
-Draw the pieces on the board using the current GameState.board
+An 8x8 list of what is on the screen, all None (unknown) so everything gets drawn. Set a square back to None to
+have it drawn again
 '''
-def drawPieces(screen, board): 
-  for r in range(DIMENSION):
-    for c in range(DIMENSION):
-      piece = board[r][c]
-      if piece != "--": # not a empty square
-        screen.blit(IMAGES[piece], p.Rect(c*SQUARE_SIZE, r*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+def newDrawn():
+  return [[None] * DIMENSION for r in range(DIMENSION)]
+
+
+'''
+The empty board, drawn once. The top left square is always light
+'''
+def drawBoard():
+  global BOARD_SURFACE
+  if BOARD_SURFACE is None:
+    BOARD_SURFACE = p.Surface((WIDTH, HEIGHT))
+    BOARD_SURFACE.fill(p.Color("white"))
+    for r in range(DIMENSION):
+      for c in range(DIMENSION):
+        color = COLORS[((r+c) % 2)]
+        p.draw.rect(BOARD_SURFACE, color, squareRect(r, c))
+  return BOARD_SURFACE
+
+
+def squareRect(r, c):
+  return p.Rect(c*SQUARE_SIZE, r*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+
+
+def highlightSurface(color): # a translucent square of the color, made once per color
+  if color not in HIGHLIGHTS:
+    s = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
+    s.set_alpha(100) # transparency value -> 0 transparent; 255 opaque
+    s.fill(p.Color(color))
+    HIGHLIGHTS[color] = s
+  return HIGHLIGHTS[color]
+
+
+'''
+Draw one square from the board surface, with its highlight and piece on top. Returns its rectangle
+'''
+def drawSquare(screen, r, c, piece, highlight=None):
+  rect = squareRect(r, c)
+  screen.blit(drawBoard(), rect, rect)
+  if highlight is not None:
+    screen.blit(highlightSurface(highlight), rect)
+  if piece != "--": # not a empty square
+    screen.blit(IMAGES[piece], rect)
+  return rect
 
 """
-Animating a move
+Animating a move. Each frame only the squares under the moving piece (where it was and where it is now) are drawn
+again, and they are marked in drawn so the next drawGameState brings them up to date
 """
-def animateMove(move, screen, board, clock):
-  global colors
+@ChessProfile.profiled('animateMove')
+def animateMove(move, screen, board, clock, drawn):
   dR = move.endRow - move.startRow # delta row
   dC = move.endCol - move.startCol # ddelta coloumn
   framesPerSquare = 5 # frames to move one square
   frameCount = (abs(dR) + abs(dC)) * framesPerSquare # total number of frames for a move
+  previous = squareRect(move.startRow, move.startCol)
   for frame in range(frameCount + 1):
     r, c = (move.startRow + dR*frame/frameCount, move.startCol + dC*frame/frameCount) # current row and coloumn
-    drawBoard(screen)
-    drawPieces(screen, board)
-    # erase the piece moved from its ending square
-    color = colors[(move.endRow + move.endCol) % 2] # alternate between light and dark squares
-    endSquare = p.Rect(move.endCol*SQUARE_SIZE, move.endRow*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE) # rectangle for end square
-    p.draw.rect(screen, color, endSquare) # draw rectangle
-    # draw captured piece onto rectangle
-    if move.pieceCaptured != '--':
-      screen.blit(IMAGES[move.pieceCaptured], endSquare) # draw captured piece onto rectangle
-    # draw moving piece
-    screen.blit(IMAGES[move.pieceMoved], p.Rect(c*SQUARE_SIZE, r*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)) # draw moving piece
-    p.display.flip() # update the screen
+    pieceRect = p.Rect(int(c*SQUARE_SIZE), int(r*SQUARE_SIZE), SQUARE_SIZE, SQUARE_SIZE)
+    dirty = previous.union(pieceRect)
+    rects = []
+    for row in range(dirty.top // SQUARE_SIZE, (dirty.bottom - 1) // SQUARE_SIZE + 1):
+      for col in range(dirty.left // SQUARE_SIZE, (dirty.right - 1) // SQUARE_SIZE + 1):
+        # the board already has the move made, the end square shows the captured piece until the piece arrives
+        piece = move.pieceCaptured if (row, col) == (move.endRow, move.endCol) else board[row][col]
+        rects.append(drawSquare(screen, row, col, piece))
+        drawn[row][col] = None
+    screen.blit(IMAGES[move.pieceMoved], pieceRect) # draw moving piece
+    p.display.update(rects) # update the squares that changed
+    previous = pieceRect
     clock.tick(60)   # 60 frames per second
 
+def getFont(name, size, bold=False, italic=False): # fonts are slow to create, make each one once
+  key = (name, size, bold, italic)
+  if key not in FONTS:
+    FONTS[key] = p.font.SysFont(name, size, bold, italic)
+  return FONTS[key]
+
+'''
+Draw text in the middle of the screen, returns its rectangle. The rendered text is kept for the next time
+'''
 def drawText(screen, text): # draw text on the screen
-  font = p.font.SysFont("Courier", 32, True, False) # font type, size, bold, italics (for easy reference)
-  textObject = font.render(text, 0, p.Color('Gray')) # text, antialiasing, color (for future reference)
-  textLocation = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObject.get_width()/2, HEIGHT/2 - textObject.get_height()/2) # center text
-  screen.blit(textObject, textLocation) # draw text
-  textObject = font.render(text, 0, p.Color('Black')) # text, antialiasing, color (for future reference)
-  screen.blit(textObject, textLocation.move(2,2)) # draw text slightly offset for outline look
+  if text not in TEXTS:
+    font = getFont("Courier", 32, True, False) # font type, size, bold, italics (for easy reference)
+    textObject = font.render(text, 0, p.Color('Gray')) # text, antialiasing, color (for future reference)
+    textSurface = p.Surface((textObject.get_width() + 2, textObject.get_height() + 2), p.SRCALPHA)
+    textSurface.blit(textObject, (0, 0))
+    textSurface.blit(font.render(text, 0, p.Color('Black')), (2, 2)) # draw text slightly offset for outline look
+    TEXTS[text] = textSurface
+  textSurface = TEXTS[text]
+  textLocation = textSurface.get_rect(center=(WIDTH//2, HEIGHT//2)) # center text
+  screen.blit(textSurface, textLocation) # draw text
+  return textLocation
+
+'''
+Frame times without a window: plays a short game of the in-process AI against itself with SDL's dummy video driver
+and returns the CPU seconds of each frame, by kind. Idle frames are the ones where nothing changed. fullRedraw draws
+every square every frame, for comparison
+'''
+def measureFrames(moves=10, idleFrames=30, fullRedraw=False):
+  os.environ['SDL_VIDEODRIVER'] = 'dummy'
+  p.init()
+  screen = p.display.set_mode((WIDTH, HEIGHT))
+  clock = p.time.Clock()
+  loadImages()
+  game_state = ChessEngine.createGameState()
+  validMoves = game_state.getLegalMoves()
+  drawn = newDrawn()
+  times = {'idle': [], 'select': [], 'animate': []}
+  def frame(kind, sqSelected=()):
+    start = time.process_time()
+    if fullRedraw:
+      drawn[:] = newDrawn()
+    rects = drawGameState(screen, game_state, validMoves, sqSelected, drawn)
+    if rects:
+      p.display.update(rects)
+    times[kind].append(time.process_time() - start)
+  for i in range(moves):
+    move = ChessAI.searcher.findBestMove(game_state, 1)[0]
+    if move is None:
+      break
+    frame('select', (move.startRow, move.startCol))
+    for j in range(idleFrames):
+      frame('idle', (move.startRow, move.startCol))
+    game_state.makeMove(move)
+    start = time.process_time()
+    animateMove(move, screen, game_state.board, clock, drawn)
+    times['animate'].append(time.process_time() - start)
+    validMoves = game_state.getLegalMoves()
+    frame('select')
+  p.quit()
+  return times
+
+'''
+python ChessMain.py --frames prints the CPU time of the frames, drawing everything and drawing only what changed
+'''
+def printFrameTimes():
+  for fullRedraw in (True, False):
+    times = measureFrames(fullRedraw=fullRedraw)
+    print('full redraw' if fullRedraw else 'changed squares only')
+    for kind, seconds in times.items():
+      seconds = sorted(seconds)
+      if seconds:
+        print('  %-8s %5d times, mean %7.3fms, p95 %7.3fms' % (kind, len(seconds), sum(seconds) / len(seconds) * 1000,
+                                                                seconds[int(len(seconds) * 0.95)] * 1000))
 
 if __name__ == "__main__":
+  if '--frames' in sys.argv:
+    printFrameTimes()
+    sys.exit()
   clear()
   print(chalk.bold('''
 Welcome to ''') + blue("Chess", bold=True, underline=True) + chalk.bold('''! You will be set up against ChickenStock, our unbeatable chess AI. Good luck!
 To play, click on the piece you want to move, then click on the square you want to move it to.
 If you want to restart, press 'r'. If you wish to quit, press 'q'.\n '''))
+  import ChickenStock # importing it doesn't start Stockfish
+  if ChickenStock.available():
+    ChickenStock.warmUp() # start it while the player picks a level, so level 4 doesn't wait for it
   eloChoosing = True
   while eloChoosing:
 
@@ -227,20 +394,16 @@ If you want to restart, press 'r'. If you wish to quit, press 'q'.\n '''))
     print(chalk.bold("[4] ") + red("Unbeatable", bold=True))
 
     choice = input("Enter your choice: ")
-    if choice == "1":
-      ChickenStock.stockfish.update_engine_parameters({"UCI_LimitStrength": "true", "UCI_Elo": 500})
-      eloChoosing = False
-      main()
-    elif choice == "2":
-      ChickenStock.stockfish.update_engine_parameters({"UCI_LimitStrength": "true", "UCI_Elo": 700})
-      eloChoosing = False
-      main()
-    elif choice == "3":
-      ChickenStock.stockfish.update_engine_parameters({"UCI_LimitStrength": "true", "UCI_Elo": 1000})
+    if choice in ("1", "2", "3"): # the lower levels use the in-process AI, no Stockfish needed
+      threading.Thread(target=ChickenStock.shutdown, daemon=True).start() # free the warmed up engine without waiting
+      ChessAI.setLevel(int(choice))
+      AI = ChessAI
       eloChoosing = False
       main()
     elif choice == "4":
-      ChickenStock.stockfish.update_engine_parameters({"UCI_LimitStrength": "false", "UCI_Elo": 3000})
+      ChickenStock.warmUp() # already running if Stockfish was found, if not the first search raises the UCIError
+      ChickenStock.setOptions({"UCI_LimitStrength": "false", "UCI_Elo": 3000})
+      AI = ChickenStock
       eloChoosing = False
       main()
     else:
@@ -0,0 +1,387 @@
+'''
+Reading and writing PGN games. readGames streams a file one game at a time (so memory doesn't grow with the file),
+parseSAN turns a SAN move like Nbd7 or exd8=Q+ into the Move of a GameState through LegalMoves.byPieceEnd, and
+toSAN/gamePGN/moveLogPGN write them back out. validate replays whole archives on several cores to check that
+every move is legal.
+
+  python ChessPGN.py validate games.pgn -w 8
+  python ChessPGN.py validate games.pgn --backend bitboard --chunk 200
+
+Pawns can only promote to queens in ChessEngine, so games with underpromotions are reported as unsupported.
+'''
+import argparse
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import ChessEngine
+
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+ROSTER = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result') # written first, in this order
+HEADER = re.compile(r'\[\s*(\w+)\s+"(.*)"\s*\]$') # up to the last quote, some writers don't escape quotes in values
+# a comment (maybe running onto the next lines), a rest of line comment, variations, NAGs, move numbers or a move
+TOKEN = re.compile(r'\{[^}]*\}?|;.*|\(|\)|\$\d+|\d+\.+|[^\s{}();$]+')
+SAN = re.compile(r'([NBRQK])?([a-h])?([1-8])?(x)?([a-h][1-8])(?:=?([NBRQ]))?$')
+CASTLING = {'O-O': 6, 'O-O-O': 2, '0-0': 6, '0-0-0': 2} # column the king ends on
+
+
+class PGNError(ValueError):
+  pass
+
+
+class PGNGame():
+  def __init__(self, headers=None, moves=None, result='*'):
+    self.headers = headers if headers is not None else {} # tag: value, in the order they were read
+    self.moves = moves if moves is not None else [] # SAN
+    self.result = result
+
+  @property
+  def fen(self): # the start position if it isn't the normal one
+    return self.headers.get('FEN')
+
+
+'''
+The games of a PGN file (a path or an open text file) one at a time as PGNGame. Comments, variations and NAGs
+are skipped
+'''
+def readGames(source):
+  f = open(source, encoding='utf-8', errors='replace') if isinstance(source, str) else source
+  try:
+    game = PGNGame()
+    inComment = False
+    variations = 0 # how deep inside ( ) we are
+    for line in f:
+      if inComment:
+        end = line.find('}')
+        if end == -1:
+          continue
+        line = line[end + 1:]
+        inComment = False
+      stripped = line.strip()
+      if not stripped or stripped[0] == '%': # blank or an escaped line
+        continue
+      if stripped[0] == '[' and variations == 0:
+        header = HEADER.match(stripped)
+        if header is not None:
+          if game.moves: # tags after moves without a result, a new game has started
+            yield game
+            game = PGNGame()
+          game.headers[header.group(1)] = header.group(2).replace('\\"', '"').replace('\\\\', '\\')
+          continue
+      for token in TOKEN.findall(line):
+        first = token[0]
+        if first == '{':
+          inComment = token[-1] != '}' # runs onto the next line
+        elif first == ';' or first == '$' or first.isdigit() and token[-1] == '.':
+          continue
+        elif first == '(':
+          variations += 1
+        elif first == ')':
+          variations = max(0, variations - 1)
+        elif variations:
+          continue
+        elif token in RESULTS:
+          game.result = token
+          yield game
+          game = PGNGame()
+        else:
+          game.moves.append(token)
+    if game.moves or game.headers: # no result at the end of the file
+      game.result = game.headers.get('Result', '*')
+      yield game
+  finally:
+    if isinstance(source, str):
+      f.close()
+
+
+'''
+The legal Move of the GameState that a SAN move stands for. Without legalMoves only the pieces of the right kind
+that can reach the square are generated and checked (see sanCodes), with them (a LegalMoves the caller already
+has) the move is looked up in byPieceEnd. Raises PGNError if the move can't be read (a pawn capture without its
+file, a pawn push with one), isn't legal (also when the x doesn't match whether it captures), is ambiguous or is an
+underpromotion
+'''
+def parseSAN(gs, san, legalMoves=None):
+  text = san.rstrip('+#!?')
+  capture = None
+  if text in CASTLING:
+    row = 7 if gs.whiteToMove else 0
+    end = (row, CASTLING[text])
+    if legalMoves is not None:
+      move = legalMoves.byStartEnd.get(((row, 4), end))
+      candidates = [move] if move is not None and move.isCastleMove else []
+    else:
+      candidates = sanCodes(gs, 'K', end, castle=True)
+  else:
+    match = SAN.match(text)
+    if match is None:
+      raise PGNError("Can't read move '" + san + "'")
+    piece, fromFile, fromRank, capture, to, promotion = match.groups()
+    if promotion is not None and promotion != 'Q':
+      raise PGNError("Underpromotion '" + san + "' isn't supported")
+    if piece is None and (fromFile is None) == (capture is not None): # exd5 and d5, never d5 with x or ed5
+      raise PGNError("Can't read move '" + san + "'")
+    end = (ChessEngine.Move.ranksToRows[to[1]], ChessEngine.Move.filesToCols[to[0]])
+    fromCol = ChessEngine.Move.filesToCols[fromFile] if fromFile is not None else None
+    if piece is None and capture is None: # a pawn push stays on its file
+      fromCol = end[1]
+    fromRow = ChessEngine.Move.ranksToRows[fromRank] if fromRank is not None else None
+    if legalMoves is not None:
+      candidates = [move for move in legalMoves.byPieceEnd.get((piece or 'p', end), ())
+                    if (fromCol is None or move.startCol == fromCol) and (fromRow is None or move.startRow == fromRow)]
+    else:
+      candidates = sanCodes(gs, piece or 'p', end, fromCol, fromRow)
+  if len(candidates) == 1:
+    move = candidates[0] if legalMoves is not None else ChessEngine.Move.fromCode(candidates[0], gs.board)
+    if (capture is not None) != (move.pieceCaptured != '--'): # pieceCaptured is set for enpassant too
+      raise PGNError("Illegal move '" + san + "' in " + gs.toFEN() + (" (it doesn't capture)" if capture else " (it captures)"))
+    return move
+  if not candidates:
+    raise PGNError("Illegal move '" + san + "' in " + gs.toFEN())
+  raise PGNError("Ambiguous move '" + san + "' in " + gs.toFEN())
+
+
+'''
+Legal move codes of the pieces of pieceType (of the player to move, on fromCol/fromRow when they are given) that
+end on end, or the castle move that ends there with castle=True
+'''
+def sanCodes(gs, pieceType, end, fromCol=None, fromRow=None, castle=False):
+  endSq = end[0] * 8 + end[1]
+  inCheck, doubleCheck, isLegal = gs.legalCodeTest()
+  if castle:
+    if inCheck: # can't castle out of check
+      return []
+    codes = []
+    kingRow, kingCol = gs.whiteKingLocation if gs.whiteToMove else gs.blackKingLocation
+    gs.getCastleMoves(kingRow, kingCol, codes)
+    return [code for code in codes if code >> 6 & 63 == endSq]
+  moveFunction = gs.moveFunctions[pieceType]
+  legal = []
+  for r, c in gs.pieceLocations[('w' if gs.whiteToMove else 'b') + pieceType]:
+    if (fromCol is not None and c != fromCol) or (fromRow is not None and r != fromRow):
+      continue
+    if pieceType == 'p' and abs(c - end[1]) > 1: # pawns only move to their own file or the next one
+      continue
+    codes = []
+    moveFunction(r, c, codes)
+    for code in codes:
+      if code >> 6 & 63 == endSq and isLegal(code):
+        legal.append(code)
+  return legal
+
+
+'''
+SAN of a legal move of the GameState, with + or # if it gives check or mate
+'''
+def toSAN(gs, move, legalMoves=None):
+  if move.isCastleMove:
+    san = 'O-O' if move.endCol > move.startCol else 'O-O-O'
+  else:
+    piece = move.pieceMoved[1]
+    capture = move.pieceCaptured != '--'
+    destination = move.getRankFile(move.endRow, move.endCol)
+    if piece == 'p':
+      san = (move.colsToFiles[move.startCol] + 'x' if capture else '') + destination + ('=Q' if move.isPawnPromotion else '')
+    else:
+      if legalMoves is None:
+        legalMoves = gs.getLegalMoves()
+      others = [other for other in legalMoves.byPieceEnd.get((piece, (move.endRow, move.endCol)), ())
+                if (other.startRow, other.startCol) != (move.startRow, move.startCol)]
+      disambiguation = ''
+      if others: # another piece of the same kind can go there too, say which one (file, else rank, else both)
+        if all(other.startCol != move.startCol for other in others):
+          disambiguation = move.colsToFiles[move.startCol]
+        elif all(other.startRow != move.startRow for other in others):
+          disambiguation = move.rowsToRanks[move.startRow]
+        else:
+          disambiguation = move.getRankFile(move.startRow, move.startCol)
+      san = piece + disambiguation + ('x' if capture else '') + destination
+  gs.makeMove(move)
+  if gs.inCheck():
+    san += '+' if gs.hasLegalMove() else '#'
+  gs.undoMove()
+  return san
+
+
+'''
+The result of the game if the GameState is checkmate or stalemate, '*' otherwise
+'''
+def gameResult(gs):
+  if gs.hasLegalMove():
+    return '*'
+  if gs.inCheck():
+    return '0-1' if gs.whiteToMove else '1-0'
+  return '1/2-1/2'
+
+
+'''
+PGN text of a game: headers (the seven tag roster is filled in), SAN moves and the result. fen is where the game
+started if it isn't the normal start position
+'''
+def writePGN(headers, sanMoves, result='*', fen=None):
+  headers = dict(headers or {})
+  headers['Result'] = result
+  if fen is not None:
+    headers['SetUp'] = '1'
+    headers['FEN'] = fen
+  lines = []
+  for tag in ROSTER + tuple(tag for tag in headers if tag not in ROSTER):
+    value = str(headers.get(tag, '????.??.??' if tag == 'Date' else '?'))
+    lines.append('[' + tag + ' "' + value.replace('\\', '\\\\').replace('"', '\\"') + '"]')
+  lines.append('')
+  fields = fen.split() if fen is not None else ['', 'w', '', '', '0', '1']
+  whiteToMove = fields[1] == 'w'
+  number = int(fields[5]) if len(fields) > 5 else 1
+  tokens = []
+  for i, san in enumerate(sanMoves):
+    if whiteToMove:
+      tokens.append(str(number) + '.')
+    elif i == 0:
+      tokens.append(str(number) + '...')
+    tokens.append(san)
+    if not whiteToMove:
+      number += 1
+    whiteToMove = not whiteToMove
+  tokens.append(result)
+  line = ''
+  for token in tokens: # movetext lines of at most 80 characters
+    if line and len(line) + 1 + len(token) > 80:
+      lines.append(line)
+      line = token
+    else:
+      line = line + ' ' + token if line else token
+  lines.append(line)
+  return '\n'.join(lines) + '\n\n'
+
+
+'''
+PGN of a game given as a start fen (None for the normal start) and moves in long algebraic notation (e2e4), like
+ChessTournament and the UCI engines use. The result is worked out from the final position if it isn't given
+'''
+def gamePGN(fen, moves, headers=None, result=None, backend=None):
+  gs = ChessEngine.createGameState(backend, fen)
+  sanMoves = []
+  for notation in moves:
+    legalMoves = gs.getLegalMoves()
+    move = next((move for move in legalMoves.moves if move.getChessNotation() == notation), None)
+    if move is None:
+      raise PGNError("Illegal move '" + notation + "' in " + gs.toFEN())
+    sanMoves.append(toSAN(gs, move, legalMoves))
+    gs.makeMove(move)
+  return writePGN(headers, sanMoves, result or gameResult(gs), fen)
+
+
+'''
+PGN of the moves in a GameState's moveLog. The moves are taken back to find the start position and made again,
+so the GameState ends up where it was
+'''
+def moveLogPGN(gs, headers=None, result=None):
+  moves = list(gs.moveLog)
+  for move in moves:
+    gs.undoMove()
+  fen = gs.toFEN()
+  sanMoves = []
+  for move in moves:
+    sanMoves.append(toSAN(gs, move))
+    gs.makeMove(move)
+  start = fen if fen != ChessEngine.GameState().toFEN() else None
+  return writePGN(headers, sanMoves, result or gameResult(gs), start)
+
+
+'''
+Play the SAN moves of a game from its start position. Returns (plies played, error message or None). A game that
+ends in checkmate has to have the matching result
+'''
+def replayGame(fen, sanMoves, result='*', backend=None):
+  try:
+    gs = ChessEngine.createGameState(backend, fen)
+  except ValueError as e:
+    return 0, str(e)
+  for i, san in enumerate(sanMoves):
+    try:
+      move = parseSAN(gs, san)
+    except PGNError as e:
+      return i, 'move ' + str(i // 2 + 1) + ': ' + str(e)
+    gs.makeMove(move)
+  if result in ('1-0', '0-1', '1/2-1/2') and gameResult(gs) not in ('*', result):
+    return len(sanMoves), 'result ' + result + ' but the game ends in ' + gameResult(gs)
+  return len(sanMoves), None
+
+
+'''
+Worker side of validate: replay every (game number, fen, moves, result) of the chunk. Returns the pid, the plies
+played, the errors [(game number, message)] and how long it took
+'''
+def replayChunk(chunk, backend):
+  start = time.perf_counter()
+  plies = 0
+  errors = []
+  for number, fen, sanMoves, result in chunk:
+    played, error = replayGame(fen, sanMoves, result, backend)
+    plies += played
+    if error is not None:
+      errors.append((number, error))
+  return os.getpid(), plies, errors, time.perf_counter() - start
+
+
+'''
+Replay every game of a PGN file on workers processes (one per core by default), chunkSize games per task. Only a
+few chunks per worker are read ahead, so memory stays flat however big the file is. onError(game number, message)
+is called for each bad game. Returns {'games', 'plies', 'errors', 'seconds', 'gamesPerSecond', 'pliesPerSecond'}
+'''
+def validate(path, workers=None, chunkSize=100, backend=None, onError=None):
+  start = time.perf_counter()
+  workers = workers or os.cpu_count() or 1
+  games = plies = errors = 0
+  def collect(done):
+    nonlocal plies, errors
+    for future in done:
+      pid, chunkPlies, chunkErrors, seconds = future.result()
+      plies += chunkPlies
+      errors += len(chunkErrors)
+      if onError is not None:
+        for number, message in chunkErrors:
+          onError(number, message)
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    running = set()
+    chunk = []
+    for game in readGames(path):
+      games += 1
+      chunk.append((games, game.fen, game.moves, game.result))
+      if len(chunk) == chunkSize:
+        if len(running) >= workers * 2: # wait for a worker before reading further
+          done, running = wait(running, return_when=FIRST_COMPLETED)
+          collect(done)
+        running.add(pool.submit(replayChunk, chunk, backend))
+        chunk = []
+    if chunk:
+      running.add(pool.submit(replayChunk, chunk, backend))
+    collect(wait(running).done)
+  seconds = time.perf_counter() - start
+  return {'games': games, 'plies': plies, 'errors': errors, 'seconds': seconds,
+          'gamesPerSecond': games / seconds if seconds > 0 else 0.0, 'pliesPerSecond': plies / seconds if seconds > 0 else 0.0}
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='PGN tools for ChessEngine')
+  parser.add_argument('command', choices=('validate',))
+  parser.add_argument('path', help='PGN file')
+  parser.add_argument('-w', '--workers', type=int, help='number of worker processes (default: one per core)')
+  parser.add_argument('--chunk', type=int, default=100, help='games per task (default: 100)')
+  parser.add_argument('--backend', choices=ChessEngine.BACKENDS, help='board backend (default: CHESS_BACKEND or list)')
+  parser.add_argument('--errors', type=int, default=20, help='how many bad games to print (default: 20)')
+  args = parser.parse_args(argv)
+
+  printed = 0
+  def onError(number, message):
+    nonlocal printed
+    if printed < args.errors:
+      print('game %d: %s' % (number, message))
+      printed += 1
+  result = validate(args.path, args.workers, args.chunk, args.backend, onError)
+  print('%d games, %d plies, %d bad in %.2fs: %.0f games/s, %.0f plies/s' % (result['games'], result['plies'], result['errors'],
+                                                                       result['seconds'], result['gamesPerSecond'], result['pliesPerSecond']))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,198 @@
+'''
+Runs perft and analysis on several cores. GameState is one object changed in place by makeMove/undoMove, so instead
+of sharing it the move tree is split near the root: every position splitDepth moves deep is sent to a
+ProcessPoolExecutor worker as a FEN string, the workers build their own GameState from it and the node counts or
+scores are added back up here.
+
+  python ChessParallel.py perft -p kiwipete -d 4 -w 16
+  python ChessParallel.py perft --fen "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1" -d 6 --split 2 --chunk 8
+  python ChessParallel.py analyse -p start -d 4
+'''
+import argparse
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import ChessEngine
+import ChessPerft
+import ChessAI
+
+
+'''
+The legal move with the given notation (like e2e4), raises ValueError if there isn't one
+'''
+def findMove(gs, notation):
+  for move in gs.getValidMoves():
+    if move.getChessNotation() == notation:
+      return move
+  raise ValueError("Illegal move '" + notation + "' in " + gs.toFEN())
+
+
+'''
+Worker side of parallelPerft: perft of every (root move, fen) in the chunk. Returns the pid of the worker, the nodes
+under each root move and how long the chunk took
+'''
+def perftChunk(chunk, depth, backend):
+  start = time.perf_counter()
+  nodes = {}
+  for rootMove, fen in chunk:
+    gs = ChessEngine.createGameState(backend, fen)
+    nodes[rootMove] = nodes.get(rootMove, 0) + ChessPerft.perft(gs, depth)
+  return os.getpid(), nodes, time.perf_counter() - start
+
+
+'''
+Worker side of parallelAnalyse: search each root move of the position to depth - 1 and return its score from the
+point of view of the player making it
+'''
+def analyseChunk(fen, rootMoves, depth, hashMB, backend):
+  start = time.perf_counter()
+  searcher = ChessAI.Search(hashMB)
+  scores = {}
+  nodes = 0
+  for rootMove in rootMoves:
+    gs = ChessEngine.createGameState(backend, fen)
+    gs.makeMove(findMove(gs, rootMove))
+    if depth <= 1:
+      score = -ChessAI.evaluate(gs)
+      nodes += 1
+    else:
+      move, childScore, _ = searcher.findBestMove(gs, depth - 1)
+      if move is None: # no moves after this one, checkmate or stalemate
+        score = ChessAI.MATE_SCORE - 1 if gs.checkmate else 0
+      else:
+        score = -childScore
+      nodes += searcher.nodes
+    scores[rootMove] = score
+  return os.getpid(), scores, nodes, time.perf_counter() - start
+
+
+'''
+Every position splitDepth moves deep under gs as (root move notation, fen). Branches that end in checkmate or
+stalemate before that have no positions to send
+'''
+def splitPositions(gs, splitDepth, rootMove=None):
+  if splitDepth == 0:
+    return [(rootMove, gs.toFEN())]
+  positions = []
+  for move in gs.getValidMoves():
+    gs.makeMove(move)
+    positions += splitPositions(gs, splitDepth - 1, rootMove or move.getChessNotation())
+    gs.undoMove()
+  return positions
+
+
+def chunked(items, chunkSize):
+  return [items[i:i + chunkSize] for i in range(0, len(items), chunkSize)]
+
+
+'''
+Add the throughput of a finished chunk to the per worker stats {pid: {'chunks', 'nodes', 'seconds', 'nps'}}
+'''
+def addWorkerStats(workerStats, pid, nodes, seconds):
+  stats = workerStats.setdefault(pid, {'chunks': 0, 'nodes': 0, 'seconds': 0.0, 'nps': 0.0})
+  stats['chunks'] += 1
+  stats['nodes'] += nodes
+  stats['seconds'] += seconds
+  stats['nps'] = stats['nodes'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+
+
+'''
+Perft of the position in fen using a pool of workers (os.cpu_count() by default). The tree is split splitDepth
+moves deep and chunkSize positions are sent to a worker at a time (by default enough chunks for about 4 per worker).
+Returns {'nodes', 'divide': {root move: nodes}, 'seconds', 'nps', 'workers': {pid: stats}}
+'''
+def parallelPerft(fen, depth, workers=None, splitDepth=1, chunkSize=None, backend=None):
+  start = time.perf_counter()
+  gs = ChessEngine.createGameState(backend, fen)
+  workers = workers or os.cpu_count() or 1
+  splitDepth = max(0, min(splitDepth, depth - 1)) # the workers need at least one move left to count
+  positions = splitPositions(gs, splitDepth)
+  if chunkSize is None:
+    chunkSize = max(1, math.ceil(len(positions) / (workers * 4)))
+  divide = {}
+  workerStats = {}
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    futures = [pool.submit(perftChunk, chunk, depth - splitDepth, backend) for chunk in chunked(positions, chunkSize)]
+    for future in as_completed(futures):
+      pid, nodes, seconds = future.result()
+      for rootMove, count in nodes.items():
+        divide[rootMove] = divide.get(rootMove, 0) + count
+      addWorkerStats(workerStats, pid, sum(nodes.values()), seconds)
+  seconds = time.perf_counter() - start
+  total = sum(divide.values())
+  if splitDepth == 0: # depth 1, nothing to divide
+    divide = {}
+  return {'nodes': total, 'divide': divide, 'seconds': seconds, 'nps': total / seconds if seconds > 0 else 0.0,
+          'workers': workerStats}
+
+
+'''
+Search every root move of the position in fen to depth in parallel (each worker searches its moves to depth - 1
+with its own transposition table of hashMB). Returns {'move', 'score', 'scores': {root move: score}, 'nodes',
+'seconds', 'nps', 'workers': {pid: stats}}, scores are from the point of view of the player to move
+'''
+def parallelAnalyse(fen, depth, workers=None, chunkSize=1, hashMB=16, backend=None):
+  start = time.perf_counter()
+  gs = ChessEngine.createGameState(backend, fen)
+  rootMoves = [move.getChessNotation() for move in gs.getValidMoves()]
+  workers = workers or os.cpu_count() or 1
+  scores = {}
+  workerStats = {}
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    futures = [pool.submit(analyseChunk, fen, chunk, depth, hashMB, backend) for chunk in chunked(rootMoves, chunkSize)]
+    for future in as_completed(futures):
+      pid, chunkScores, nodes, seconds = future.result()
+      scores.update(chunkScores)
+      addWorkerStats(workerStats, pid, nodes, seconds)
+  seconds = time.perf_counter() - start
+  nodes = sum(stats['nodes'] for stats in workerStats.values())
+  best = max(rootMoves, key=lambda move: scores[move]) if rootMoves else None
+  return {'move': best, 'score': scores[best] if best else None, 'scores': scores, 'nodes': nodes,
+          'seconds': seconds, 'nps': nodes / seconds if seconds > 0 else 0.0, 'workers': workerStats}
+
+
+def printWorkers(workerStats):
+  for pid in sorted(workerStats):
+    stats = workerStats[pid]
+    print('  worker %-8d %4d chunks %12d nodes %8.3fs %10.0f nodes/s' % (pid, stats['chunks'], stats['nodes'],
+                                                                           stats['seconds'], stats['nps']))
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Parallel perft and analysis for ChessEngine')
+  parser.add_argument('command', choices=('perft', 'analyse'))
+  parser.add_argument('-p', '--position', choices=sorted(ChessPerft.POSITIONS), default='start',
+                      help='position from the perft suite (default: start)')
+  parser.add_argument('--fen', help='use this position instead')
+  parser.add_argument('-d', '--depth', type=int, default=4)
+  parser.add_argument('-w', '--workers', type=int, help='number of worker processes (default: one per core)')
+  parser.add_argument('--split', type=int, default=1, help='how many moves deep to split the perft tree (default: 1)')
+  parser.add_argument('--chunk', type=int, help='positions (perft) or root moves (analyse) per task')
+  parser.add_argument('--backend', choices=ChessEngine.BACKENDS, help='board backend (default: CHESS_BACKEND or list)')
+  args = parser.parse_args(argv)
+
+  fen = args.fen or ChessPerft.POSITIONS[args.position][0]
+  if args.command == 'perft':
+    result = parallelPerft(fen, args.depth, args.workers, args.split, args.chunk, args.backend)
+    for rootMove in sorted(result['divide']):
+      print('  ' + rootMove + ': ' + str(result['divide'][rootMove]))
+    print('depth %d: %d nodes in %.3fs, %.0f nodes/s' % (args.depth, result['nodes'], result['seconds'], result['nps']))
+    expected = None if args.fen else ChessPerft.POSITIONS[args.position][1]
+    if expected is not None and args.depth <= len(expected) and expected[args.depth - 1] != result['nodes']:
+      print('WRONG, expected ' + str(expected[args.depth - 1]))
+      printWorkers(result['workers'])
+      return 1
+  else:
+    result = parallelAnalyse(fen, args.depth, args.workers, args.chunk or 1, backend=args.backend)
+    for rootMove in sorted(result['scores'], key=lambda move: -result['scores'][move]):
+      print('  %s: %d' % (rootMove, result['scores'][rootMove]))
+    print('best %s (%s) at depth %d, %d nodes in %.3fs, %.0f nodes/s' % (result['move'], result['score'], args.depth,
+                                                                       result['nodes'], result['seconds'], result['nps']))
+  printWorkers(result['workers'])
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
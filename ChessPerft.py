@@ -0,0 +1,215 @@
+'''
+Perft (performance test) for ChessEngine. Counts every leaf of the move tree to a depth, which checks that
+getValidMoves/makeMove/undoMove are still correct and measures how fast they are.
+
+  python ChessPerft.py                         run the whole suite to the deepest known count of each position
+  python ChessPerft.py -p kiwipete -d 3 --divide
+  python ChessPerft.py --fen "8/8/8/8/8/8/8/K1k5 w - - 0 1" -d 4
+  python ChessPerft.py --backend bitboard --json results.json --compare baseline.json
+  python ChessPerft.py --epd perftsuite.epd -d 3
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import ChessEngine
+
+try:
+  import resource # not available on windows
+except ImportError:
+  resource = None
+
+'''
+Standard perft positions with their node counts for depth 1, 2, ... The engine only promotes to queens, so where
+promotions can happen the counts only include queen promotions (the published numbers are in the comments)
+'''
+POSITIONS = {
+  'start': ('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1', [20, 400, 8902, 197281]),
+  'kiwipete': ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', [48, 2039, 97862]),
+  'position3': ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', [14, 191, 2812, 43238, 674624]),
+  'position4': ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', [6, 228, 8087]), # 6, 264, 9467
+  'position5': ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', [41, 1373, 54007]), # 44, 1486, 62379
+  # enpassant edge cases
+  'illegal-ep-1': ('3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1', [18, 92, 1670, 10138, 185429]),
+  'illegal-ep-2': ('8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1', [13, 102, 1266, 10276, 135655]),
+  'ep-gives-check': ('8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1', [15, 126, 1928, 13931]),
+  # castling edge cases
+  'short-castle-check': ('5k2/8/8/8/8/8/8/4K2R w K - 0 1', [15, 66, 1198, 6399, 120330]),
+  'long-castle-check': ('3k4/8/8/8/8/8/8/R3K3 w Q - 0 1', [16, 71, 1286, 7418, 141077]),
+  'castle-rights': ('r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1', [26, 1141, 27826]),
+  'castle-prevented': ('r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1', [44, 1494, 50509]),
+  # checks, mates and stalemates
+  'discovered-check': ('8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1', [29, 165, 5160]), # 29, 165, 5160, 31961
+  'self-stalemate': ('K1k5/8/P7/8/8/8/8/8 w - - 0 1', [2, 6, 13, 63]), # 2, 6, 13, 63, 382
+  'stalemate-checkmate': ('8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1', [37, 183, 6559, 23527]),
+}
+
+'''
+Positions from an EPD file in the usual perft suite format, the node counts are D1, D2, ... operations:
+  rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - ;D1 20 ;D2 400 ;D3 8902
+Returns (name, fen, counts) for each line, lazily
+'''
+def readPerftEPD(path):
+  number = 0
+  for fen, operations in ChessEngine.readEPD(path):
+    number += 1
+    counts = []
+    while 'D' + str(len(counts) + 1) in operations:
+      counts.append(int(operations['D' + str(len(counts) + 1)]))
+    yield operations.get('id', path + ':' + str(number)), fen, counts
+
+
+'''
+Count the leaf nodes depth moves deep. The last level is counted without making the moves
+'''
+def perft(gs, depth):
+  if depth == 0:
+    return 1
+  codes = gs.getValidMoveCodes() # packed moves, a Move is only made for the moves that get played
+  if depth == 1:
+    return len(codes)
+  nodes = 0
+  for code in codes:
+    gs.makeMove(ChessEngine.Move.fromCode(code, gs.board))
+    nodes += perft(gs, depth - 1)
+    gs.undoMove()
+  return nodes
+
+
+'''
+Perft split up by the first move, returns {move notation: nodes}. Handy for finding which move a bug is under
+'''
+def divide(gs, depth):
+  results = {}
+  for move in gs.getValidMoves():
+    gs.makeMove(move)
+    results[move.getChessNotation()] = perft(gs, depth - 1)
+    gs.undoMove()
+  return results
+
+
+'''
+Run perft for every depth from 1 to depth, timing each one. Returns a list of result dicts
+'''
+def runPosition(name, fen, depth, expected=None, backend=None, showDivide=False):
+  results = []
+  gs = ChessEngine.createGameState(backend, fen)
+  for d in range(1, depth + 1):
+    start = time.perf_counter()
+    if showDivide and d == depth:
+      split = divide(gs, d)
+      nodes = sum(split.values())
+    else:
+      nodes = perft(gs, d)
+    seconds = time.perf_counter() - start
+    expectedNodes = expected[d - 1] if expected is not None and d <= len(expected) else None
+    results.append({'position': name, 'depth': d, 'nodes': nodes, 'expected': expectedNodes,
+                    'ok': expectedNodes is None or nodes == expectedNodes, 'seconds': seconds,
+                    'nps': nodes / seconds if seconds > 0 else 0.0})
+    if showDivide and d == depth:
+      for notation in sorted(split):
+        print('  ' + notation + ': ' + str(split[notation]))
+  return results
+
+
+def peakMemoryKB():
+  if resource is None:
+    return None
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return peak // 1024 if sys.platform == 'darwin' else peak # bytes on mac, kilobytes on linux
+
+
+def gitCommit():
+  try:
+    return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=5).stdout.strip() or None
+  except (OSError, subprocess.SubprocessError):
+    return None
+
+
+def printResult(result):
+  status = 'ok' if result['ok'] else 'FAILED (expected ' + str(result['expected']) + ')'
+  print('%-20s depth %d %12d nodes %8.3fs %10.0f nodes/s  %s' % (result['position'], result['depth'], result['nodes'],
+                                                                result['seconds'], result['nps'], status))
+
+
+'''
+Print how nodes per second changed compared to an earlier results file
+'''
+def compareResults(results, baselineFile):
+  with open(baselineFile) as f:
+    baseline = json.load(f)
+  old = {(r['position'], r['depth']): r for r in baseline['results']}
+  print('\nCompared to ' + baselineFile + ' (' + str(baseline.get('commit')) + '):')
+  for result in results:
+    previous = old.get((result['position'], result['depth']))
+    if previous is None or previous['nps'] == 0:
+      continue
+    change = (result['nps'] / previous['nps'] - 1) * 100
+    print('%-20s depth %d %10.0f -> %10.0f nodes/s (%+.1f%%)' % (result['position'], result['depth'],
+                                                             previous['nps'], result['nps'], change))
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Perft and divide for ChessEngine')
+  parser.add_argument('-p', '--position', action='append', choices=sorted(POSITIONS),
+                      help='position from the suite to run (can be given more than once, default: all)')
+  parser.add_argument('--fen', help='run a custom position instead of the suite')
+  parser.add_argument('--epd', help='run the positions of an EPD file (D1, D2, ... operations are the expected counts)')
+  parser.add_argument('-d', '--depth', type=int, help='depth to run to (default: the deepest known count of each position)')
+  parser.add_argument('--divide', action='store_true', help='print the node count under each root move')
+  parser.add_argument('--backend', choices=ChessEngine.BACKENDS, help='board backend (default: CHESS_BACKEND or list)')
+  parser.add_argument('--tracemalloc', action='store_true', help='also track peak python allocations (slower)')
+  parser.add_argument('--json', help='write the results to this file')
+  parser.add_argument('--compare', help='compare nodes per second with an earlier --json file')
+  args = parser.parse_args(argv)
+
+  if args.fen:
+    runs = [('fen', args.fen, args.depth or 3, None)]
+  elif args.epd:
+    runs = ((name, fen, args.depth or len(counts) or 3, counts) for name, fen, counts in readPerftEPD(args.epd))
+  else:
+    names = args.position or list(POSITIONS)
+    runs = [(name, POSITIONS[name][0], args.depth or len(POSITIONS[name][1]), POSITIONS[name][1]) for name in names]
+
+  if args.tracemalloc:
+    tracemalloc.start()
+  results = []
+  totalStart = time.perf_counter()
+  for name, fen, depth, expected in runs:
+    positionResults = runPosition(name, fen, depth, expected, args.backend, args.divide)
+    for result in positionResults:
+      printResult(result)
+    results += positionResults
+  totalSeconds = time.perf_counter() - totalStart
+  totalNodes = sum(r['nodes'] for r in results)
+
+  report = {'commit': gitCommit(), 'backend': args.backend or os.environ.get('CHESS_BACKEND', 'list'),
+            'python': platform.python_version(), 'results': results, 'totalNodes': totalNodes,
+            'totalSeconds': totalSeconds, 'nps': totalNodes / totalSeconds if totalSeconds > 0 else 0.0,
+            'peakMemoryKB': peakMemoryKB(), 'peakTracedKB': None, 'ok': all(r['ok'] for r in results)}
+  if args.tracemalloc:
+    report['peakTracedKB'] = tracemalloc.get_traced_memory()[1] // 1024
+    tracemalloc.stop()
+
+  print('\n%d nodes in %.3fs, %.0f nodes/s' % (totalNodes, totalSeconds, report['nps']))
+  if report['peakMemoryKB'] is not None:
+    print('peak memory (max rss): %d KB' % report['peakMemoryKB'])
+  if report['peakTracedKB'] is not None:
+    print('peak traced allocations: %d KB' % report['peakTracedKB'])
+  if not report['ok']:
+    print('some node counts are WRONG')
+
+  if args.json:
+    with open(args.json, 'w') as f:
+      json.dump(report, f, indent=2)
+  if args.compare:
+    compareResults(results, args.compare)
+  return 0 if report['ok'] else 1
+
+
+if __name__ == '__main__':
+  sys.exit(main())
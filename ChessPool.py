@@ -0,0 +1,226 @@
+'''
+A pool of UCI engine processes for analysing many positions or games at once. Each worker is a ChessUCI.UCIEngine
+with its own Hash and Threads budget, jobs of (position, limits) go through one queue, and a worker that crashes or
+stops answering is restarted and its job retried.
+
+  pool = ChessPool.EnginePool(['stockfish'], size=4, hashMB=256, threads=2)
+  futures = [pool.submit(fen=fen, depth=18) for fen in fens]
+  for future in futures:
+    print(future.result()['bestmove'])
+  print(pool.stats())
+  pool.close()
+
+python ChessAI.py works as the engine for trying it out without Stockfish.
+'''
+import concurrent.futures
+import queue
+import threading
+import time
+import ChessCache
+import ChessUCI
+
+
+class Job():
+  def __init__(self, fen, moves, limits, cacheKey=None):
+    self.fen = fen
+    self.moves = list(moves)
+    self.limits = limits
+    self.cacheKey = cacheKey # (position, settings) to store the result under, if the pool has a cache
+    self.future = concurrent.futures.Future()
+    self.submitted = time.perf_counter()
+    self.attempts = 0
+
+
+class PoolWorker():
+  def __init__(self, pool, number):
+    self.pool = pool
+    self.number = number
+    self.engine = None
+    self.restarts = 0
+    self.jobs = 0
+    self.errors = 0
+    self.nodes = 0
+    self.searchSeconds = 0.0 # time spent in the engine
+    self.latencySeconds = 0.0 # time from submit to result, including the wait in the queue
+    self.maxLatency = 0.0
+    self.lock = threading.Lock() # held while the worker runs a job or is health checked
+    self.thread = threading.Thread(target=self.run, name='engine-pool-' + str(number), daemon=True)
+
+  '''
+  Start (or restart) the engine process with the pool's options
+  '''
+  def startEngine(self):
+    if self.engine is not None:
+      self.engine.quit(1)
+      self.restarts += 1
+    self.engine = ChessUCI.UCIEngine(self.pool.command, self.pool.options)
+    self.engine.start(self.pool.startTimeout)
+
+  def healthy(self):
+    return self.engine is not None and self.engine.isReady(self.pool.readyTimeout)
+
+  '''
+  Ask the engine if it is ready and restart it if it doesn't answer. Returns whether it was healthy, or None if the
+  worker is busy with a job and blocking is False
+  '''
+  def checkHealth(self, blocking=True):
+    if not self.lock.acquire(blocking=blocking):
+      return None
+    try:
+      healthy = self.healthy()
+      if not healthy:
+        try:
+          self.startEngine()
+        except ChessUCI.UCIError:
+          self.engine = None # the next job tries again
+      return healthy
+    finally:
+      self.lock.release()
+
+  def run(self):
+    while True:
+      try:
+        job = self.pool.jobs.get(timeout=self.pool.healthInterval)
+      except queue.Empty: # idle for a while, find a dead engine now rather than with the next job
+        self.checkHealth()
+        continue
+      if job is None: # the pool is closing
+        return
+      if job.attempts > 0 or job.future.set_running_or_notify_cancel(): # retried jobs are already running
+        with self.lock:
+          self.runJob(job)
+
+  def runJob(self, job):
+    job.attempts += 1
+    start = time.perf_counter()
+    try:
+      if self.engine is None or not self.engine.isRunning():
+        self.startEngine()
+      limits = dict(job.limits)
+      search = self.engine.go(job.fen, job.moves, **limits)
+      try:
+        bestMove, ponderMove = search.result(self.pool.jobTimeout)
+      except concurrent.futures.TimeoutError:
+        search.stop()
+        bestMove, ponderMove = search.result(self.pool.readyTimeout) # no answer to stop either, restart below
+    except Exception as e:
+      self.errors += 1
+      try:
+        self.startEngine() # crashed or stuck, get a fresh process for the next job
+      except ChessUCI.UCIError:
+        self.engine = None
+      if job.attempts <= self.pool.retries:
+        self.pool.jobs.put(job) # give it another go, maybe on another worker
+      else:
+        job.future.set_exception(e if isinstance(e, ChessUCI.UCIError) else ChessUCI.UCIError(str(e)))
+      return
+    seconds = time.perf_counter() - start
+    latency = time.perf_counter() - job.submitted
+    self.jobs += 1
+    self.nodes += search.info.get('nodes', 0)
+    self.searchSeconds += seconds
+    self.latencySeconds += latency
+    self.maxLatency = max(self.maxLatency, latency)
+    if job.cacheKey is not None and bestMove is not None:
+      self.pool.cache.put(job.cacheKey[0], job.cacheKey[1], bestMove, ChessCache.scoreText(search.info), search.info.get('depth'))
+    job.future.set_result({'bestmove': bestMove, 'ponder': ponderMove, 'info': search.info, 'worker': self.number,
+                           'seconds': seconds, 'latency': latency, 'cached': False})
+
+  def stats(self):
+    return {'jobs': self.jobs, 'errors': self.errors, 'restarts': self.restarts, 'busy': self.lock.locked(), 'nodes': self.nodes,
+            'nps': self.nodes / self.searchSeconds if self.searchSeconds > 0 else 0.0,
+            'jobsPerSecond': self.jobs / self.searchSeconds if self.searchSeconds > 0 else 0.0,
+            'meanLatency': self.latencySeconds / self.jobs if self.jobs else 0.0, 'maxLatency': self.maxLatency}
+
+
+class EnginePool():
+  '''
+  size engine processes of command, each with hashMB of hash and threads search threads (plus any other UCI options).
+  A job that fails is retried up to retries times, jobTimeout is how long a search may take before it is stopped.
+  A worker that has had no job for healthInterval seconds checks its engine (None to leave it to checkHealth).
+  With a ChessCache.AnalysisCache as cache, positions it already has are answered without an engine
+  '''
+  def __init__(self, command, size=2, hashMB=64, threads=1, options=None, retries=1, jobTimeout=None,
+               startTimeout=10, readyTimeout=5, cache=None, healthInterval=30):
+    self.command = command
+    self.cache = cache
+    self.options = dict(options or {})
+    self.options['Hash'] = hashMB
+    self.options['Threads'] = threads
+    self.retries = retries
+    self.jobTimeout = jobTimeout
+    self.startTimeout = startTimeout
+    self.readyTimeout = readyTimeout
+    self.healthInterval = healthInterval
+    self.jobs = queue.Queue()
+    self.workers = [PoolWorker(self, number) for number in range(size)]
+    try:
+      for worker in self.workers:
+        worker.startEngine()
+    except Exception: # don't leave the engines that did start running
+      for worker in self.workers:
+        if worker.engine is not None:
+          worker.engine.quit()
+      raise
+    for worker in self.workers:
+      worker.thread.start()
+
+  '''
+  Queue a search of the position (fen, the start position if None, plus moves) with UCI go limits like depth=18 or
+  movetime=500. Returns a future of {'bestmove', 'ponder', 'info' (the last info line), 'worker', 'seconds', 'latency',
+  'cached'}
+  '''
+  def submit(self, fen=None, moves=(), **limits):
+    cacheKey = None
+    if self.cache is not None:
+      cacheKey = (ChessCache.gamePositionKey(fen, moves), self.cacheSettings(limits))
+      cached = self.cache.get(*cacheKey)
+      if cached is not None:
+        future = concurrent.futures.Future()
+        future.set_result({'bestmove': cached[0], 'ponder': None, 'info': {}, 'worker': None, 'seconds': 0.0,
+                           'latency': 0.0, 'cached': True})
+        return future
+    job = Job(fen, moves, limits, cacheKey)
+    self.jobs.put(job)
+    return job.future
+
+  def cacheSettings(self, limits): # the engine, its options (other than hash and threads) and the limits
+    settings = {name: value for name, value in self.options.items() if name not in ('Hash', 'Threads')}
+    settings.update(limits)
+    settings['engine'] = ' '.join(self.command) if not isinstance(self.command, str) else self.command
+    return settings
+
+  '''
+  Search every position (fen strings, or (fen, moves) pairs) with the same limits, returns the results in order
+  '''
+  def analyse(self, positions, **limits):
+    futures = []
+    for position in positions:
+      fen, moves = (position, ()) if isinstance(position, str) or position is None else position
+      futures.append(self.submit(fen, moves, **limits))
+    return [future.result() for future in futures]
+
+  '''
+  Ask every idle worker's engine if it is ready and restart the ones that don't answer, right now. Idle workers also
+  do this by themselves every healthInterval seconds. Returns {worker: healthy}
+  '''
+  def checkHealth(self):
+    health = {}
+    for worker in self.workers:
+      healthy = worker.checkHealth(blocking=False)
+      health[worker.number] = True if healthy is None else healthy # a busy worker is answering a job right now
+    return health
+
+  def stats(self):
+    return {worker.number: worker.stats() for worker in self.workers}
+
+  def pending(self): # jobs waiting for a worker
+    return self.jobs.qsize()
+
+  def close(self):
+    for worker in self.workers:
+      self.jobs.put(None)
+    for worker in self.workers:
+      worker.thread.join()
+      if worker.engine is not None:
+        worker.engine.quit()
@@ -0,0 +1,166 @@
+'''
+Timing of the hot paths (move generation, attack checks, AI searches, drawing) that can be left in the code. It is
+off unless CHESS_PROFILE is set, and then the decorated functions are returned untouched, so it costs nothing.
+
+  CHESS_PROFILE=profile.json python ChessMain.py
+
+writes profile.json at exit: 'stats' has the calls, total/mean/percentile times and counters (like moves generated)
+of every entry point, and 'traceEvents' the individual calls in Chrome trace format, so the same file can be opened
+in chrome://tracing or ui.perfetto.dev. CHESS_PROFILE=1 writes chess-profile.json.
+
+  @ChessProfile.profiled('getValidMoves', len)   time every call, and count len(result) as items
+  with ChessProfile.section('frame'): ...        time a block
+  ChessProfile.record('search', seconds)         add a time measured some other way
+  ChessProfile.count('nodes', n)                 add to a counter
+'''
+import atexit
+import functools
+import json
+import os
+import random
+import threading
+import time
+
+PROFILE_PATH = os.environ.get('CHESS_PROFILE', '')
+ENABLED = PROFILE_PATH not in ('', '0')
+if PROFILE_PATH == '1':
+  PROFILE_PATH = 'chess-profile.json'
+MAX_SAMPLES = 10000 # per name, for the percentiles (a random sample once there are more calls)
+MAX_EVENTS = 200000 # trace events kept, later calls are only counted
+
+timings = {} # name: Timing
+counters = {} # name: total
+events = []
+lock = threading.Lock()
+start = time.perf_counter()
+
+
+class Timing():
+  def __init__(self):
+    self.calls = 0
+    self.seconds = 0.0
+    self.maxSeconds = 0.0
+    self.samples = []
+    self.items = 0 # what the counter function of profiled added up, e.g. moves generated
+
+  def add(self, seconds):
+    self.calls += 1
+    self.seconds += seconds
+    self.maxSeconds = max(self.maxSeconds, seconds)
+    if len(self.samples) < MAX_SAMPLES:
+      self.samples.append(seconds)
+    else: # reservoir sampling keeps every call equally likely to be in the sample
+      i = random.randrange(self.calls)
+      if i < MAX_SAMPLES:
+        self.samples[i] = seconds
+
+  def stats(self):
+    samples = sorted(self.samples)
+    def percentile(p):
+      return samples[min(len(samples) - 1, int(len(samples) * p))] if samples else 0.0
+    stats = {'calls': self.calls, 'totalMs': self.seconds * 1000, 'meanMs': self.seconds / self.calls * 1000 if self.calls else 0.0,
+             'p50Ms': percentile(0.5) * 1000, 'p95Ms': percentile(0.95) * 1000, 'p99Ms': percentile(0.99) * 1000,
+             'maxMs': self.maxSeconds * 1000}
+    if self.items:
+      stats['items'] = self.items
+    return stats
+
+
+'''
+Add a call of name that started at perf_counter time began and took seconds
+'''
+def record(name, seconds, began=None, items=0):
+  if not ENABLED:
+    return
+  with lock:
+    timing = timings.get(name)
+    if timing is None:
+      timing = timings[name] = Timing()
+    timing.add(seconds)
+    timing.items += items
+    if len(events) < MAX_EVENTS:
+      began = time.perf_counter() - seconds if began is None else began
+      events.append((name, began, seconds, threading.get_ident()))
+
+
+def count(name, n=1):
+  if not ENABLED:
+    return
+  with lock:
+    counters[name] = counters.get(name, 0) + n
+
+
+'''
+Decorator timing every call as name. counter(result) is added to the name's items, e.g. len for a list of moves.
+When profiling is off the function is returned as it is
+'''
+def profiled(name, counter=None):
+  def decorate(function):
+    if not ENABLED:
+      return function
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+      began = time.perf_counter()
+      result = function(*args, **kwargs)
+      record(name, time.perf_counter() - began, began, counter(result) if counter is not None else 0)
+      return result
+    return wrapper
+  return decorate
+
+
+class Section():
+  def __init__(self, name):
+    self.name = name
+
+  def __enter__(self):
+    self.began = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    record(self.name, time.perf_counter() - self.began, self.began)
+    return False
+
+
+class NoSection():
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+noSection = NoSection()
+
+
+def section(name): # with section('frame'): ... times the block
+  return Section(name) if ENABLED else noSection
+
+
+def stats():
+  with lock:
+    return {'timings': {name: timing.stats() for name, timing in sorted(timings.items())}, 'counters': dict(counters)}
+
+
+'''
+The stats and the calls as Chrome trace events ('X' events, times in microseconds since the module was loaded)
+'''
+def report():
+  with lock:
+    traceEvents = [{'name': name, 'ph': 'X', 'ts': (began - start) * 1e6, 'dur': seconds * 1e6, 'pid': os.getpid(),
+                    'tid': tid} for name, began, seconds, tid in events]
+  return {'traceEvents': traceEvents, 'displayTimeUnit': 'ms', 'stats': stats()}
+
+
+def write(path=None):
+  with open(path or PROFILE_PATH, 'w') as f:
+    json.dump(report(), f)
+
+
+def reset():
+  with lock:
+    timings.clear()
+    counters.clear()
+    events.clear()
+
+
+if ENABLED:
+  atexit.register(write)
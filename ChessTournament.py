@@ -0,0 +1,349 @@
+'''
+Headless engine-vs-engine matches, for checking that a change didn't make the AI weaker (or slower) without opening
+the pygame window. Games are played straight on ChessEngine.GameState in a ProcessPoolExecutor, each worker keeps
+its own players. Every opening is played twice, once with each player as white.
+
+Players are given as:
+  ai:3                          ChessAI at level 3 (see ChessAI.LEVELS)
+  ai:depth=3,movetime=200       ChessAI with these search limits (depth, nodes, movetime) and noise=, hash=
+  uci:stockfish,movetime=100    a UCI engine, go limits and UCI options (Skill Level=5) after the command
+
+  python ChessTournament.py ai:2 ai:3 -g 20
+  python ChessTournament.py ai:depth=3 "uci:python ChessAI.py,depth=2" --openings openings.epd -w 4 --games-out games.jsonl
+'''
+import argparse
+import atexit
+import json
+import math
+import os
+import shlex
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import ChessAI
+import ChessEngine
+import ChessLimits
+import ChessPGN
+import ChessUCI
+
+# a few common openings, used when no --openings file is given (move lists from the start position)
+OPENINGS = [
+  ['e2e4', 'e7e5', 'g1f3', 'b8c6'],
+  ['e2e4', 'c7c5', 'g1f3', 'd7d6'],
+  ['d2d4', 'd7d5', 'c2c4', 'e7e6'],
+  ['d2d4', 'g8f6', 'c2c4', 'g7g6'],
+  ['c2c4', 'e7e5', 'b1c3', 'g8f6'],
+  ['e2e4', 'e7e6', 'd2d4', 'd7d5'],
+  ['e2e4', 'c7c6', 'd2d4', 'd7d5'],
+  ['g1f3', 'd7d5', 'g2g3', 'g8f6'],
+]
+RESULTS = {'1-0': 1.0, '1/2-1/2': 0.5, '0-1': 0.0} # white's score
+
+players = {} # spec: player, for the games of this process
+
+
+class AIPlayer():
+  def __init__(self, limits, noise=0, hashMB=16):
+    self.limits = limits
+    self.noise = noise
+    self.searcher = ChessAI.Search(hashMB)
+
+  def newGame(self):
+    self.searcher.table.clear()
+
+  '''
+  The move to play (notation) and its score in centipawns for the player to move
+  '''
+  def move(self, gs, fen, moves):
+    move, score, depth = self.searcher.searchWithLimits(gs, self.limits, noise=self.noise)
+    return move.getChessNotation(), score
+
+  def close(self):
+    pass
+
+
+class UCIPlayer():
+  def __init__(self, command, limits, options=None):
+    self.limits = limits
+    self.engine = ChessUCI.UCIEngine(command, options)
+    self.engine.start()
+
+  def newGame(self):
+    self.engine.newGame()
+
+  def move(self, gs, fen, moves):
+    search = self.engine.go(fen, moves, **self.limits.goArguments())
+    bestMove = search.result()[0]
+    score = search.info.get('score', {})
+    if 'mate' in score: # mate in n, the same scale as ChessAI's mate scores
+      score = (ChessAI.MATE_SCORE - abs(score['mate'])) * (1 if score['mate'] > 0 else -1)
+    else:
+      score = score.get('cp')
+    return bestMove, score
+
+  def close(self):
+    self.engine.quit()
+
+
+'''
+Make the player described by spec (see the top of the file). Raises ValueError for a spec it can't read
+'''
+def createPlayer(spec):
+  kind, _, rest = spec.partition(':')
+  if kind == 'ai':
+    if rest.isdigit():
+      level = ChessAI.LEVELS[int(rest)]
+      return AIPlayer(level['limits'], level['noise'])
+    settings = parseSettings(rest.split(',') if rest else [])
+    noise = int(settings.pop('noise', 0))
+    hashMB = int(settings.pop('hash', 16))
+    limits = limitsFrom(settings)
+    if settings:
+      raise ValueError("Unknown ai setting '" + next(iter(settings)) + "' in " + spec)
+    return AIPlayer(limits, noise, hashMB)
+  if kind == 'uci' and rest:
+    parts = rest.split(',')
+    settings = parseSettings(parts[1:])
+    limits = limitsFrom(settings)
+    return UCIPlayer(shlex.split(parts[0]), limits, settings) # whatever isn't a limit is a UCI option
+  raise ValueError("Unknown player '" + spec + "', use ai:<level>, ai:<limits> or uci:<command>")
+
+
+def parseSettings(items):
+  settings = {}
+  for item in items:
+    name, equals, value = item.partition('=')
+    if not equals:
+      raise ValueError("Expected name=value, got '" + item + "'")
+    settings[name.strip()] = value.strip()
+  return settings
+
+
+def limitsFrom(settings): # takes the search limits out of settings, depth 3 if there are none
+  limits = {name: int(settings.pop(name)) for name in ('depth', 'nodes', 'movetime') if name in settings}
+  return ChessLimits.SearchLimits(**limits) if limits else ChessLimits.SearchLimits(depth=3)
+
+
+def getPlayer(spec):
+  if spec not in players:
+    players[spec] = createPlayer(spec)
+  return players[spec]
+
+
+@atexit.register
+def closePlayers(): # quit the UCI engines when the worker process ends
+  for player in players.values():
+    player.close()
+  players.clear()
+
+
+'''
+True when neither side can possibly checkmate: bare kings, or a single knight or bishop against a bare king
+'''
+def insufficientMaterial(gs):
+  minors = 0
+  for piece, locations in gs.pieceLocations.items():
+    if not locations or piece[1] == 'K':
+      continue
+    if piece[1] in 'NB':
+      minors += len(locations)
+    else:
+      return False
+  return minors <= 1
+
+
+'''
+The result if the game is over (result, reason), otherwise None. Game rules first, then adjudication: scores
+(white's point of view, one per ply) past resignScore for resignPlies plies in a row win, scores within drawScore
+for drawPlies plies after ply drawAfter draw, and the game is drawn at maxPlies
+'''
+def gameOver(gs, scores, adjudication):
+  if not gs.hasLegalMove():
+    if gs.inCheck():
+      return ('0-1' if gs.whiteToMove else '1-0'), 'checkmate'
+    return '1/2-1/2', 'stalemate'
+  if gs.halfmoveClock >= 100:
+    return '1/2-1/2', '50 moves'
+  if gs.repetitionCount() >= 2:
+    return '1/2-1/2', 'repetition'
+  if insufficientMaterial(gs):
+    return '1/2-1/2', 'insufficient material'
+  resignPlies = adjudication['resignPlies']
+  recent = scores[-resignPlies:]
+  if resignPlies and len(recent) == resignPlies and None not in recent:
+    if all(score >= adjudication['resignScore'] for score in recent):
+      return '1-0', 'adjudicated'
+    if all(score <= -adjudication['resignScore'] for score in recent):
+      return '0-1', 'adjudicated'
+  drawPlies = adjudication['drawPlies']
+  recent = scores[-drawPlies:]
+  if drawPlies and len(scores) >= adjudication['drawAfter'] and len(recent) == drawPlies and None not in recent:
+    if all(abs(score) <= adjudication['drawScore'] for score in recent):
+      return '1/2-1/2', 'adjudicated'
+  if len(gs.moveLog) >= adjudication['maxPlies']:
+    return '1/2-1/2', 'move limit'
+  return None
+
+
+ADJUDICATION = {'resignScore': 1000, 'resignPlies': 8, 'drawScore': 10, 'drawPlies': 16, 'drawAfter': 80,
+                'maxPlies': 300}
+
+
+'''
+Play one game from fen (the start position if None) after the opening moves. Returns {'white', 'black', 'fen',
+'moves', 'result', 'reason', 'seconds'}, moves includes the opening
+'''
+def playGame(whiteSpec, blackSpec, fen=None, opening=(), adjudication=None, backend=None):
+  adjudication = dict(ADJUDICATION, **(adjudication or {}))
+  start = time.perf_counter()
+  gs = ChessEngine.createGameState(backend, fen)
+  moves = []
+  for notation in opening:
+    gs.makeMove(findMove(gs, notation))
+    moves.append(notation)
+  white, black = getPlayer(whiteSpec), getPlayer(blackSpec)
+  white.newGame()
+  if black is not white:
+    black.newGame()
+  scores = [] # white's point of view
+  over = gameOver(gs, scores, adjudication)
+  while over is None:
+    player = white if gs.whiteToMove else black
+    notation, score = player.move(gs, fen, moves)
+    try:
+      move = findMove(gs, notation)
+    except ValueError: # an illegal move loses
+      over = ('0-1' if gs.whiteToMove else '1-0'), 'illegal move ' + str(notation)
+      break
+    scores.append(None if score is None else score if gs.whiteToMove else -score)
+    gs.makeMove(move)
+    moves.append(move.getChessNotation())
+    over = gameOver(gs, scores, adjudication)
+  return {'white': whiteSpec, 'black': blackSpec, 'fen': fen, 'moves': moves, 'result': over[0],
+          'reason': over[1], 'seconds': time.perf_counter() - start}
+
+
+'''
+The legal move with the given notation (like e2e4), raises ValueError if there isn't one. Only queen promotions
+exist on the board, so an underpromotion from an engine is played as a queen
+'''
+def findMove(gs, notation):
+  if notation is not None and len(notation) == 5:
+    notation = notation[:4]
+  for move in gs.getValidMoves():
+    if move.getChessNotation()[:4] == notation:
+      return move
+  raise ValueError("Illegal move '" + str(notation) + "' in " + gs.toFEN())
+
+
+'''
+Openings from an EPD/FEN file as (fen, []) or the built in OPENINGS as (None, moves)
+'''
+def loadOpenings(path=None):
+  if path is None:
+    return [(None, moves) for moves in OPENINGS]
+  return [(fen, []) for fen, operations in ChessEngine.readEPD(path)]
+
+
+'''
+The list of games to play: each opening twice with the colours swapped, cycling through the openings until there
+are games games
+'''
+def schedule(playerA, playerB, openings, games):
+  pairs = []
+  for i in range(games):
+    fen, moves = openings[(i // 2) % len(openings)]
+    white, black = (playerA, playerB) if i % 2 == 0 else (playerB, playerA)
+    pairs.append((white, black, fen, moves))
+  return pairs
+
+
+'''
+playerA's wins, draws and losses over the finished games, its score and the Elo difference that score suggests
+'''
+def standings(playerA, results):
+  wins = draws = losses = 0
+  for game in results:
+    score = RESULTS[game['result']] if game['white'] == playerA else 1 - RESULTS[game['result']]
+    if score == 1:
+      wins += 1
+    elif score == 0:
+      losses += 1
+    else:
+      draws += 1
+  played = wins + draws + losses
+  score = (wins + draws / 2) / played if played else 0.5
+  if score == 0.5:
+    elo = 0.0
+  elif score <= 0 or score >= 1:
+    elo = math.copysign(math.inf, score - 0.5)
+  else:
+    elo = -400 * math.log10(1 / score - 1)
+  return {'wins': wins, 'draws': draws, 'losses': losses, 'score': score, 'elo': elo}
+
+
+'''
+Play games games between playerA and playerB on workers processes (one per core by default). onGame(game) is
+called as each one finishes. Returns {'games': [...], 'standings', 'seconds', 'gamesPerSecond', 'pliesPerSecond'}
+'''
+def runTournament(playerA, playerB, games=10, openings=None, workers=None, adjudication=None, backend=None,
+                  onGame=None):
+  start = time.perf_counter()
+  pairs = schedule(playerA, playerB, openings or loadOpenings(), games)
+  results = []
+  with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+    futures = [pool.submit(playGame, white, black, fen, moves, adjudication, backend) for white, black, fen, moves in pairs]
+    for future in as_completed(futures):
+      game = future.result()
+      results.append(game)
+      if onGame is not None:
+        onGame(game)
+  seconds = time.perf_counter() - start
+  plies = sum(len(game['moves']) for game in results)
+  return {'games': results, 'standings': standings(playerA, results), 'seconds': seconds,
+          'gamesPerSecond': len(results) / seconds if seconds > 0 else 0.0,
+          'pliesPerSecond': plies / seconds if seconds > 0 else 0.0}
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Headless engine-vs-engine matches')
+  parser.add_argument('playerA', help='ai:<level>, ai:depth=3,movetime=200 or uci:<command>,depth=10')
+  parser.add_argument('playerB')
+  parser.add_argument('-g', '--games', type=int, default=10, help='number of games (default: 10)')
+  parser.add_argument('-w', '--workers', type=int, help='number of worker processes (default: one per core)')
+  parser.add_argument('--openings', help='EPD or FEN file of start positions (default: a few common openings)')
+  parser.add_argument('--max-plies', type=int, default=ADJUDICATION['maxPlies'], help='draw games this long')
+  parser.add_argument('--resign-score', type=int, default=ADJUDICATION['resignScore'],
+                      help='adjudicate a win after both sides agree on a score this big (centipawns)')
+  parser.add_argument('--backend', choices=ChessEngine.BACKENDS, help='board backend (default: CHESS_BACKEND or list)')
+  parser.add_argument('--games-out', help='write every game to this file, as PGN if it ends in .pgn, otherwise one JSON object per line')
+  args = parser.parse_args(argv)
+
+  for spec in (args.playerA, args.playerB): # fail here rather than in every worker
+    if not spec.startswith('uci:'):
+      createPlayer(spec)
+  gamesOut = open(args.games_out, 'w') if args.games_out else None
+  def onGame(game):
+    print('%-28s %-28s %-8s %-22s %4d plies %7.2fs' % (game['white'], game['black'], game['result'], game['reason'],
+                                                      len(game['moves']), game['seconds']))
+    if gamesOut is not None and args.games_out.endswith('.pgn'):
+      headers = {'Event': args.playerA + ' vs ' + args.playerB, 'White': game['white'], 'Black': game['black'],
+                 'Termination': game['reason']}
+      gamesOut.write(ChessPGN.gamePGN(game['fen'], game['moves'], headers, game['result'], args.backend))
+    elif gamesOut is not None:
+      gamesOut.write(json.dumps(game) + '\n')
+  adjudication = {'maxPlies': args.max_plies, 'resignScore': args.resign_score}
+  try:
+    result = runTournament(args.playerA, args.playerB, args.games, loadOpenings(args.openings), args.workers,
+                           adjudication, args.backend, onGame)
+  finally:
+    if gamesOut is not None:
+      gamesOut.close()
+  table = result['standings']
+  print('%s vs %s: +%d =%d -%d, score %.1f%%, elo %+.0f' % (args.playerA, args.playerB, table['wins'], table['draws'],
+                                                           table['losses'], table['score'] * 100, table['elo']))
+  print('%d games in %.2fs, %.2f games/s, %.0f plies/s' % (len(result['games']), result['seconds'],
+                                                           result['gamesPerSecond'], result['pliesPerSecond']))
+
+
+if __name__ == '__main__':
+  main()
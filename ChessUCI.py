@@ -0,0 +1,332 @@
+'''
+Asyncio UCI client. Talks to a UCI engine process (Stockfish, or `python ChessAI.py` as a small local stand-in)
+without blocking the caller: the asyncio loop runs on a background thread, go() returns straight away and the
+bestmove arrives through a future the pygame loop can poll every frame.
+
+  engine = ChessUCI.UCIEngine(['stockfish'], {'Hash': 64})
+  engine.start()
+  search = engine.go(moves=['e2e4'], depth=15, onInfo=print) # info lines are parsed into dicts
+  ...
+  if search.done():
+    bestMove, ponderMove = search.result()
+'''
+import asyncio
+import concurrent.futures
+import subprocess
+import threading
+
+# the one asyncio loop all engines share, started on a daemon thread the first time it is needed
+loopLock = threading.Lock()
+sharedLoop = None
+
+INFO_INTS = ('depth', 'seldepth', 'multipv', 'nodes', 'nps', 'time', 'hashfull', 'tbhits', 'currmovenumber', 'cpuload')
+GO_LIMITS = ('depth', 'nodes', 'movetime', 'wtime', 'btime', 'winc', 'binc', 'movestogo', 'mate')
+
+
+class UCIError(Exception): # the engine died, didn't answer in time or was used wrongly
+  pass
+
+
+'''
+The shared event loop, started on a background thread the first time
+'''
+def eventLoop():
+  global sharedLoop
+  with loopLock:
+    if sharedLoop is None:
+      sharedLoop = asyncio.new_event_loop()
+      threading.Thread(target=sharedLoop.run_forever, name='uci-loop', daemon=True).start()
+    return sharedLoop
+
+
+'''
+Parse an info line into a dict, e.g.
+  'info depth 12 score cp 31 nodes 20451 pv e2e4 e7e5' -> {'depth': 12, 'score': {'cp': 31}, 'nodes': 20451, 'pv': ['e2e4', 'e7e5']}
+Scores are {'cp': centipawns} or {'mate': moves}, with 'lowerbound'/'upperbound': True when the engine sends them
+'''
+def parseInfo(line):
+  tokens = line.split()
+  info = {}
+  i = 1 # skip 'info'
+  while i < len(tokens):
+    token = tokens[i]
+    if token in INFO_INTS and i + 1 < len(tokens):
+      try:
+        info[token] = int(tokens[i + 1])
+      except ValueError:
+        pass
+      i += 2
+    elif token == 'score' and i + 2 < len(tokens):
+      score = {tokens[i + 1]: int(tokens[i + 2])}
+      i += 3
+      while i < len(tokens) and tokens[i] in ('lowerbound', 'upperbound'):
+        score[tokens[i]] = True
+        i += 1
+      info['score'] = score
+    elif token == 'currmove' and i + 1 < len(tokens):
+      info['currmove'] = tokens[i + 1]
+      i += 2
+    elif token in ('pv', 'refutation', 'currline'): # the moves run to the end of the line
+      info[token] = tokens[i + 1:]
+      break
+    elif token == 'string':
+      info['string'] = ' '.join(tokens[i + 1:])
+      break
+    else:
+      i += 1
+  return info
+
+
+'''
+A running go command. done() and result() can be called from any thread, result() gives (bestmove, ponder move or
+None). info is the latest parsed info line and infos all of them
+'''
+class UCISearch():
+  def __init__(self, engine, goCommand, positionCommand, onInfo=None, ponder=False):
+    self.engine = engine
+    self.goCommand = goCommand
+    self.positionCommand = positionCommand
+    self.onInfo = onInfo
+    self.pondering = ponder
+    self.stopRequested = False
+    self.future = concurrent.futures.Future()
+    self.info = {}
+    self.infos = []
+
+  def done(self):
+    return self.future.done()
+
+  def result(self, timeout=None):
+    return self.future.result(timeout)
+
+  '''
+  Ask the engine to stop, it still answers with a bestmove
+  '''
+  def stop(self):
+    self.stopRequested = True
+    self.engine.runSoon(self.engine.stopSearch(self))
+
+  '''
+  The opponent played the move we were pondering on, carry on with a normal search
+  '''
+  def ponderhit(self):
+    self.pondering = False
+    self.engine.runSoon(self.engine.sendIfCurrent(self, 'ponderhit'))
+
+  def addInfo(self, info):
+    self.info = info
+    self.infos.append(info)
+    if self.onInfo is not None:
+      self.onInfo(info)
+
+
+class UCIEngine():
+  def __init__(self, command, options=None):
+    self.command = [command] if isinstance(command, str) else list(command)
+    self.options = dict(options or {}) # sent with setoption when the engine starts
+    self.loop = eventLoop()
+    self.process = None
+    self.readerTask = None
+    self.name = None # from 'id name'
+    self.engineOptions = [] # option names the engine told us about
+    self.search = None # the UCISearch the engine is working on
+    self.waiting = {} # 'uciok'/'readyok': asyncio future waiting for that line
+    self.searchLock = None # asyncio lock so go commands run one after the other
+
+  '''
+  Run a coroutine on the loop thread and wait for its result (raises UCIError after timeout seconds)
+  '''
+  def call(self, coroutine, timeout=None):
+    try:
+      return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+    except concurrent.futures.TimeoutError:
+      raise UCIError('No answer from ' + ' '.join(self.command) + ' in ' + str(timeout) + 's')
+
+  def runSoon(self, coroutine): # run a coroutine on the loop thread without waiting for it
+    return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+  '''
+  Start the engine process and set it up (uci, the options, isready). Blocks until it is ready
+  '''
+  def start(self, timeout=10):
+    self.call(self.startAsync(), timeout)
+
+  async def startAsync(self):
+    try:
+      self.process = await asyncio.create_subprocess_exec(*self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                                          stderr=subprocess.DEVNULL)
+    except OSError as e:
+      raise UCIError("Couldn't start " + ' '.join(self.command) + ': ' + str(e))
+    self.searchLock = asyncio.Lock()
+    self.readerTask = self.loop.create_task(self.readLines())
+    await self.waitFor('uci', 'uciok')
+    for name, value in self.options.items():
+      self.send('setoption name ' + str(name) + ' value ' + str(value))
+    await self.waitFor('isready', 'readyok')
+
+  def isRunning(self):
+    return self.process is not None and self.process.returncode is None
+
+  def send(self, line):
+    if not self.isRunning():
+      raise UCIError(' '.join(self.command) + ' is not running')
+    self.process.stdin.write((line + '\n').encode())
+
+  async def waitFor(self, command, answer):
+    future = self.waiting.get(answer)
+    if future is None:
+      future = self.waiting[answer] = self.loop.create_future()
+    self.send(command)
+    try:
+      return await future
+    finally:
+      self.waiting.pop(answer, None)
+
+  '''
+  Reads everything the engine writes and hands it to whoever is waiting for it
+  '''
+  async def readLines(self):
+    while True:
+      line = await self.process.stdout.readline()
+      if not line: # the engine quit or crashed
+        break
+      line = line.decode(errors='replace').strip()
+      command = line.split(' ', 1)[0]
+      if command in ('uciok', 'readyok'):
+        future = self.waiting.get(command)
+        if future is not None and not future.done():
+          future.set_result(True)
+      elif command == 'info':
+        if self.search is not None:
+          self.search.addInfo(parseInfo(line))
+      elif command == 'bestmove':
+        tokens = line.split()
+        bestMove = tokens[1] if len(tokens) > 1 and tokens[1] != '(none)' else None
+        ponderMove = tokens[3] if len(tokens) > 3 and tokens[2] == 'ponder' else None
+        search, self.search = self.search, None
+        if search is not None and not search.future.done():
+          search.future.set_result((bestMove, ponderMove))
+      elif line.startswith('id name '):
+        self.name = line[8:]
+      elif line.startswith('option name '):
+        self.engineOptions.append(line[12:].split(' type ')[0])
+    await self.process.wait()
+    error = UCIError(' '.join(self.command) + ' exited with code ' + str(self.process.returncode))
+    for future in self.waiting.values():
+      if not future.done():
+        future.set_exception(error)
+    if self.search is not None and not self.search.future.done():
+      self.search.future.set_exception(error)
+    self.search = None
+
+  '''
+  Start a search and return its UCISearch straight away. The position is fen (the start position if None) plus the
+  moves in long algebraic notation (e2e4, e7e8q). Limits are given as keywords: depth, nodes, movetime (ms), wtime,
+  btime, winc, binc, movestogo, mate or infinite=True. With ponder=True the engine thinks on the opponent's time until
+  ponderhit() or stop(). If another search is running it is stopped first
+  '''
+  def go(self, fen=None, moves=(), onInfo=None, ponder=False, infinite=False, **limits):
+    position = 'position ' + ('startpos' if fen is None else 'fen ' + fen)
+    if moves:
+      position += ' moves ' + ' '.join(moves)
+    goCommand = 'go'
+    if ponder:
+      goCommand += ' ponder'
+    if infinite:
+      goCommand += ' infinite'
+    for name, value in limits.items():
+      if name not in GO_LIMITS:
+        raise ValueError("Unknown go limit '" + name + "'")
+      if value is not None:
+        goCommand += ' ' + name + ' ' + str(int(value))
+    search = UCISearch(self, goCommand, position, onInfo, ponder)
+    self.runSoon(self.startSearch(search))
+    return search
+
+  async def startSearch(self, search):
+    async with self.searchLock: # one search at a time, the engine can only answer one go
+      try:
+        previous = self.search
+        if previous is not None:
+          self.send('stop')
+          await asyncio.wrap_future(previous.future)
+        self.search = search
+        self.send(search.positionCommand)
+        self.send(search.goCommand)
+        if search.stopRequested: # stop() was called before the search got going
+          self.send('stop')
+      except Exception as e:
+        self.search = None if self.search is search else self.search
+        if not search.future.done():
+          search.future.set_exception(e if isinstance(e, UCIError) else UCIError(str(e)))
+
+  async def stopSearch(self, search):
+    if self.search is search and self.isRunning():
+      self.send('stop')
+
+  async def sendIfCurrent(self, search, line):
+    if self.search is search and self.isRunning():
+      self.send(line)
+
+  '''
+  Stop whatever the engine is doing and wait for its bestmove
+  '''
+  def stop(self, timeout=10):
+    search = self.search
+    if search is not None:
+      search.stop()
+      try:
+        search.result(timeout)
+      except UCIError:
+        pass
+
+  '''
+  Change options on the running engine (and remember them for restarts)
+  '''
+  def setOptions(self, options):
+    self.options.update(options)
+    self.call(self.setOptionsAsync(options), 10)
+
+  async def setOptionsAsync(self, options):
+    for name, value in options.items():
+      self.send('setoption name ' + str(name) + ' value ' + str(value))
+    await self.waitFor('isready', 'readyok')
+
+  '''
+  Check the engine still answers, returns True if it said readyok within timeout seconds
+  '''
+  def isReady(self, timeout=5):
+    if not self.isRunning():
+      return False
+    try:
+      self.call(self.waitFor('isready', 'readyok'), timeout)
+      return True
+    except UCIError:
+      return False
+
+  def newGame(self, timeout=10):
+    self.stop(timeout)
+    self.call(self.newGameAsync(), timeout)
+
+  async def newGameAsync(self):
+    self.send('ucinewgame')
+    await self.waitFor('isready', 'readyok')
+
+  '''
+  Ask the engine to quit, kill it if it hasn't after timeout seconds
+  '''
+  def quit(self, timeout=5):
+    if self.process is None:
+      return
+    try:
+      self.call(self.quitAsync(), timeout)
+    except UCIError:
+      self.process.kill()
+    self.process = None
+
+  async def quitAsync(self):
+    if self.isRunning():
+      self.send('quit')
+      await self.process.wait()
+    if self.readerTask is not None:
+      await self.readerTask
@@ -1,9 +1,24 @@
-from stockfish import Stockfish
+import concurrent.futures
+import os
+import shutil
+import threading
+import time
+import ChessBook
+import ChessCache
+import ChessEngine
+import ChessLimits
+import ChessProfile
+import ChessUCI
 
 '''
-Set the parameters for the Stockfish engine.
+Set the parameters for the Stockfish engine. The engine is found on the PATH as stockfish, or set STOCKFISH_PATH
 '''
-stockfish = Stockfish(parameters={
+STOCKFISH_PATH = os.environ.get('STOCKFISH_PATH', 'stockfish')
+LIMITS = ChessLimits.SearchLimits(depth=15, movetime=3000) # movetime is the most a move may take
+PONDER = True # think on the player's time too
+BOOK_DEPTH = 30 # play from the opening book (ChessBook) for this many half moves
+USE_CACHE = True # remember the engine's moves on disk (ChessCache) and reuse them for the same position and settings
+engine = ChessUCI.UCIEngine(STOCKFISH_PATH, {
     "Debug Log File": "",
     "Contempt": 0,
     "Min Split Depth": 0,
@@ -18,22 +33,189 @@ stockfish = Stockfish(parameters={
     "UCI_Chess960": "false",
     "UCI_LimitStrength": "false",
     "UCI_Elo": 3000
-}, depth=15)
+}) # started by warmUp on a background thread, not on import
+
+moves = [] # the game so far in long algebraic notation, sent with every search
+gameState = ChessEngine.GameState() # the same game, for looking positions up in the book
+pondering = None # (ponder move, UCISearch) while the engine thinks on the player's time
+thinking = None # the search for the engine's next move
+thinkingSince = 0.0
+thinkingArguments = None # the go arguments of thinking, part of the key its move is cached under
+searchSeconds = [0.0, 0] # total time and number of searches, the average is what a book move saves
+timeManager = ChessLimits.TimeManager()
+warmUpThread = None
+warmUpLock = threading.Lock()
+warmUpError = None # the UCIError if the engine didn't start
+pendingOptions = {} # options set before the engine was ready, sent by getEngine
+startup = {'began': None, 'readySeconds': None, 'waitedSeconds': 0.0} # when warmUp started, how long until readyok, how long moves waited for it
 
 '''
 Functions for the ChickenStock AI.
 '''
 
+'''
+Whether the Stockfish binary can be found, so warming it up is worth it
+'''
+def available():
+    return shutil.which(STOCKFISH_PATH) is not None
+
+'''
+Start Stockfish on a background thread: uci, the options (Hash is allocated here, which takes a while for a big
+one) and isready. Call it as early as possible, e.g. while the player picks a level, and the engine is ready by the
+time the first move is needed. Calling it again does nothing
+'''
+def warmUp():
+    global warmUpThread
+    with warmUpLock:
+        if warmUpThread is None:
+            startup['began'] = time.perf_counter()
+            warmUpThread = threading.Thread(target=startEngine, name='stockfish-warmup', daemon=True)
+            warmUpThread.start()
+    return warmUpThread
+
+def startEngine():
+    global warmUpError
+    try:
+        engine.start()
+    except ChessUCI.UCIError as e:
+        warmUpError = e
+    startup['readySeconds'] = time.perf_counter() - startup['began']
+    ChessProfile.record('ChickenStock.warmUp', startup['readySeconds'], startup['began'])
+
+'''
+The running engine. Starts it if warmUp hasn't, waits for it to be ready and raises the UCIError if it didn't start
+'''
+def getEngine():
+    thread = warmUp()
+    if thread.is_alive():
+        began = time.perf_counter()
+        thread.join()
+        startup['waitedSeconds'] += time.perf_counter() - began
+    if warmUpError is not None:
+        raise warmUpError
+    if pendingOptions:
+        options = dict(pendingOptions)
+        pendingOptions.clear()
+        engine.setOptions(options)
+    return engine
+
+'''
+Set engine options without waiting for the engine, they are sent once it is ready
+'''
+def setOptions(options):
+    pendingOptions.update(options)
+
+'''
+Quit the engine (waiting for the warm-up first), e.g. when a level without Stockfish was picked after all
+'''
+def shutdown():
+    global warmUpThread, warmUpError
+    with warmUpLock:
+        thread, warmUpThread = warmUpThread, None
+    if thread is not None:
+        thread.join()
+        engine.quit()
+    warmUpError = None
+
 def stockfishInit():
-    stockfish.set_position()
+    global gameState, pondering, thinking
+    pondering = None
+    thinking = None
+    moves.clear()
+    gameState = ChessEngine.GameState()
+    if warmUpThread is not None: # nothing to reset in an engine that was never started
+        getEngine().newGame() # stops any search that is still running
+
+def newGame(): # same name as in ChessAI so ChessMain can reset either one
+    stockfishInit()
 
 def addMove(move):
-    stockfish.make_moves_from_current_position([move])
+    global pondering, thinking, thinkingSince, thinkingArguments
+    moves.append(move)
+    for validMove in gameState.getValidMoves():
+        if validMove.getChessNotation() == move:
+            gameState.makeMove(validMove)
+            break
+    if pondering is not None:
+        ponderMove, search = pondering
+        pondering = None
+        if move == ponderMove: # guessed right, the ponder search becomes the real one
+            search.ponderhit()
+            thinking = search
+            thinkingSince = time.perf_counter()
+            thinkingArguments = LIMITS.goArguments() # what the ponder search was started with
+        else:
+            search.stop()
+
+'''
+What a cached move depends on besides the position: the engine, its strength options and the go arguments the
+search was given (the movetime the time manager picked, not just LIMITS), so a short search is never reused as a
+full one
+'''
+def cacheSettings(arguments):
+    options = dict(engine.options, **pendingOptions) # what the engine is (or will be) set to, without waiting for it
+    settings = {'engine': STOCKFISH_PATH, 'Skill Level': options.get('Skill Level'),
+                'UCI_LimitStrength': options.get('UCI_LimitStrength'), 'UCI_Elo': options.get('UCI_Elo')}
+    settings.update(arguments)
+    return settings
 
+def doneFuture(move): # a future that already has the result, like a finished UCISearch
+    future = concurrent.futures.Future()
+    future.set_result((move, None))
+    return future
 
-def getAIMove(validMoves):
-    move = stockfish.get_best_move()
-    stockfish.make_moves_from_current_position([move])
+'''
+The go arguments for the engine's next move. The time manager picks the movetime for this position (short for a
+forced move or a recapture, longer in check), within LIMITS
+'''
+def goArguments():
+    soft, hard = timeManager.allocate(gameState, LIMITS)
+    if soft is None: # depth or nodes only
+        return LIMITS.goArguments()
+    return LIMITS.copy(movetime=max(1, int(soft * 1000)), wtime=None, btime=None, winc=0, binc=0,
+                       movestogo=None).goArguments()
+
+'''
+Start the search for the engine's move without waiting for it. Returns a UCISearch, poll done() and then pass it
+to finishAIMove
+'''
+def startAIMove():
+    global thinking, thinkingSince, thinkingArguments
+    if thinking is None: # not already searching after a ponderhit
+        book = ChessBook.openBook()
+        if book is not None:
+            averageSeconds = searchSeconds[0] / searchSeconds[1] if searchSeconds[1] else 0.0
+            bookMove = book.bookMove(gameState, gameState.getValidMoves(), BOOK_DEPTH, searchSeconds=averageSeconds)
+            if bookMove is not None: # no need to ask the engine, hand back a future that is already done
+                return doneFuture(bookMove.getChessNotation())
+        arguments = goArguments()
+        if USE_CACHE:
+            cached = ChessCache.openCache().get(gameState, cacheSettings(arguments))
+            if cached is not None:
+                return doneFuture(cached[0])
+        searchEngine = getEngine() # only a real search waits for the engine to be ready
+        thinkingSince = time.perf_counter()
+        thinkingArguments = arguments
+        thinking = searchEngine.go(moves=moves, **arguments)
+    return thinking
+
+def finishAIMove(search, validMoves):
+    global pondering, thinking
+    move, ponderMove = search.result()
+    if search is thinking:
+        searchSeconds[0] += time.perf_counter() - thinkingSince
+        searchSeconds[1] += 1
+        ChessProfile.record('ChickenStock.search', time.perf_counter() - thinkingSince, thinkingSince) # the engine round trip
+        thinking = None
+        if USE_CACHE and move is not None:
+            ChessCache.openCache().put(gameState, cacheSettings(thinkingArguments), move, ChessCache.scoreText(search.info), search.info.get('depth'))
+    addMove(move)
+    if PONDER and ponderMove is not None:
+        pondering = (ponderMove, getEngine().go(moves=moves + [ponderMove], ponder=True, **LIMITS.goArguments()))
     for temp_move in validMoves:
         if temp_move.getChessNotation() == move:
-            return temp_move
\ No newline at end of file
+            return temp_move
+
+@ChessProfile.profiled('ChickenStock.getAIMove')
+def getAIMove(validMoves):
+    return finishAIMove(startAIMove(), validMoves)
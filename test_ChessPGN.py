@@ -0,0 +1,44 @@
+'''
+ChessPGN's SAN reading, run with python -m pytest
+'''
+import pytest
+import ChessEngine
+import ChessPGN
+
+OPEN_CENTER = 'rnbqkbnr/ppp1pppp/8/3p4/4P3/8/PPPP1PPP/RNBQKBNR w KQkq d6 0 2' # 1. e4 d5
+ENPASSANT = 'rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3'
+
+
+@pytest.mark.parametrize('withLegalMoves', [False, True])
+@pytest.mark.parametrize('fen, san, expected', [
+  (OPEN_CENTER, 'exd5', 'e4d5'),
+  (OPEN_CENTER, 'e5', 'e4e5'),
+  (OPEN_CENTER, 'Nf3', 'g1f3'),
+  (OPEN_CENTER, 'Qh5+', 'd1h5'),
+  (ENPASSANT, 'exf6', 'e5f6'),
+  (ENPASSANT, 'e6', 'e5e6'),
+])
+def testParseSAN(fen, san, expected, withLegalMoves):
+  gs = ChessEngine.GameState(fen)
+  move = ChessPGN.parseSAN(gs, san, gs.getLegalMoves() if withLegalMoves else None)
+  assert move.getChessNotation() == expected
+  assert ChessPGN.toSAN(gs, move).rstrip('+#') == san.rstrip('+#')
+
+
+@pytest.mark.parametrize('withLegalMoves', [False, True])
+@pytest.mark.parametrize('fen, san', [
+  (OPEN_CENTER, 'd5'), # only a capture gets there
+  (OPEN_CENTER, 'ed5'), # a pawn capture needs its x
+  (OPEN_CENTER, 'xd5'),
+  (OPEN_CENTER, 'exe5'), # a pawn push with a file
+  (OPEN_CENTER, 'Nxf3'), # nothing to capture
+  (OPEN_CENTER, 'Ke3'),
+  (ENPASSANT, 'ef6'),
+  (ENPASSANT, 'f6'),
+  ('7k/P7/8/8/8/8/8/K7 w - - 0 1', 'a8=N'),
+  ('k7/8/8/8/8/8/8/KN3N2 w - - 0 1', 'Nd2'),
+])
+def testParseSANRejects(fen, san, withLegalMoves):
+  gs = ChessEngine.GameState(fen)
+  with pytest.raises(ChessPGN.PGNError):
+    ChessPGN.parseSAN(gs, san, gs.getLegalMoves() if withLegalMoves else None)
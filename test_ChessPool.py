@@ -0,0 +1,147 @@
+'''
+ChessPool.EnginePool against the small UCI engine in ChessAI.py (python ChessAI.py), run with python -m pytest
+'''
+import os
+import signal
+import sys
+import time
+import pytest
+import ChessCache
+import ChessEngine
+import ChessPool
+
+STAND_IN = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ChessAI.py')]
+FENS = ['r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+        'r1bqk2r/pppp1ppp/2n2n2/2b1p3/2B1P3/3P1N2/PPP2PPP/RNBQK2R w KQkq - 1 5',
+        '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+        '6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1',
+        '4k3/8/8/8/8/8/4P3/4K3 w - - 0 1',
+        'r5k1/5ppp/8/8/8/8/5PPP/3Q2K1 b - - 0 1']
+
+
+@pytest.fixture
+def pool():
+  pool = ChessPool.EnginePool(STAND_IN, size=2, hashMB=8, threads=3)
+  yield pool
+  pool.close()
+
+
+def isLegal(fen, bestMove, moves=()):
+  gs = ChessEngine.GameState(fen)
+  for played in moves:
+    gs.makeMove(next(move for move in gs.getValidMoves() if move.getChessNotation() == played))
+  return any(move.getChessNotation() == bestMove for move in gs.getValidMoves())
+
+
+def waitFor(condition, seconds=10):
+  end = time.perf_counter() + seconds
+  while not condition():
+    assert time.perf_counter() < end, 'timed out'
+    time.sleep(0.01)
+
+
+def testSubmitConcurrently(pool):
+  futures = [pool.submit(fen=fen, depth=2) for fen in FENS]
+  results = [future.result(timeout=60) for future in futures]
+  for fen, result in zip(FENS, results):
+    assert isLegal(fen, result['bestmove'])
+    assert 1 <= result['info']['depth'] <= 2 and not result['cached'] # a forced mate ends the search early
+  assert {result['worker'] for result in results} <= {0, 1}
+  stats = pool.stats()
+  assert sum(worker['jobs'] for worker in stats.values()) == len(FENS)
+  assert all(worker['errors'] == 0 for worker in stats.values())
+
+
+def testAnalyse(pool):
+  results = pool.analyse(FENS[:3] + [(None, ['e2e4', 'e7e5'])], depth=2)
+  assert [isLegal(fen, result['bestmove']) for fen, result in zip(FENS[:3], results)] == [True] * 3
+  assert isLegal(None, results[3]['bestmove'], ['e2e4', 'e7e5'])
+
+
+def testWorkerOptions(pool):
+  for worker in pool.workers: # every worker's own engine was started with the pool's Hash and Threads
+    with worker.lock:
+      search = worker.engine.go(depth=1)
+      search.result(timeout=30)
+    assert search.infos[0] == {'string': 'hash 8 threads 3'}
+
+
+def testCheckHealth(pool):
+  assert pool.checkHealth() == {0: True, 1: True}
+  victim = pool.workers[1]
+  victim.engine.process.send_signal(signal.SIGKILL)
+  waitFor(lambda: not victim.engine.isRunning())
+  assert pool.checkHealth() == {0: True, 1: False} # found dead and restarted
+  assert victim.restarts == 1 and victim.engine.isRunning()
+  assert pool.checkHealth() == {0: True, 1: True}
+  assert isLegal(FENS[0], pool.submit(fen=FENS[0], depth=1).result(timeout=60)['bestmove'])
+
+
+def testRestartAndRetryAfterKill():
+  pool = ChessPool.EnginePool(STAND_IN, size=1, hashMB=8)
+  try:
+    worker = pool.workers[0]
+    future = pool.submit(fen=FENS[0], depth=64, movetime=1500)
+    waitFor(lambda: worker.lock.locked() and worker.engine.search is not None) # the job is being searched
+    process = worker.engine.process
+    process.send_signal(signal.SIGKILL)
+    result = future.result(timeout=60) # retried on a fresh engine
+    assert isLegal(FENS[0], result['bestmove'])
+    assert worker.errors == 1 and worker.restarts == 1
+    assert worker.engine.process is not process and worker.engine.isRunning()
+  finally:
+    pool.close()
+
+
+def testRetriesRunOut():
+  pool = ChessPool.EnginePool(STAND_IN, size=1, hashMB=8, retries=0)
+  try:
+    worker = pool.workers[0]
+    future = pool.submit(depth=64, movetime=1500)
+    waitFor(lambda: worker.lock.locked() and worker.engine.search is not None)
+    worker.engine.process.send_signal(signal.SIGKILL)
+    with pytest.raises(ChessPool.ChessUCI.UCIError):
+      future.result(timeout=60)
+    assert pool.submit(depth=1).result(timeout=60)['bestmove'] is not None # the worker was restarted for the next job
+  finally:
+    pool.close()
+
+
+def testCache(tmp_path):
+  pool = ChessPool.EnginePool(STAND_IN, size=1, hashMB=8, cache=ChessCache.AnalysisCache(str(tmp_path / 'cache.sqlite')))
+  try:
+    first = pool.submit(fen=FENS[3], depth=2).result(timeout=60)
+    second = pool.submit(fen=FENS[3], depth=2).result(timeout=60)
+    assert not first['cached'] and second['cached']
+    assert second['bestmove'] == first['bestmove']
+    assert not pool.submit(fen=FENS[3], depth=3).result(timeout=60)['cached'] # other limits, searched again
+  finally:
+    pool.close()
+
+
+def testIdleWorkersCheckThemselves():
+  pool = ChessPool.EnginePool(STAND_IN, size=1, hashMB=8, healthInterval=0.2)
+  try:
+    worker = pool.workers[0]
+    worker.engine.process.send_signal(signal.SIGKILL)
+    waitFor(lambda: worker.restarts == 1 and worker.engine is not None and worker.engine.isRunning())
+    assert isLegal(FENS[0], pool.submit(fen=FENS[0], depth=1).result(timeout=60)['bestmove'])
+    assert worker.errors == 0 # the job never saw the dead engine
+  finally:
+    pool.close()
+
+
+def testFailedStartQuitsStartedEngines(tmp_path):
+  # the first engine starts, the second one exits straight away
+  script = tmp_path / 'once.py'
+  script.write_text('import os, sys\n'
+                    'pids = %r\n'
+                    'if os.path.exists(pids):\n'
+                    '  sys.exit(1)\n'
+                    'open(pids, "w").write(str(os.getpid()))\n'
+                    'os.execv(sys.executable, [sys.executable, %r])\n' % (str(tmp_path / 'pid'), STAND_IN[1]))
+  with pytest.raises(ChessPool.ChessUCI.UCIError):
+    ChessPool.EnginePool([sys.executable, str(script)], size=2, hashMB=8)
+  pid = int((tmp_path / 'pid').read_text())
+  with pytest.raises(ProcessLookupError): # the engine that did start was quit
+    os.kill(pid, 0)
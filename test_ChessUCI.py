@@ -0,0 +1,109 @@
+'''
+ChessUCI against the small UCI engine in ChessAI.py (python ChessAI.py), run with python -m pytest
+'''
+import os
+import sys
+import time
+import pytest
+import ChessEngine
+import ChessUCI
+
+STAND_IN = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ChessAI.py')]
+
+
+@pytest.fixture
+def engine():
+  engine = ChessUCI.UCIEngine(STAND_IN, {'Hash': 8})
+  engine.start()
+  yield engine
+  engine.quit()
+
+
+def isLegal(bestMove, moves=()):
+  gs = ChessEngine.GameState()
+  for move in moves:
+    gs.makeMove(next(m for m in gs.getValidMoves() if m.getChessNotation() == move))
+  return any(move.getChessNotation() == bestMove for move in gs.getValidMoves())
+
+
+def testParseInfo():
+  assert ChessUCI.parseInfo('info depth 12 score cp 31 nodes 20451 pv e2e4 e7e5') == \
+         {'depth': 12, 'score': {'cp': 31}, 'nodes': 20451, 'pv': ['e2e4', 'e7e5']}
+  info = ChessUCI.parseInfo('info depth 20 seldepth 25 score mate -3 lowerbound currmove g1f3 string hello there')
+  assert info['score'] == {'mate': -3, 'lowerbound': True}
+  assert info['currmove'] == 'g1f3' and info['string'] == 'hello there'
+
+
+def testStart(engine):
+  assert engine.name == 'ChessAI'
+  assert 'Hash' in engine.engineOptions
+  assert engine.isReady()
+
+
+def testGoDepth(engine):
+  streamed = []
+  search = engine.go(moves=['e2e4', 'e7e5'], onInfo=streamed.append, depth=3)
+  bestMove, ponderMove = search.result(timeout=30)
+  assert isLegal(bestMove, ['e2e4', 'e7e5'])
+  assert search.infos[0] == {'string': 'hash 8 threads 1'} # the options sent at start reached the engine
+  assert [info['depth'] for info in search.infos[1:]] == [1, 2, 3]
+  assert streamed == search.infos # every info line went to onInfo as it arrived
+  assert search.info['pv'][0] == bestMove and 'cp' in search.info['score']
+  assert ponderMove is None or isLegal(ponderMove, ['e2e4', 'e7e5', bestMove])
+
+
+def testGoMovetime(engine):
+  began = time.perf_counter()
+  search = engine.go(depth=64, movetime=300)
+  bestMove, ponderMove = search.result(timeout=30)
+  assert isLegal(bestMove)
+  assert time.perf_counter() - began < 3
+
+
+def testGoFen(engine):
+  search = engine.go(fen='6k1/5ppp/8/8/8/8/8/K2R4 w - - 0 1', depth=3) # back rank mate in one
+  assert search.result(timeout=30)[0] == 'd1d8'
+  assert search.info['score'] == {'mate': 1}
+
+
+def testInfiniteAndStop(engine):
+  search = engine.go(infinite=True)
+  time.sleep(0.5)
+  assert not search.done() # an infinite search only answers after stop
+  search.stop()
+  bestMove, ponderMove = search.result(timeout=30)
+  assert isLegal(bestMove)
+  assert search.stopRequested
+
+
+def testPonderAndPonderhit(engine):
+  search = engine.go(moves=['e2e4'], ponder=True, depth=64, movetime=300)
+  time.sleep(0.8)
+  assert not search.done() # the clock doesn't run while pondering
+  began = time.perf_counter()
+  search.ponderhit()
+  bestMove, ponderMove = search.result(timeout=30)
+  assert isLegal(bestMove, ['e2e4'])
+  assert time.perf_counter() - began < 3 # ponderhit started the movetime
+
+
+def testPonderStop(engine):
+  search = engine.go(moves=['e2e4'], ponder=True, depth=64)
+  time.sleep(0.3)
+  search.stop() # the player made another move
+  assert isLegal(search.result(timeout=30)[0], ['e2e4'])
+  assert isLegal(engine.go(depth=2).result(timeout=30)[0]) # and the engine still searches normally
+
+
+def testNewGameAndOptions(engine):
+  engine.setOptions({'Hash': 4})
+  assert engine.options['Hash'] == 4
+  engine.newGame()
+  assert isLegal(engine.go(depth=2).result(timeout=30)[0])
+
+
+def testEngineExit():
+  engine = ChessUCI.UCIEngine([sys.executable, '-c', 'print("uciok")'])
+  with pytest.raises(ChessUCI.UCIError):
+    engine.start(timeout=10) # exits before readyok
+  engine.quit()